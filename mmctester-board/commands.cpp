@@ -7,6 +7,25 @@
 #define COMMAND_DIG_READ 0x03
 #define COMMAND_AN_WRITE 0x04
 #define COMMAND_AN_READ 0x05
+#define COMMAND_SET_FRAMING 0x06
+#define COMMAND_SET_SCAN 0x07
+#define COMMAND_BATCH 0x08
+#define COMMAND_SET_CAPTURE 0x09
+
+#define NETFN_SENSOR_EVENT 0x04
+#define CMD_GET_SENSOR_READING 0x2d
+
+uint8_t framing = FRAMING_HEX;
+struct scan_entry scan_entries[MAX_SCAN_ENTRIES];
+uint8_t scan_count = 0;
+uint16_t scan_period_ms = 0;
+struct capture_config capture;
+// ring of blocks, the one at capture_head is being filled
+uint8_t capture_blocks[CAPTURE_BLOCKS][CAPTURE_BLOCK_SIZE];
+uint8_t capture_block_nbytes[CAPTURE_BLOCKS];
+uint8_t capture_head = 0;
+uint8_t capture_tail = 0;
+uint8_t capture_sequence = 0;
 
 
 // byte 0: pin number
@@ -76,6 +95,302 @@ static size_t an_read_command(uint8_t *buffer, size_t nbytes, uint8_t *reply)
     return 3;
 }
 
+// byte 0: framing (FRAMING_HEX = 0, FRAMING_BINARY = 1)
+// the reply is sent with the previous framing
+static size_t set_framing_command(uint8_t *buffer, size_t nbytes, uint8_t *reply)
+{
+    if (nbytes != 1 || buffer[0] > FRAMING_BINARY) {
+        reply[0] = ERR_INVALID_FORMAT;
+        return 1;
+    }
+    framing = buffer[0];
+    reply[0] = OK;
+    return 1;
+}
+
+
+// byte 0-1: period in ms between the start of two sweeps, LSB first
+// byte 2..: target address, sensor number and LUN of each sensor, up to
+// MAX_SCAN_ENTRIES, no sensors stops the scan
+static size_t set_scan_command(uint8_t *buffer, size_t nbytes, uint8_t *reply)
+{
+    if (nbytes < 2 || (nbytes - 2) % 3 ||
+            (nbytes - 2) / 3 > MAX_SCAN_ENTRIES) {
+        reply[0] = ERR_INVALID_FORMAT;
+        return 1;
+    }
+    scan_count = 0;
+    scan_period_ms = buffer[0] | (buffer[1] << 8);
+    for (size_t i = 2; i < nbytes; i += 3) {
+        scan_entries[scan_count].target = buffer[i];
+        scan_entries[scan_count].sensor = buffer[i + 1];
+        scan_entries[scan_count].lun = buffer[i + 2] & 0x03;
+        scan_count++;
+    }
+    reply[0] = OK;
+    return 1;
+}
+
+
+// batch command, runs several pin commands and replies with their results
+// concatenated, all of them are checked before any runs
+// <COMMAND_BATCH> <command> <args ...> <command> <args ...> ...
+// replies <OK> <results ...>, digital read gives 1 byte and analog read 2
+// bytes LSB first, the other commands none
+// what is left of a binary message after LOCAL_ADDR, the command byte and
+// OK
+#define MAX_BATCH_RESULTS 29
+
+struct batch_op {
+    uint8_t command_byte;
+    uint8_t nargs;
+    uint8_t nresults;
+} batch_ops[] = {
+    {COMMAND_PIN_MODE, 2, 0},
+    {COMMAND_DIG_WRITE, 2, 0},
+    {COMMAND_DIG_READ, 1, 1},
+    {COMMAND_AN_WRITE, 2, 0},
+    {COMMAND_AN_READ, 1, 2},
+    {0, 0, 0}
+};
+
+
+static struct batch_op *find_batch_op(uint8_t command_byte)
+{
+    for (size_t i = 0; batch_ops[i].command_byte; i++) {
+        if (batch_ops[i].command_byte == command_byte)
+            return &batch_ops[i];
+    }
+    return NULL;
+}
+
+
+// byte 0..: command byte and arguments of each pin command
+// nothing runs if a command is not a pin command, lacks arguments or the
+// results do not fit in a reply
+static size_t batch_command(uint8_t *buffer, size_t nbytes, uint8_t *reply)
+{
+    size_t nresults = 0;
+    for (size_t i = 0; i < nbytes; ) {
+        struct batch_op *op = find_batch_op(buffer[i]);
+        if (!op || i + 1 + op->nargs > nbytes) {
+            reply[0] = ERR_INVALID_FORMAT;
+            return 1;
+        }
+        nresults += op->nresults;
+        i += 1 + op->nargs;
+    }
+    if (nresults > MAX_BATCH_RESULTS) {
+        reply[0] = ERR_TOO_LONG;
+        return 1;
+    }
+
+    uint8_t op_reply[4];
+    size_t n = 1;
+    for (size_t i = 0; i < nbytes; ) {
+        struct batch_op *op = find_batch_op(buffer[i]);
+        // the reply of a single command is <command> <OK> <results ...>
+        execute_command(buffer + i, 1 + op->nargs, op_reply);
+        for (size_t j = 0; j < op->nresults; j++)
+            reply[n++] = op_reply[2 + j];
+        i += 1 + op->nargs;
+    }
+    reply[0] = OK;
+    return n;
+}
+
+
+// byte 0-1: period in us between two samples, LSB first
+// byte 2-3: number of samples, LSB first, 0 stops the capture
+// byte 4: trigger pin
+// byte 5: trigger (TRIGGER_NONE = 0, TRIGGER_RISING = 1, TRIGGER_FALLING = 2)
+// byte 6..: pins, up to MAX_CAPTURE_PINS, CAPTURE_ANALOG set for analog
+static size_t set_capture_command(uint8_t *buffer, size_t nbytes,
+                                  uint8_t *reply)
+{
+    if (nbytes < 6 || nbytes - 6 > MAX_CAPTURE_PINS ||
+            buffer[5] > TRIGGER_FALLING) {
+        reply[0] = ERR_INVALID_FORMAT;
+        return 1;
+    }
+    uint16_t period_us = buffer[0] | (buffer[1] << 8);
+    uint16_t count = buffer[2] | (buffer[3] << 8);
+    if (count && (period_us == 0 || nbytes == 6)) {
+        reply[0] = ERR_INVALID_FORMAT;
+        return 1;
+    }
+    capture.period_us = period_us;
+    capture.remaining = count;
+    capture.npins = nbytes - 6;
+    for (size_t i = 0; i < capture.npins; i++)
+        capture.pins[i] = buffer[6 + i];
+    capture.trigger_pin = buffer[4];
+    capture.trigger_mode = buffer[5];
+    capture.triggered = capture.trigger_mode == TRIGGER_NONE;
+    if (!capture.triggered)
+        capture.trigger_level = digitalRead(capture.trigger_pin);
+    // blocks of a previous capture are dropped
+    capture_head = capture_tail = 0;
+    capture_block_nbytes[0] = 0;
+    capture_sequence = 0;
+    reply[0] = OK;
+    return 1;
+}
+
+
+// true once the trigger pin has changed as configured
+bool capture_trigger(void)
+{
+    if (capture.triggered)
+        return true;
+    uint8_t level = digitalRead(capture.trigger_pin);
+    if (level != capture.trigger_level)
+        capture.triggered = (level != 0) ==
+            (capture.trigger_mode == TRIGGER_RISING);
+    capture.trigger_level = level;
+    return capture.triggered;
+}
+
+
+static size_t capture_sample_size(void)
+{
+    size_t size = 0;
+    bool digital = false;
+    for (size_t i = 0; i < capture.npins; i++) {
+        if (capture.pins[i] & CAPTURE_ANALOG)
+            size += 2;
+        else
+            digital = true;
+    }
+    return digital ? size + 1 : size;
+}
+
+
+// the block being filled is queued for sending, or dropped if all the
+// others are still waiting
+void capture_break(void)
+{
+    if (capture_block_nbytes[capture_head] == 0)
+        return;
+    uint8_t next = (capture_head + 1) % CAPTURE_BLOCKS;
+    if (next == capture_tail) {
+        capture_block_nbytes[capture_head] = 0;
+        return;
+    }
+    capture_head = next;
+    capture_block_nbytes[capture_head] = 0;
+}
+
+
+// takes a sample of the pins, timestamp_us is the time it was due
+void capture_sample(uint32_t timestamp_us)
+{
+    uint8_t *block = capture_blocks[capture_head];
+    size_t n = capture_block_nbytes[capture_head];
+    if (n == 0) {
+        block[0] = CAPTURE_BLOCK;
+        block[1] = capture_sequence++;
+        for (size_t i = 0; i < 4; i++)
+            block[2 + i] = (timestamp_us >> (8 * i)) & 0xff;
+        n = CAPTURE_HEADER_SIZE;
+    }
+    uint8_t digital = 0;
+    uint8_t bit = 0;
+    bool has_digital = false;
+    for (size_t i = 0; i < capture.npins; i++) {
+        uint8_t pin = capture.pins[i];
+        if (pin & CAPTURE_ANALOG) {
+            int val = analogRead(pin & ~CAPTURE_ANALOG);
+            block[n++] = val & 0xff;
+            block[n++] = (val >> 8) & 0xff;
+        } else {
+            if (digitalRead(pin))
+                digital |= 1 << bit;
+            bit++;
+            has_digital = true;
+        }
+    }
+    if (has_digital)
+        block[n++] = digital;
+    capture_block_nbytes[capture_head] = n;
+    capture.remaining--;
+    if (capture.remaining == 0 ||
+            n + capture_sample_size() > CAPTURE_BLOCK_SIZE)
+        capture_break();
+}
+
+
+// the oldest block waiting to be sent, NULL if there is none
+uint8_t *capture_ready_block(size_t *nbytes)
+{
+    if (capture_tail == capture_head)
+        return NULL;
+    *nbytes = capture_block_nbytes[capture_tail];
+    return capture_blocks[capture_tail];
+}
+
+
+void capture_pop_block(void)
+{
+    if (capture_tail != capture_head)
+        capture_tail = (capture_tail + 1) % CAPTURE_BLOCKS;
+}
+
+
+static uint8_t ipmb_checksum(uint8_t *data, size_t nbytes)
+{
+    uint8_t sum = 0;
+    for (size_t i = 0; i < nbytes; i++)
+        sum += data[i];
+    return -sum;
+}
+
+
+// Get Sensor Reading request of a scan entry, in the format of the
+// messages received from serial: <responder address> <IPMB message ...>
+size_t scan_request(uint8_t index, uint8_t rq_sa, uint8_t *msg)
+{
+    struct scan_entry *entry = &scan_entries[index];
+    msg[0] = entry->target;
+    msg[1] = (NETFN_SENSOR_EVENT << 2) | entry->lun;
+    msg[2] = ipmb_checksum(msg, 2);
+    msg[3] = rq_sa;
+    msg[4] = (index << 2) | SCAN_RQ_LUN;
+    msg[5] = CMD_GET_SENSOR_READING;
+    msg[6] = entry->sensor;
+    msg[7] = ipmb_checksum(msg + 3, 4);
+    return SCAN_REQUEST_SIZE;
+}
+
+
+bool is_scan_response(uint8_t *msg, size_t nbytes)
+{
+    return nbytes >= 8 &&
+        msg[1] == (((NETFN_SENSOR_EVENT | 1) << 2) | SCAN_RQ_LUN) &&
+        msg[5] == CMD_GET_SENSOR_READING;
+}
+
+
+// turns a scan response into a result without LOCAL_ADDR, returns 0 if the
+// response is invalid or does not match the current entries
+size_t scan_result(uint8_t *msg, size_t nbytes, uint32_t timestamp,
+                   uint8_t *result)
+{
+    uint8_t index = msg[4] >> 2;
+    if (index >= scan_count || msg[3] != scan_entries[index].target ||
+            ipmb_checksum(msg, 3) || ipmb_checksum(msg + 3, nbytes - 3))
+        return 0;
+    result[0] = SCAN_RESULT;
+    result[1] = index;
+    result[2] = msg[6];
+    // reading, config and states, the checksum is not part of them
+    for (size_t i = 0; i < 4; i++)
+        result[3 + i] = 7 + i < nbytes - 1 ? msg[7 + i] : 0;
+    for (size_t i = 0; i < 4; i++)
+        result[7 + i] = (timestamp >> (8 * i)) & 0xff;
+    return SCAN_RESULT_SIZE;
+}
+
 
 struct command_entry {
     uint8_t command_byte;
@@ -86,6 +401,10 @@ struct command_entry {
     {COMMAND_DIG_READ, dig_read_command},
     {COMMAND_AN_WRITE, an_write_command},
     {COMMAND_AN_READ, an_read_command},
+    {COMMAND_SET_FRAMING, set_framing_command},
+    {COMMAND_SET_SCAN, set_scan_command},
+    {COMMAND_BATCH, batch_command},
+    {COMMAND_SET_CAPTURE, set_capture_command},
     {0, NULL}
 };
 
@@ -22,6 +22,86 @@
 #define ERR_NO_COMMAND 0x85
 #define ERR_TOO_LONG 0x86
 
+#define FRAMING_HEX 0x00
+#define FRAMING_BINARY 0x01
+
+// framing used for the serial messages, changed by the set framing command
+extern uint8_t framing;
+
+// sensor scan, the board reads the sensors itself and sends the results as
+// <LOCAL_ADDR> <SCAN_RESULT> <entry index> <completion code> <reading>
+// <reading config> <states 1> <states 2> <timestamp ms, 4 bytes, LSB first>
+#define SCAN_RESULT 0x90
+#define MAX_SCAN_ENTRIES 9
+// requester LUN of the scan requests, tells their responses apart from the
+// ones to the host, the entry index is used as sequence number
+#define SCAN_RQ_LUN 0x02
+#define SCAN_REQUEST_SIZE 8
+#define SCAN_RESULT_SIZE 11
+
+struct scan_entry {
+    uint8_t target;
+    uint8_t sensor;
+    uint8_t lun;
+};
+
+// entries and period set by the set scan command, no entries stops the scan
+extern struct scan_entry scan_entries[MAX_SCAN_ENTRIES];
+extern uint8_t scan_count;
+extern uint16_t scan_period_ms;
+
+// waveform capture, the board samples pins every period and sends the
+// samples in blocks as
+// <LOCAL_ADDR> <CAPTURE_BLOCK> <sequence> <timestamp us of the first
+// sample, 4 bytes, LSB first> <samples ...>
+// a sample is the value of each analog pin, 2 bytes LSB first, followed by
+// a byte with a bit per digital pin if there are any. The samples of a
+// block are evenly spaced, a block missed because the buffer was full
+// shows as a gap in the sequence
+#define CAPTURE_BLOCK 0x91
+#define MAX_CAPTURE_PINS 4
+// set in the pin byte of the set capture command for analog pins
+#define CAPTURE_ANALOG 0x80
+#define CAPTURE_HEADER_SIZE 6
+// a block fits in a binary message with LOCAL_ADDR
+#define CAPTURE_BLOCK_SIZE 31
+#define CAPTURE_BLOCKS 8
+#define TRIGGER_NONE 0x00
+#define TRIGGER_RISING 0x01
+#define TRIGGER_FALLING 0x02
+
+struct capture_config {
+    uint8_t pins[MAX_CAPTURE_PINS];
+    uint8_t npins;
+    uint16_t period_us;
+    // samples still to be taken, 0 when not capturing
+    uint16_t remaining;
+    uint8_t trigger_pin;
+    uint8_t trigger_mode;
+    uint8_t trigger_level;
+    bool triggered;
+};
+
+// set by the set capture command, a count of 0 stops the capture
+extern struct capture_config capture;
+
 size_t execute_command(uint8_t *buffer, size_t nbytes, uint8_t *reply);
 
+size_t scan_request(uint8_t index, uint8_t rq_sa, uint8_t *msg);
+
+bool is_scan_response(uint8_t *msg, size_t nbytes);
+
+size_t scan_result(uint8_t *msg, size_t nbytes, uint32_t timestamp,
+                   uint8_t *result);
+
+bool capture_trigger(void);
+
+void capture_sample(uint32_t timestamp_us);
+
+void capture_break(void);
+
+uint8_t *capture_ready_block(size_t *nbytes);
+
+void capture_pop_block(void);
+
 #endif
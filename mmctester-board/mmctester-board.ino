@@ -13,10 +13,24 @@
 #define MAX_SERIAL_MSG_SIZE (MAX_I2C_MSG_SIZE*3)
 #define SERIAL_BAUDRATE 115200
 #define MAX_IPMB_SEND_RETRIES 3
-#define TERMINATOR 10
+// several responses can arrive while one is being forwarded when the host
+// keeps more than one request in flight, one slot is kept free to tell a
+// full ring from an empty one
+#define I2C_RX_SLOTS 5
+// a scan goes on with the next sensor if a reading is not answered in time
+#define SCAN_RESPONSE_TIMEOUT_MS 50
 
-size_t i2c_nbytes = 0;
-uint8_t i2c_rx_buffer[MAX_I2C_MSG_SIZE];
+size_t i2c_nbytes[I2C_RX_SLOTS];
+uint8_t i2c_rx_buffer[I2C_RX_SLOTS][MAX_I2C_MSG_SIZE];
+volatile uint8_t i2c_rx_head = 0;
+volatile uint8_t i2c_rx_tail = 0;
+
+uint8_t scan_index = 0;
+bool scan_waiting = false;
+uint32_t scan_sweep_ms = 0;
+uint32_t scan_sent_ms = 0;
+
+uint32_t capture_next_us = 0;
 
 
 // serial message format:
@@ -29,18 +43,48 @@ static size_t format_serial_message(uint8_t *inbuf, uint8_t *outbuf, size_t nbyt
 }
 
 
+// sends a message with the given framing, hex or binary
+static void send_serial_message(uint8_t *msg, size_t nbytes, uint8_t msg_framing)
+{
+    uint8_t tx_buffer[MAX_SERIAL_MSG_SIZE];
+    size_t tx_size;
+    if (msg_framing == FRAMING_BINARY)
+        tx_size = bytes_to_frame(msg, tx_buffer, nbytes);
+    else
+        tx_size = format_serial_message(msg, tx_buffer, nbytes);
+    Serial.write(tx_buffer, tx_size);
+}
+
+
+static void send_status(uint8_t status)
+{
+    uint8_t msg[] = {LOCAL_ADDR, status};
+    send_serial_message(msg, sizeof(msg), framing);
+}
+
+
 // Receiving more than 32 bytes will crash the board,
 // it's probably a limitation of the i2c peripheral
 void i2c_on_receive(int nbytes)
 {
-    i2c_rx_buffer[0] = IPMB_ADDR;
+    uint8_t head = i2c_rx_head;
+    uint8_t next = (head + 1) % I2C_RX_SLOTS;
+    if (next == i2c_rx_tail) {
+        // no free slot, the message is dropped
+        for (int i=0; i < nbytes; i++)
+            Wire.read();
+        return;
+    }
+    uint8_t *buffer = i2c_rx_buffer[head];
+    buffer[0] = IPMB_ADDR;
     for (size_t i=1; i < nbytes + 1; i++) {
         if (i >= MAX_I2C_MSG_SIZE)
             Wire.read(); // flush remaining
         else
-            i2c_rx_buffer[i] = Wire.read();
+            buffer[i] = Wire.read();
     }
-    i2c_nbytes = min(nbytes + 1, MAX_I2C_MSG_SIZE);
+    i2c_nbytes[head] = min(nbytes + 1, MAX_I2C_MSG_SIZE);
+    i2c_rx_head = next;
 }
 
 
@@ -57,23 +101,29 @@ void setup()
 }
 
 
-static void handle_i2c_command(uint8_t *buffer, size_t nbytes)
+static bool i2c_send(uint8_t *buffer, size_t nbytes)
 {
     uint8_t retries = 0;
     size_t sent = 0;
-    if (nbytes > MAX_I2C_MSG_SIZE) {
-        Serial.print(ERR_TOO_LONG_ASCII_MSG);
-        return;
-    }
     while (sent < nbytes - 1) {
         Wire.beginTransmission(buffer[0]>>1);
         sent = Wire.write(&buffer[1], nbytes - 1);
         Wire.endTransmission();
-        if (++retries >= MAX_IPMB_SEND_RETRIES) {
-            Serial.print(ERR_I2C_MAX_RETRIES_ASCII_MSG);
-            break;
-        }
-  }
+        if (++retries >= MAX_IPMB_SEND_RETRIES)
+            return false;
+    }
+    return true;
+}
+
+
+static void handle_i2c_command(uint8_t *buffer, size_t nbytes)
+{
+    if (nbytes > MAX_I2C_MSG_SIZE) {
+        send_status(ERR_TOO_LONG);
+        return;
+    }
+    if (!i2c_send(buffer, nbytes))
+        send_status(ERR_I2C_MAX_RETRIES);
 }
 
 
@@ -81,34 +131,126 @@ static void handle_i2c_command(uint8_t *buffer, size_t nbytes)
 // response format: <LOCAL_ADDR> <COMMAND_BYTE> <STATUS_BYTE> .. rest
 static void handle_local_command(uint8_t *buffer, size_t nbytes)
 {
-    uint8_t error_code = 0;
     uint8_t reply[MAX_BINARY_MSG_SIZE];
-    uint8_t tx_buffer[MAX_SERIAL_MSG_SIZE];
+    // the reply uses the framing of the request, even if it changes it
+    uint8_t reply_framing = framing;
     // ping command
     if (nbytes == 1) {
-        Serial.print(PONG_ASCII_MSG);
+        send_serial_message(buffer, 1, reply_framing);
         return;
     }
     reply[0] = LOCAL_ADDR;
     // execute command skipping address byte
     size_t reply_nbytes = execute_command(buffer + 1, nbytes - 1, reply + 1);
-    size_t tx_size = format_serial_message(reply, tx_buffer, reply_nbytes + 1);
-    Serial.write(tx_buffer, tx_size);
+    send_serial_message(reply, reply_nbytes + 1, reply_framing);
+}
+
+
+// scan responses are sent as compact results, the ones that do not match
+// the current scan entries are dropped
+static void forward_scan_result(uint8_t *msg, size_t nbytes)
+{
+    uint8_t result[SCAN_RESULT_SIZE + 1];
+    result[0] = LOCAL_ADDR;
+    size_t result_nbytes = scan_result(msg, nbytes, millis(), result + 1);
+    if (result_nbytes == 0)
+        return;
+    if (result[2] == scan_index - 1)
+        scan_waiting = false;
+    send_serial_message(result, result_nbytes + 1, framing);
 }
 
 
 static void forward_i2c_to_serial_if_needed()
 {
-    uint8_t tx_buffer[MAX_SERIAL_MSG_SIZE];
-    size_t nbytes;
+    uint8_t head;
+    uint8_t tail = i2c_rx_tail;
     ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
-        nbytes = i2c_nbytes;
-        i2c_nbytes = 0;
+        head = i2c_rx_head;
+    }
+    if (head != tail) {
+        // the interrupt does not write to the slot until tail moves past it
+        if (is_scan_response(i2c_rx_buffer[tail], i2c_nbytes[tail]))
+            forward_scan_result(i2c_rx_buffer[tail], i2c_nbytes[tail]);
+        else
+            send_serial_message(i2c_rx_buffer[tail], i2c_nbytes[tail],
+                                framing);
+        i2c_rx_tail = (tail + 1) % I2C_RX_SLOTS;
+    }
+}
+
+
+// reads the scan entries one after the other, the next one once the
+// previous is answered or timed out, and starts a sweep every period
+static void scan_if_needed()
+{
+    if (scan_count == 0) {
+        scan_index = 0;
+        scan_waiting = false;
+        return;
     }
-    if (nbytes) {
-        // we assume this finishes before there is a new i2c interrupt
-        size_t tx_size = format_serial_message(i2c_rx_buffer, tx_buffer, nbytes);
-        Serial.write(tx_buffer, tx_size);
+    uint32_t now = millis();
+    if (scan_waiting && now - scan_sent_ms < SCAN_RESPONSE_TIMEOUT_MS)
+        return;
+    scan_waiting = false;
+    if (scan_index >= scan_count) {
+        if (now - scan_sweep_ms < scan_period_ms)
+            return;
+        scan_index = 0;
+    }
+    if (scan_index == 0)
+        scan_sweep_ms = now;
+    uint8_t msg[SCAN_REQUEST_SIZE];
+    size_t nbytes = scan_request(scan_index, IPMB_ADDR, msg);
+    scan_index++;
+    if (i2c_send(msg, nbytes)) {
+        scan_waiting = true;
+        scan_sent_ms = now;
+    }
+}
+
+
+// sends the oldest capture block if it can be written without blocking,
+// then takes a sample when it is due. Sampling is polled, a sample later
+// than a whole period starts a new block so the samples of a block stay
+// evenly spaced
+static void capture_if_needed()
+{
+    size_t nbytes;
+    uint8_t *block = capture_ready_block(&nbytes);
+    if (block && (framing == FRAMING_HEX ||
+            Serial.availableForWrite() >= (int) (nbytes + 1 + FRAME_OVERHEAD))) {
+        uint8_t msg[MAX_BINARY_MSG_SIZE];
+        msg[0] = LOCAL_ADDR;
+        memcpy(msg + 1, block, nbytes);
+        capture_pop_block();
+        send_serial_message(msg, nbytes + 1, framing);
+    }
+    if (capture.remaining == 0)
+        return;
+    uint32_t now = micros();
+    if (!capture.triggered) {
+        if (!capture_trigger())
+            return;
+        capture_next_us = now;
+    }
+    if ((int32_t) (now - capture_next_us) < 0)
+        return;
+    if (now - capture_next_us >= capture.period_us) {
+        capture_break();
+        capture_next_us = now;
+    }
+    capture_sample(capture_next_us);
+    capture_next_us += capture.period_us;
+}
+
+
+static void process_binary_message(uint8_t *buffer, size_t nbytes)
+{
+    if (buffer[0] == LOCAL_ADDR) {
+      handle_local_command(buffer, nbytes);
+    } else {
+      handle_i2c_command(buffer, nbytes);
     }
 }
 
@@ -118,7 +260,7 @@ static void process_serial_message(uint8_t *hex_buffer, size_t hex_nbytes)
     uint8_t buffer[MAX_BINARY_MSG_SIZE];
     size_t nbytes = hex_to_bytes(hex_buffer, buffer, hex_nbytes);
     if (nbytes == 0) {
-      Serial.print(ERR_NO_DATA_ASCII_MSG);
+      send_status(ERR_NO_DATA);
       return;
     }
     if (buffer[0] == LOCAL_ADDR) {
@@ -129,21 +271,42 @@ static void process_serial_message(uint8_t *hex_buffer, size_t hex_nbytes)
 }
 
 
+// in binary framing, bytes outside of a frame are still collected as a hex
+// line, a host that only knows the hex framing switches the board back to
+// it with its first message (usually the ping command). Only a line of hex
+// digits does, the leftovers of a broken frame are dropped
 static void process_serial()
 {
-    static size_t len = 0;
     static uint8_t rx_buffer[MAX_SERIAL_MSG_SIZE];
+    static uint8_t frame_buffer[MAX_BINARY_MSG_SIZE];
+    static struct frame_parser parser = {
+        FRAME_IDLE, frame_buffer, MAX_BINARY_MSG_SIZE, 0, 0, 0
+    };
+    static struct line_collector line = {
+        rx_buffer, MAX_SERIAL_MSG_SIZE, 0, false, false
+    };
     uint8_t current_byte = 0;
+    uint8_t state = FRAME_IDLE;
     if (Serial.available()) {
-        if (len >= MAX_SERIAL_MSG_SIZE) {
-            Serial.print(ERR_TOO_LONG_ASCII_MSG);
-            len = 0;
-        } else {
-            rx_buffer[len++] = current_byte = (uint8_t) Serial.read();
-            if (current_byte == TERMINATOR) {
-                process_serial_message(rx_buffer, len);
-                len = 0;
-            }
+        current_byte = (uint8_t) Serial.read();
+        if (framing == FRAMING_BINARY)
+            state = frame_parser_feed(&parser, current_byte);
+        uint8_t line_state = line_collector_feed(&line, current_byte, state);
+        if (state == FRAME_READY) {
+            process_binary_message(frame_buffer, parser.len);
+            return;
+        }
+        switch (line_state) {
+        case LINE_TOO_LONG:
+            send_status(ERR_TOO_LONG);
+            break;
+        case LINE_READY:
+            if (framing == FRAMING_BINARY &&
+                    !is_hex_line(line.buffer, line.len))
+                break;
+            framing = FRAMING_HEX;
+            process_serial_message(line.buffer, line.len);
+            break;
         }
     }
 }
@@ -154,5 +317,7 @@ void loop()
     for (;;) {
         forward_i2c_to_serial_if_needed();
         process_serial();
+        scan_if_needed();
+        capture_if_needed();
     }
 }
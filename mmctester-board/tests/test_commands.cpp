@@ -77,6 +77,187 @@ static char *test_an_read()
 }
 
 
+static char *test_set_framing()
+{
+    uint8_t reply[32];
+    uint8_t command[] = "\x06\x01";
+    size_t n = execute_command(command, 2, reply);
+    mu_assert("Invalid response length", n == 2);
+    mu_assert("Invalid command byte in response", reply[0] == 0x06);
+    mu_assert("Invalid response", reply[1] == OK);
+    mu_assert("Framing not changed", framing == FRAMING_BINARY);
+    uint8_t invalid[] = "\x06\x07";
+    n = execute_command(invalid, 2, reply);
+    mu_assert("Invalid framing accepted", reply[1] == ERR_INVALID_FORMAT);
+    mu_assert("Framing changed by invalid command", framing == FRAMING_BINARY);
+    framing = FRAMING_HEX;
+    return NULL;
+}
+
+
+static char *test_set_scan()
+{
+    uint8_t reply[32];
+    uint8_t command[] = "\x07\xe8\x03\x72\x05\x00\x74\x01\x05";
+    size_t n = execute_command(command, 9, reply);
+    mu_assert("Invalid response length", n == 2);
+    mu_assert("Invalid command byte in response", reply[0] == 0x07);
+    mu_assert("Invalid response", reply[1] == OK);
+    mu_assert("Scan count not valid", scan_count == 2);
+    mu_assert("Scan period not valid", scan_period_ms == 1000);
+    mu_assert("Scan target not valid", scan_entries[1].target == 0x74);
+    mu_assert("Scan sensor not valid", scan_entries[1].sensor == 0x01);
+    mu_assert("Scan lun not masked", scan_entries[1].lun == 0x01);
+    uint8_t invalid[] = "\x07\xe8\x03\x72\x05";
+    n = execute_command(invalid, 5, reply);
+    mu_assert("Invalid scan accepted", reply[1] == ERR_INVALID_FORMAT);
+    mu_assert("Scan changed by invalid command", scan_count == 2);
+    uint8_t stop[] = "\x07\x00\x00";
+    n = execute_command(stop, 3, reply);
+    mu_assert("Invalid response", reply[1] == OK);
+    mu_assert("Scan not stopped", scan_count == 0);
+    return NULL;
+}
+
+
+static char *test_batch()
+{
+    uint8_t reply[32];
+    uint8_t command[] = "\x08\x01\x0d\x01\x03\x0f\x02\x03\x01\x05\x0e";
+    size_t n = execute_command(command, 11, reply);
+    mu_assert("Invalid response length", n == 5);
+    mu_assert("Invalid command byte in response", reply[0] == 0x08);
+    mu_assert("Invalid response", reply[1] == OK);
+    mu_assert("Invalid read value", reply[2] == _digital_read_value);
+    uint16_t val = reply[3] | (reply[4] << 8);
+    mu_assert("Invalid analog read value", val == _analog_read_value);
+    mu_assert("Batch not run in order", _last_call_pin == 14);
+    mu_assert("Dig write val not valid", _last_call_val == 1);
+    uint8_t invalid[] = "\x08\x02\x04\x00\x07\x00\x00";
+    n = execute_command(invalid, 7, reply);
+    mu_assert("Invalid batch accepted", reply[1] == ERR_INVALID_FORMAT);
+    mu_assert("Invalid batch partially run", _last_call_pin == 14);
+    uint8_t truncated[] = "\x08\x03\x04\x02\x05";
+    n = execute_command(truncated, 5, reply);
+    mu_assert("Truncated batch accepted", reply[1] == ERR_INVALID_FORMAT);
+    uint8_t too_long[31] = {0x08};
+    for (size_t i = 1; i < 31; i += 2) {
+        too_long[i] = 0x05;
+        too_long[i + 1] = 0x0e;
+    }
+    n = execute_command(too_long, 31, reply);
+    mu_assert("Too many results accepted", reply[1] == ERR_TOO_LONG);
+    return NULL;
+}
+
+
+static char *test_set_capture()
+{
+    uint8_t reply[32];
+    uint8_t command[] = "\x09\xe8\x03\x05\x00\x02\x01\x8e\x03\x04";
+    _digital_read_value = 0;
+    size_t n = execute_command(command, 10, reply);
+    mu_assert("Invalid response length", n == 2);
+    mu_assert("Invalid command byte in response", reply[0] == 0x09);
+    mu_assert("Invalid response", reply[1] == OK);
+    mu_assert("Capture period not valid", capture.period_us == 1000);
+    mu_assert("Capture count not valid", capture.remaining == 5);
+    mu_assert("Capture pins not valid", capture.npins == 3);
+    mu_assert("Capture analog pin not valid", capture.pins[0] == 0x8e);
+    mu_assert("Capture triggered too early", !capture_trigger());
+    _digital_read_value = 1;
+    mu_assert("Capture not triggered on rising edge", capture_trigger());
+    uint8_t invalid[] = "\x09\x00\x00\x05\x00\x02\x00\x03";
+    n = execute_command(invalid, 8, reply);
+    mu_assert("Capture without period accepted",
+              reply[1] == ERR_INVALID_FORMAT);
+    mu_assert("Capture changed by invalid command", capture.remaining == 5);
+    uint8_t stop[] = "\x09\x00\x00\x00\x00\x00\x00";
+    n = execute_command(stop, 7, reply);
+    mu_assert("Invalid response", reply[1] == OK);
+    mu_assert("Capture not stopped", capture.remaining == 0);
+    return NULL;
+}
+
+
+static char *test_capture_blocks()
+{
+    uint8_t reply[32];
+    // one analog and two digital pins, 3 bytes per sample, 8 per block
+    uint8_t command[] = "\x09\x64\x00\x0a\x00\x00\x00\x8e\x03\x04";
+    execute_command(command, 10, reply);
+    size_t nbytes;
+    mu_assert("Block ready before sampling", !capture_ready_block(&nbytes));
+    for (uint32_t i = 0; i < 10; i++)
+        capture_sample(0x01020304 + 100 * i);
+    mu_assert("Capture not finished", capture.remaining == 0);
+    uint8_t *block = capture_ready_block(&nbytes);
+    mu_assert("No block ready", block != NULL);
+    mu_assert("Invalid block size", nbytes == CAPTURE_HEADER_SIZE + 8 * 3);
+    mu_assert("Invalid block type", block[0] == CAPTURE_BLOCK);
+    mu_assert("Invalid block sequence", block[1] == 0);
+    mu_assert("Invalid block timestamp", block[2] == 0x04 && block[5] == 0x01);
+    uint16_t val = block[6] | (block[7] << 8);
+    mu_assert("Invalid analog value", val == _analog_read_value);
+    mu_assert("Invalid digital values", block[8] == 0x03);
+    capture_pop_block();
+    block = capture_ready_block(&nbytes);
+    mu_assert("Last block not ready", block != NULL);
+    mu_assert("Invalid last block size", nbytes == CAPTURE_HEADER_SIZE + 2 * 3);
+    mu_assert("Invalid last block sequence", block[1] == 1);
+    uint32_t timestamp = block[2] | (block[3] << 8) | (block[4] << 16) |
+        ((uint32_t) block[5] << 24);
+    mu_assert("Invalid last block timestamp", timestamp == 0x01020304 + 800);
+    capture_pop_block();
+    mu_assert("Unexpected block", !capture_ready_block(&nbytes));
+    return NULL;
+}
+
+
+static char *test_scan_request()
+{
+    uint8_t reply[32];
+    uint8_t command[] = "\x07\x00\x00\x74\x01\x00\x72\x05\x00";
+    execute_command(command, 9, reply);
+    uint8_t msg[SCAN_REQUEST_SIZE];
+    uint8_t expected[] = "\x72\x10\x7e\x20\x06\x2d\x05\xa8";
+    size_t n = scan_request(1, 0x20, msg);
+    mu_assert("Invalid request length", n == SCAN_REQUEST_SIZE);
+    for (size_t i = 0; i < n; i++)
+        mu_assert("Invalid request", msg[i] == expected[i]);
+    scan_count = 0;
+    return NULL;
+}
+
+
+static char *test_scan_result()
+{
+    uint8_t reply[32];
+    uint8_t command[] = "\x07\x00\x00\x74\x01\x00\x72\x05\x00";
+    execute_command(command, 9, reply);
+    uint8_t response[] = "\x20\x16\xca\x72\x06\x2d\x00\x40\xc0\x01\x00\x5a";
+    mu_assert("Scan response not recognized", is_scan_response(response, 12));
+    uint8_t host_response[] = "\x20\x14\xcc\x72\x06\x2d\x00\x40\xc0\x5a";
+    mu_assert("Host response taken as scan response",
+              !is_scan_response(host_response, 10));
+    uint8_t result[SCAN_RESULT_SIZE];
+    uint8_t expected[] = "\x90\x01\x00\x40\xc0\x01\x00\x04\x03\x02\x01";
+    size_t n = scan_result(response, 12, 0x01020304, result);
+    mu_assert("Invalid result length", n == SCAN_RESULT_SIZE);
+    for (size_t i = 0; i < n; i++)
+        mu_assert("Invalid result", result[i] == expected[i]);
+    response[11] = 0x00;
+    n = scan_result(response, 12, 0, result);
+    mu_assert("Invalid checksum accepted", n == 0);
+    response[11] = 0x5a;
+    scan_count = 1;
+    n = scan_result(response, 12, 0, result);
+    mu_assert("Unknown entry accepted", n == 0);
+    scan_count = 0;
+    return NULL;
+}
+
+
 static char *all_tests()
 {
     mu_run_test(test_pin_mode);
@@ -84,6 +265,13 @@ static char *all_tests()
     mu_run_test(test_dig_read);
     mu_run_test(test_an_write);
     mu_run_test(test_an_read);
+    mu_run_test(test_set_framing);
+    mu_run_test(test_set_scan);
+    mu_run_test(test_batch);
+    mu_run_test(test_set_capture);
+    mu_run_test(test_capture_blocks);
+    mu_run_test(test_scan_request);
+    mu_run_test(test_scan_result);
     return NULL;
 }
 
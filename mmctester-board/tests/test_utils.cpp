@@ -47,12 +47,135 @@ static char *test_hex_to_bytes()
 }
 
 
+static char *test_bytes_to_frame()
+{
+    uint8_t input[] = "\x00\x05\x0e";
+    uint8_t output[8];
+    size_t frame_size = bytes_to_frame(input, output, 3);
+    mu_assert("bytes_to_frame: incorrect size returned", frame_size == 6);
+    mu_assert("bytes_to_frame: unexpected output",
+        memcmp((char *) output, "\xa5\x03\x00\x05\x0e\xea", 6) == 0);
+    return NULL;
+}
+
+
+static char *test_frame_parser()
+{
+    uint8_t input[] = "\x30\xa5\x03\x00\x05\x0e\xea";
+    uint8_t buffer[8];
+    uint8_t state = FRAME_IDLE;
+    struct frame_parser parser;
+    frame_parser_init(&parser, buffer, sizeof(buffer));
+    mu_assert("frame_parser: byte outside of frame not reported",
+        frame_parser_feed(&parser, input[0]) == FRAME_IDLE);
+    for (size_t i=1; i < 7; i++)
+        state = frame_parser_feed(&parser, input[i]);
+    mu_assert("frame_parser: frame not ready", state == FRAME_READY);
+    mu_assert("frame_parser: incorrect length", parser.len == 3);
+    mu_assert("frame_parser: unexpected payload",
+        memcmp((char *) buffer, "\x00\x05\x0e", 3) == 0);
+    return NULL;
+}
+
+
+static char *test_frame_parser_checksum()
+{
+    uint8_t input[] = "\xa5\x02\x00\x05\x00";
+    uint8_t buffer[8];
+    uint8_t state = FRAME_IDLE;
+    struct frame_parser parser;
+    frame_parser_init(&parser, buffer, sizeof(buffer));
+    for (size_t i=0; i < 5; i++)
+        state = frame_parser_feed(&parser, input[i]);
+    mu_assert("frame_parser: invalid checksum accepted", state == FRAME_ERROR);
+    return NULL;
+}
+
+
+static char *test_frame_parser_too_long()
+{
+    uint8_t buffer[2];
+    struct frame_parser parser;
+    frame_parser_init(&parser, buffer, sizeof(buffer));
+    frame_parser_feed(&parser, FRAME_START);
+    mu_assert("frame_parser: too long frame accepted",
+        frame_parser_feed(&parser, 3) == FRAME_ERROR);
+    return NULL;
+}
+
+
+static char *test_is_hex_line()
+{
+    uint8_t line[] = "00 01\r\n";
+    uint8_t garbage[] = "\x01\x02\n";
+    mu_assert("is_hex_line: hex line rejected", is_hex_line(line, 7));
+    mu_assert("is_hex_line: garbage accepted", !is_hex_line(garbage, 3));
+    mu_assert("is_hex_line: empty line accepted", !is_hex_line(line + 5, 2));
+    return NULL;
+}
+
+
+static char *test_line_collector()
+{
+    uint8_t input[] = "00 01\n";
+    uint8_t buffer[8];
+    uint8_t state = LINE_NONE;
+    struct line_collector line;
+    line_collector_init(&line, buffer, sizeof(buffer));
+    for (size_t i=0; i < 6; i++)
+        state = line_collector_feed(&line, input[i], FRAME_IDLE);
+    mu_assert("line_collector: line not ready", state == LINE_READY);
+    mu_assert("line_collector: incorrect length", line.len == 6);
+    mu_assert("line_collector: unexpected line",
+        memcmp((char *) buffer, "00 01\n", 6) == 0);
+    for (size_t i=0; i < 8; i++)
+        state = line_collector_feed(&line, '0', FRAME_IDLE);
+    mu_assert("line_collector: too long line accepted",
+        line_collector_feed(&line, '0', FRAME_IDLE) == LINE_TOO_LONG);
+    return NULL;
+}
+
+
+// the payload of a frame with a wrong length is read as bytes outside of
+// a frame, its 0x0a must not end a hex line that process_serial accepts
+static char *test_line_collector_bad_frame()
+{
+    uint8_t input[] = "00\xa5\xff\x01\x0a\x02\x0a" "00 01\n";
+    uint8_t frame_buffer[8];
+    uint8_t buffer[16];
+    uint8_t state = LINE_NONE;
+    size_t lines = 0;
+    struct frame_parser parser;
+    struct line_collector line;
+    frame_parser_init(&parser, frame_buffer, sizeof(frame_buffer));
+    line_collector_init(&line, buffer, sizeof(buffer));
+    for (size_t i=0; i < sizeof(input) - 1; i++) {
+        state = line_collector_feed(&line, input[i],
+                                    frame_parser_feed(&parser, input[i]));
+        if (state == LINE_READY && is_hex_line(buffer, line.len))
+            lines++;
+    }
+    mu_assert("line_collector: frame leftovers made a line", lines == 1);
+    mu_assert("line_collector: hex line after bad frame lost",
+        state == LINE_READY && line.len == 6 &&
+        memcmp((char *) buffer, "00 01\n", 6) == 0);
+    return NULL;
+}
+
+
 static char *all_tests()
 {
     mu_run_test(test_is_hex);
     mu_run_test(test_bytes_to_hex);
     mu_run_test(test_hex_to_nibble);
     mu_run_test(test_hex_to_bytes);
+    mu_run_test(test_bytes_to_frame);
+    mu_run_test(test_frame_parser);
+    mu_run_test(test_frame_parser_checksum);
+    mu_run_test(test_frame_parser_too_long);
+    mu_run_test(test_is_hex_line);
+    mu_run_test(test_line_collector);
+    mu_run_test(test_line_collector_bad_frame);
     return NULL;
 }
 
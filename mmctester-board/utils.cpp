@@ -56,3 +56,127 @@ size_t hex_to_bytes(uint8_t *hex, uint8_t *bytes, size_t len)
     }
     return nbytes;
 }
+
+
+size_t bytes_to_frame(uint8_t *bytes, uint8_t *frame, size_t nbytes)
+{
+    uint8_t sum = nbytes;
+    frame[0] = FRAME_START;
+    frame[1] = nbytes;
+    for (size_t i=0; i < nbytes; i++) {
+        frame[i + 2] = bytes[i];
+        sum += bytes[i];
+    }
+    frame[nbytes + 2] = -sum;
+    return nbytes + FRAME_OVERHEAD;
+}
+
+
+void frame_parser_init(struct frame_parser *parser, uint8_t *buffer, size_t size)
+{
+    parser->state = FRAME_IDLE;
+    parser->buffer = buffer;
+    parser->size = size;
+    parser->len = 0;
+    parser->pos = 0;
+    parser->sum = 0;
+}
+
+
+// returns FRAME_IDLE for bytes outside of a frame, FRAME_READY when a
+// frame with a valid checksum has been stored in buffer (parser->len bytes)
+uint8_t frame_parser_feed(struct frame_parser *parser, uint8_t byte)
+{
+    switch (parser->state) {
+    case FRAME_IDLE:
+    case FRAME_READY:
+    case FRAME_ERROR:
+        if (byte != FRAME_START) {
+            parser->state = FRAME_IDLE;
+            return FRAME_IDLE;
+        }
+        parser->state = FRAME_INCOMPLETE;
+        parser->pos = 0;
+        parser->len = 0;
+        return FRAME_INCOMPLETE;
+    case FRAME_INCOMPLETE:
+        if (parser->pos == 0 && parser->len == 0) {
+            if (byte == 0 || byte > parser->size) {
+                parser->state = FRAME_ERROR;
+                return FRAME_ERROR;
+            }
+            parser->len = byte;
+            parser->sum = byte;
+            return FRAME_INCOMPLETE;
+        }
+        parser->sum += byte;
+        if (parser->pos < parser->len) {
+            parser->buffer[parser->pos++] = byte;
+            return FRAME_INCOMPLETE;
+        }
+        parser->state = parser->sum ? FRAME_ERROR : FRAME_READY;
+        return parser->state;
+    }
+    return FRAME_ERROR;
+}
+
+
+// true if the line only has hex digits and separators, with at least one
+// digit
+bool is_hex_line(uint8_t *line, size_t len)
+{
+    bool digits = false;
+    for (size_t i=0; i < len; i++) {
+        if (is_hex(line[i]))
+            digits = true;
+        else if (line[i] != ' ' && line[i] != '\r' &&
+                 line[i] != LINE_TERMINATOR)
+            return false;
+    }
+    return digits;
+}
+
+
+void line_collector_init(struct line_collector *line, uint8_t *buffer, size_t size)
+{
+    line->buffer = buffer;
+    line->size = size;
+    line->len = 0;
+    line->ready = false;
+    line->discard = false;
+}
+
+
+// frame_state: what the frame parser returned for the byte, FRAME_IDLE if
+// there is no parser. A line is dropped by any frame byte, and after a
+// broken frame the bytes up to the next terminator are its leftovers, they
+// never make a line. Returns LINE_READY when buffer holds a line (len
+// bytes, terminator included)
+uint8_t line_collector_feed(struct line_collector *line, uint8_t byte,
+                            uint8_t frame_state)
+{
+    if (line->ready) {
+        line->ready = false;
+        line->len = 0;
+    }
+    if (frame_state != FRAME_IDLE) {
+        line->len = 0;
+        if (frame_state == FRAME_ERROR)
+            line->discard = true;
+        return LINE_NONE;
+    }
+    if (line->discard) {
+        if (byte == LINE_TERMINATOR)
+            line->discard = false;
+        return LINE_NONE;
+    }
+    if (line->len >= line->size) {
+        line->len = 0;
+        return LINE_TOO_LONG;
+    }
+    line->buffer[line->len++] = byte;
+    if (byte != LINE_TERMINATOR)
+        return LINE_NONE;
+    line->ready = true;
+    return LINE_READY;
+}
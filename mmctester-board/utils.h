@@ -15,4 +15,52 @@ char hex_to_nibble(uint8_t digit);
 
 size_t hex_to_bytes(uint8_t *hex, uint8_t *bytes, size_t len);
 
+// binary frame format:
+// <FRAME_START> <LENGTH> <PAYLOAD ...> <CHECKSUM>
+// the checksum makes the sum of length, payload and checksum 0
+#define FRAME_START 0xa5
+#define FRAME_OVERHEAD 3
+
+#define FRAME_IDLE 0
+#define FRAME_INCOMPLETE 1
+#define FRAME_READY 2
+#define FRAME_ERROR 3
+
+struct frame_parser {
+    uint8_t state;
+    uint8_t *buffer;
+    size_t size;
+    size_t len;
+    size_t pos;
+    uint8_t sum;
+};
+
+size_t bytes_to_frame(uint8_t *bytes, uint8_t *frame, size_t nbytes);
+
+void frame_parser_init(struct frame_parser *parser, uint8_t *buffer, size_t size);
+
+uint8_t frame_parser_feed(struct frame_parser *parser, uint8_t byte);
+
+// hex lines, collected from the bytes outside of binary frames
+#define LINE_TERMINATOR 10
+
+#define LINE_NONE 0
+#define LINE_READY 1
+#define LINE_TOO_LONG 2
+
+struct line_collector {
+    uint8_t *buffer;
+    size_t size;
+    size_t len;
+    bool ready;
+    bool discard;
+};
+
+bool is_hex_line(uint8_t *line, size_t len);
+
+void line_collector_init(struct line_collector *line, uint8_t *buffer, size_t size);
+
+uint8_t line_collector_feed(struct line_collector *line, uint8_t byte,
+                            uint8_t frame_state);
+
 #endif
@@ -0,0 +1,582 @@
+#!/usr/bin/env python
+import asyncio
+import sys
+import time
+
+import pyipmi
+import serial
+
+from pyipmi.errors import IpmiTimeoutError
+from pyipmi.logger import log
+from pyipmi.msgs import encode_message
+
+from mmctester.arduino import (ArduinoLocalCommand, HIGH, LOW, OUTPUT,
+                               LocalBatch)
+from mmctester.capture import Capture, capture_command_args
+from mmctester.interface import (BoardProtocol, FRAMINGS, LOCAL_ADDR,
+                                 MAX_PIPELINE_WINDOW)
+from mmctester.main import HOTSWAP_ACTIONS, Main, STATUS_PERIOD
+from mmctester.metrics import DEFAULT_EXPORT_INTERVAL, MeteredSerial
+from mmctester.scan import decode_scan_result, scan_command_args
+from mmctester.sensors import sensor_luts
+from mmctester.scheduler import DEFAULT_BUDGET
+
+# longest sleep of the sensor task of AsyncMain while no sensor is due
+SENSOR_PERIOD = 0.2
+
+
+class AsyncArduinoLocalCommand(ArduinoLocalCommand):
+    '''ArduinoLocalCommand whose commands are coroutines.
+
+    recv and recv_capture are coroutines. Local answers carry no sequence
+    number, so one command at a time is sent.
+    '''
+
+    def __init__(self, send, recv, local_address=0x0, metrics=None,
+                 recv_capture=None):
+        super().__init__(send, recv, local_address, metrics,
+                         recv_capture)
+        self._lock = asyncio.Lock()
+
+    async def send_and_receive(self, command):
+        async with self._lock:
+            started = time.perf_counter()
+            self.send(command)
+            try:
+                ans = await self.recv()
+            except IpmiTimeoutError:
+                self._observe_timeout()
+                raise
+            self._observe(started)
+            return ans
+
+    async def execute(self, command_id, *args):
+        ans = await self.send_and_receive(self._command(command_id, *args))
+        return self._check_answer(command_id, ans)
+
+    async def pin_mode(self, pin, mode):
+        await self.execute(self.COMMAND_PIN_MODE, pin, mode)
+
+    async def digital_write(self, pin, val):
+        await self.execute(self.COMMAND_DIG_WRITE, pin, val)
+
+    async def digital_read(self, pin):
+        return (await self.execute(self.COMMAND_DIG_READ, pin))[3]
+
+    async def analog_write(self, pin, val):
+        await self.execute(self.COMMAND_AN_WRITE, pin, val & 0xff)
+
+    async def analog_read(self, pin):
+        return self._analog_value(
+            await self.execute(self.COMMAND_AN_READ, pin))
+
+    async def set_scan(self, entries, period):
+        await self.execute(self.COMMAND_SET_SCAN,
+                           *scan_command_args(entries, period))
+
+    async def stop_scan(self):
+        await self.execute(self.COMMAND_SET_SCAN, 0, 0)
+
+    def batch(self):
+        return AsyncLocalBatch(self)
+
+    async def start_capture(self, analog=(), digital=(), period=0.001,
+                            count=1000, trigger=None):
+        args = capture_command_args(analog, digital, period, count, trigger)
+        capture = Capture(analog, digital, period, count)
+        await self.execute(self.COMMAND_SET_CAPTURE, *args)
+        return capture
+
+    async def stop_capture(self):
+        await self.execute(self.COMMAND_SET_CAPTURE, 0, 0, 0, 0, 0, 0)
+
+    async def receive_capture(self, capture, timeout=None):
+        '''Adds the blocks that arrive to capture until it is complete.
+
+        Returns False if no block arrived within timeout seconds, None waits
+        forever.
+        '''
+        while not capture.complete:
+            try:
+                capture.add_block(await self.recv_capture(timeout))
+            except IpmiTimeoutError:
+                return False
+        return True
+
+    async def capture(self, analog=(), digital=(), period=0.001, count=1000,
+                      trigger=None, timeout=None):
+        capture = await self.start_capture(analog, digital, period, count,
+                                           trigger)
+        if not await self.receive_capture(capture, timeout):
+            await self.stop_capture()
+        return capture
+
+    async def run_batch(self, commands):
+        results = []
+        for batch in self._split_batch(commands):
+            if batch and self.batch_supported:
+                ans = await self.send_and_receive(self._command(
+                    self.COMMAND_BATCH, *self._batch_args(batch)))
+                if not self._batch_unsupported(ans):
+                    results.extend(self._batch_results(batch, ans))
+                    continue
+            for command_id, args, size in batch:
+                results.append(self._single_result(
+                    size, await self.execute(command_id, *args)))
+        return results
+
+
+class AsyncLocalBatch(LocalBatch):
+    '''LocalBatch whose flush is a coroutine, an async context manager.'''
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.flush()
+
+    async def flush(self):
+        self.results = await self.arduino.run_batch(self._take())
+        return self.results
+
+
+class AsyncMMCTesterBoard(BoardProtocol):
+    '''mmctester-board driven by an asyncio event loop.
+
+    The serial port is read from a reader callback of the loop and waiting
+    for an answer never blocks other tasks. Requests from several tasks are
+    pipelined, up to pipeline_window of them are in flight at once.
+
+    Use open() or "async with" before sending anything.
+    '''
+
+    NAME = 'mmctester-board'
+
+    def __init__(self, port='/dev/ttyACM0', baudrate=115200, address=0x20,
+                 framing='auto', max_queue_size=256):
+        if framing not in FRAMINGS:
+            raise ValueError(f'Unknown framing: {framing}')
+        super().__init__(address, max_queue_size)
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = 1.0
+        self.max_retries = 3
+        self.pipeline_window = 4
+        self._wanted_framing = framing
+        self._ser = None
+        self._loop = None
+        self._rx_changed = None
+        self._reader_error = None
+        self._in_flight = None
+        self.arduino = AsyncArduinoLocalCommand(
+            self._serial_send_raw, self._local_receive_raw, LOCAL_ADDR,
+            self.metrics, self._capture_receive_raw)
+
+    async def open(self):
+        self._loop = asyncio.get_running_loop()
+        self._rx_changed = self._loop.create_future()
+        self._in_flight = asyncio.Semaphore(
+            max(1, min(self.pipeline_window, MAX_PIPELINE_WINDOW)))
+        # reads never block, they only take what the driver already has
+        self._ser = MeteredSerial(
+            serial.Serial(self.port, baudrate=self.baudrate, timeout=0),
+            self.metrics)
+        self._loop.add_reader(self._ser.fileno(), self._on_readable)
+        try:
+            await self._wait_until_ready()
+            if self._wanted_framing != 'hex':
+                await self._negotiate_framing(
+                    self._wanted_framing == 'binary')
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        if self._ser is None:
+            return
+        if self._reader_error is None:
+            self._loop.remove_reader(self._ser.fileno())
+        self._ser.close()
+        self._ser = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def _on_readable(self):
+        pushed = False
+        try:
+            while self._ser.in_waiting:
+                # the rest of a frame may not be there yet
+                for rx_data in self._framing.read_frames(self._ser):
+                    self._recv_queue.push(rx_data)
+                    pushed = True
+        except Exception as e:
+            log().debug('Serial read failed: %s', e)
+            self._reader_error = e
+            self._loop.remove_reader(self._ser.fileno())
+            pushed = True
+        if pushed:
+            self._rx_changed.set_result(None)
+            self._rx_changed = self._loop.create_future()
+
+    async def _wait_for_frame(self, pop, timeout):
+        '''Returns the first frame given by pop, waiting until there is one.
+
+        pop: takes a frame of the wanted kind from the receive queue, None
+        if there is none
+        timeout: seconds to wait for the frame, None waits forever and 0
+        only takes what has already arrived
+        '''
+        deadline = None
+        if timeout is not None:
+            deadline = self._loop.time() + timeout
+        rx_data = pop()
+        while rx_data is None:
+            if self._reader_error is not None:
+                raise IOError(f'Serial reader failed: {self._reader_error}')
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    raise IpmiTimeoutError()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._rx_changed),
+                                       remaining)
+            except asyncio.TimeoutError:
+                pass
+            rx_data = pop()
+        return rx_data
+
+    async def _local_receive_raw(self):
+        return await self._wait_for_frame(self._recv_queue.pop_local,
+                                          self.timeout)
+
+    # sends ping command until it is answered, older answers are dropped
+    async def _wait_until_ready(self):
+        for _ in range(self.max_retries):
+            self._ser.write(b'00\n')
+            try:
+                while list(await self._local_receive_raw()) != [LOCAL_ADDR]:
+                    pass
+                return
+            except IpmiTimeoutError:
+                pass
+        raise IOError('Board not ready to accept serial commands')
+
+    async def _negotiate_framing(self, required):
+        self._serial_send_raw(self._framing_request())
+        try:
+            ans = await self._local_receive_raw()
+        except IpmiTimeoutError:
+            ans = None
+        self._framing_answer(ans, required)
+
+    async def _send_and_receive(self, target, lun, netfn, cmdid, payload):
+        '''Send a request and wait for its response, resending on timeout.
+
+        Returns the received data as bytestring
+        '''
+        async with self._in_flight:
+            header = self._request_header(target, lun, netfn, cmdid)
+            key = self._request_key(header)
+            rtt = self.rtt.get(header.rs_sa, netfn, cmdid)
+            samples = rtt.samples
+            timeout = rtt.timeout
+            sent = time.perf_counter()
+            for retries in range(self.max_retries):
+                if retries:
+                    self.metrics.retries += 1
+                    await asyncio.sleep(rtt.backoff(retries))
+                self._send_raw(header, payload)
+                try:
+                    rx_data = await self._wait_for_frame(
+                        lambda: self._recv_queue.pop_response(key),
+                        timeout)
+                except IpmiTimeoutError:
+                    timeout = rtt.timed_out(timeout)
+                    continue
+                elapsed = time.perf_counter() - sent
+                self.metrics.request_seconds.observe(elapsed)
+                if retries:
+                    rtt.answered_after_retry(samples)
+                else:
+                    rtt.observe(elapsed)
+                # returns only from completion code to (excluding) payload
+                # checksum
+                return rx_data[6:-1]
+        log().debug('Recv queue: %s', self._recv_queue)
+        self.metrics.timeouts += 1
+        raise IpmiTimeoutError()
+
+    async def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
+        return await self._send_and_receive(target=target,
+                                            lun=lun,
+                                            netfn=netfn,
+                                            cmdid=raw_bytes[0],
+                                            payload=raw_bytes[1:])
+
+    async def send_and_receive(self, req):
+        '''Send an IPMI message request, returns its response.'''
+        log().debug('IPMI Request [%s]', req)
+        rx_data = await self._send_and_receive(target=req.target,
+                                               lun=req.lun,
+                                               netfn=req.netfn,
+                                               cmdid=req.cmdid,
+                                               payload=encode_message(req))
+        return self._decode_response(req, rx_data)
+
+    async def send_and_receive_many(self, reqs):
+        '''Returns the responses to reqs, which are sent concurrently.'''
+        return await asyncio.gather(
+            *[self.send_and_receive(req) for req in reqs])
+
+    async def receive_and_ack_event(self, timeout=None):
+        '''Returns the next Platform Event request, after acknowledging it.
+
+        timeout: seconds to wait for an event, the serial timeout by default,
+        0 polls without blocking
+
+        Returns None if no event arrived in time.
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            raw_rx_data = await self._wait_for_frame(
+                self._recv_queue.pop_event, timeout)
+        except IpmiTimeoutError:
+            return None
+        return self._ack_event(raw_rx_data)
+
+    async def events(self):
+        '''Yields Platform Event requests as they arrive, acknowledged.'''
+        while True:
+            raw_rx_data = await self._wait_for_frame(
+                self._recv_queue.pop_event, None)
+            yield self._ack_event(raw_rx_data)
+
+    async def start_scan(self, entries, period):
+        '''Makes the board read sensors on its own, see scan_results.
+
+        entries: (target address, sensor number, lun) of up to
+        MAX_SCAN_ENTRIES sensors
+        period: seconds between the start of two sweeps over the entries
+        '''
+        await self.arduino.set_scan(entries, period)
+        self.scan_entries = list(entries)
+
+    async def stop_scan(self):
+        await self.arduino.stop_scan()
+
+    async def _capture_receive_raw(self, timeout):
+        return await self._wait_for_frame(self._recv_queue.pop_capture,
+                                          timeout)
+
+    async def scan_results(self, timeout=None):
+        '''Yields a ScanResult per reading done by the board.
+
+        Stops when no reading arrives within timeout seconds, None waits
+        forever.
+        '''
+        while True:
+            try:
+                data = await self._wait_for_frame(self._recv_queue.pop_scan,
+                                                  timeout)
+            except IpmiTimeoutError:
+                return
+            yield decode_scan_result(data, self.scan_entries)
+
+    def pop_unprocessed_messages(self):
+        return self._recv_queue.pop_unprocessed()
+
+
+class BlockingBridge(object):
+    '''Blocking pyipmi interface sending through an AsyncMMCTesterBoard.
+
+    pyipmi helpers are synchronous, they can be run in an executor thread
+    with a connection created on this bridge while the loop does the I/O.
+    '''
+
+    NAME = 'mmctester-board'
+
+    def __init__(self, board, loop):
+        self.board = board
+        self._loop = loop
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def establish_session(self, session):
+        self._session = session
+
+    def close_session(self):
+        pass
+
+    def is_ipmc_accessible(self, target):
+        self.send_and_receive_raw(target, 0, 6, b'\x01')
+        return True
+
+    def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
+        return self._run(
+            self.board.send_and_receive_raw(target, lun, netfn, raw_bytes))
+
+    def send_and_receive(self, req):
+        return self._run(self.board.send_and_receive(req))
+
+
+class AsyncMain(Main):
+    '''Main with sensor polling, event handling and keys as asyncio tasks.
+
+    The pyipmi helpers, e.g. FRU and SDR reading, run in executor threads.
+    '''
+
+    def __init__(self, port, target, pin_pg, pin_hs, pin_pwm,
+                 sensor_period=SENSOR_PERIOD, sdr_cache=True, fru_cache=True,
+                 poll_budget=DEFAULT_BUDGET, poll_intervals=None,
+                 record=None, hotswap_delays=None, metrics_file=None,
+                 metrics_interval=DEFAULT_EXPORT_INTERVAL):
+        self._init_state(pin_pg, pin_hs, pin_pwm, sdr_cache, fru_cache,
+                         poll_budget, poll_intervals, record, hotswap_delays,
+                         metrics_file, metrics_interval)
+        self.port = port
+        self.target = target
+        self.sensor_period = sensor_period
+        self.interface = AsyncMMCTesterBoard(port=port)
+        self.ipmi = None
+        self.sdr = []
+        self.scheduler = None
+        self.tui = None
+        self._key_commands = []
+
+    def call_later(self, delay, callback):
+        return asyncio.get_running_loop().call_later(delay, callback)
+
+    async def _blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, func, *args)
+
+    def on_key_press(self, key):
+        action = self.key_action(key)
+        if action is not None:
+            self._key_commands.append(action)
+
+    async def setup_pins(self):
+        async with self.interface.arduino.batch() as batch:
+            for pin in self.output_pins():
+                batch.pin_mode(pin, OUTPUT)
+
+    async def read_sensors(self, sdrs):
+        return self.sensor_readings(sdrs, await self.interface
+                                    .send_and_receive_many(
+                                        self.sensor_requests(sdrs)))
+
+    async def show_payload_status(self):
+        self.set_payload_lines(await self.payload_status_batch().flush())
+
+    # the actions of the states are coroutines, they are queued so they
+    # run one after the other, in the order of the transitions
+    def enter_hotswap_state(self, state):
+        self._hotswap_states.put_nowait(state)
+
+    async def _sequence_hotswap(self):
+        while True:
+            state = await self._hotswap_states.get()
+            lines, set_led, payload = HOTSWAP_ACTIONS[state]
+            for line in lines:
+                self.log(line)
+            await self._blocking(set_led, self.ipmi)
+            if payload is not None and self.pin_pg is not None:
+                await self.interface.arduino.digital_write(
+                    self.pin_pg, HIGH if payload else LOW)
+            self.draw(force=True)
+
+    async def _poll_sensors(self):
+        while True:
+            started = time.monotonic()
+            batch = self.scheduler.next_batch(started)
+            if batch:
+                readings = await self.read_sensors([s.sdr for s in batch])
+                self.scheduler.update(batch, readings, started)
+                self.record_batch(batch)
+            self.show_readings(self.scheduler.readings())
+            await self.show_payload_status()
+            self.show_metrics()
+            unprocessed = self.interface.pop_unprocessed_messages()
+            if unprocessed:
+                self.log(f"Unknown messages: {unprocessed}")
+            self.draw()
+            time_to_next = self.scheduler.time_to_next()
+            if time_to_next is None or time_to_next > self.sensor_period:
+                time_to_next = self.sensor_period
+            await asyncio.sleep(time_to_next)
+
+    async def _export(self):
+        while True:
+            await asyncio.sleep(self.exporter.interval)
+            self.export_metrics()
+
+    async def _handle_events(self):
+        async for event in self.interface.events():
+            self.handle_event(event)
+
+    # keys are read when the terminal has input, and every STATUS_PERIOD
+    # to notice resizes
+    async def _handle_keys(self):
+        loop = asyncio.get_running_loop()
+        pressed = asyncio.Event()
+        loop.add_reader(sys.stdin, pressed.set)
+        try:
+            while not self.want_quit:
+                self.tui.process_events()
+                while self._key_commands:
+                    command, args = self._key_commands.pop(0)
+                    await command(*args)
+                if self.want_quit:
+                    break
+                try:
+                    await asyncio.wait_for(pressed.wait(), STATUS_PERIOD)
+                except asyncio.TimeoutError:
+                    pass
+                pressed.clear()
+        finally:
+            loop.remove_reader(sys.stdin)
+
+    async def run(self):
+        async with self.interface:
+            self.ipmi = pyipmi.create_connection(
+                BlockingBridge(self.interface, asyncio.get_running_loop()))
+            self.ipmi.target = pyipmi.Target(self.target)
+            await self._blocking(self.identify)
+            self.sdr = await self._blocking(self.read_sdr)
+            self.luts = sensor_luts(self.sdr)
+            self.scheduler = self.create_scheduler()
+            self.recorder = self.create_recorder()
+            self.exporter = self.create_exporter(self.port, self.target)
+            self._hotswap_states = asyncio.Queue()
+            self.hotswap = self.create_hotswap(
+                asyncio.get_running_loop().call_later)
+            await self.setup_pins()
+            await self._blocking(self.show_general_info)
+            self._init_tui()
+            tasks = [asyncio.create_task(self._poll_sensors()),
+                     asyncio.create_task(self._handle_events()),
+                     asyncio.create_task(self._handle_keys()),
+                     asyncio.create_task(self._sequence_hotswap())]
+            if self.exporter is not None:
+                tasks.append(asyncio.create_task(self._export()))
+            try:
+                done, _ = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                self.tui.quit()
+                self.close_recorder()
+                self.export_metrics()
@@ -1,4 +1,11 @@
 #!/usr/bin/env python
+import time
+
+from pyipmi.errors import IpmiTimeoutError
+
+from mmctester.capture import Capture, capture_command_args
+from mmctester.scan import scan_command_args
+
 LOW = 0x0
 HIGH = 0x1
 INPUT = 0x0
@@ -12,6 +19,11 @@ PIN_A4 = 18
 PIN_A5 = 19
 PIN_A6 = 20
 PIN_A7 = 21
+ERR_NO_COMMAND = 0x85
+# bytes of a local message after the local address and the command byte
+MAX_BATCH_ARGS = 30
+# and of its answer after the command byte and OK
+MAX_BATCH_RESULTS = 29
 
 
 class ArduinoLocalCommand(object):
@@ -21,49 +33,254 @@ class ArduinoLocalCommand(object):
     COMMAND_DIG_READ = 0x03
     COMMAND_AN_WRITE = 0x04
     COMMAND_AN_READ = 0x05
+    COMMAND_SET_FRAMING = 0x06
+    COMMAND_SET_SCAN = 0x07
+    COMMAND_BATCH = 0x08
+    COMMAND_SET_CAPTURE = 0x09
 
-    def __init__(self, send, recv, local_address=0x0):
+    def __init__(self, send, recv, local_address=0x0, metrics=None,
+                 recv_capture=None):
         self.send = send
         self.recv = recv
+        # takes the next capture block, waiting at most a timeout
+        self.recv_capture = recv_capture
         self.local_address = local_address
+        # BoardMetrics counting the commands and their latency
+        self.metrics = metrics
+        # cleared when the firmware turns out not to know the batch command
+        self.batch_supported = True
+
+    def _observe(self, started):
+        if self.metrics is not None:
+            self.metrics.local_commands += 1
+            self.metrics.local_command_seconds.observe(
+                time.perf_counter() - started)
+
+    def _observe_timeout(self):
+        if self.metrics is not None:
+            self.metrics.timeouts += 1
 
     def send_and_receive(self, command):
+        started = time.perf_counter()
         self.send(command)
-        return self.recv()
+        try:
+            ans = self.recv()
+        except IpmiTimeoutError:
+            self._observe_timeout()
+            raise
+        self._observe(started)
+        return ans
 
-    def pin_mode(self, pin, mode):
-        command = bytearray(
-            (self.local_address, self.COMMAND_PIN_MODE, pin, mode))
-        ans = self.send_and_receive(bytes(command))
-        if ans[1] != self.COMMAND_PIN_MODE or ans[2] != self.OK:
+    def _command(self, command_id, *args):
+        return bytes((self.local_address, command_id) + args)
+
+    def _check_answer(self, command_id, ans):
+        if ans[1] != command_id or ans[2] != self.OK:
             raise IOError(f'Invalid answer: {ans}')
+        return ans
+
+    def execute(self, command_id, *args):
+        '''Sends a local command, returns its answer once it is checked.'''
+        ans = self.send_and_receive(self._command(command_id, *args))
+        return self._check_answer(command_id, ans)
+
+    def pin_mode(self, pin, mode):
+        self.execute(self.COMMAND_PIN_MODE, pin, mode)
 
     def digital_write(self, pin, val):
-        command = bytearray(
-            (self.local_address, self.COMMAND_DIG_WRITE, pin, val))
-        ans = self.send_and_receive(bytes(command))
-        if ans[1] != self.COMMAND_DIG_WRITE or ans[2] != self.OK:
-            raise IOError(f'Invalid answer: {ans}')
+        self.execute(self.COMMAND_DIG_WRITE, pin, val)
 
     def digital_read(self, pin):
-        command = bytearray(
-            (self.local_address, self.COMMAND_DIG_READ, pin))
-        ans = self.send_and_receive(bytes(command))
-        if ans[1] != self.COMMAND_DIG_READ or ans[2] != self.OK:
-            raise IOError(f'Invalid answer: {ans}')
-        return ans[3]
+        return self.execute(self.COMMAND_DIG_READ, pin)[3]
 
     def analog_write(self, pin, val):
-        command = bytearray(
-            (self.local_address, self.COMMAND_AN_WRITE, pin, val & 0xff))
-        ans = self.send_and_receive(bytes(command))
-        if ans[1] != self.COMMAND_AN_WRITE or ans[2] != self.OK:
-            raise IOError(f'Invalid answer: {ans}')
+        self.execute(self.COMMAND_AN_WRITE, pin, val & 0xff)
 
     def analog_read(self, pin):
-        command = bytearray(
-            (self.local_address, self.COMMAND_AN_READ, pin))
-        ans = self.send_and_receive(bytes(command))
-        if ans[1] != self.COMMAND_AN_READ or ans[2] != self.OK:
+        return self._analog_value(self.execute(self.COMMAND_AN_READ, pin))
+
+    def set_scan(self, entries, period):
+        '''Makes the board read sensors on its own, see start_scan.'''
+        self.execute(self.COMMAND_SET_SCAN,
+                     *scan_command_args(entries, period))
+
+    def stop_scan(self):
+        self.execute(self.COMMAND_SET_SCAN, 0, 0)
+
+    def start_capture(self, analog=(), digital=(), period=0.001, count=1000,
+                      trigger=None):
+        '''Makes the board sample pins, returns the Capture to fill.
+
+        The board samples the analog and digital pins every period seconds
+        and streams the samples in blocks, receive_capture adds them to the
+        Capture. With a trigger, (pin, 'rising' or 'falling'), sampling
+        starts when the pin changes so, e.g. when the payload is powered.
+        '''
+        args = capture_command_args(analog, digital, period, count, trigger)
+        capture = Capture(analog, digital, period, count)
+        self.execute(self.COMMAND_SET_CAPTURE, *args)
+        return capture
+
+    def stop_capture(self):
+        self.execute(self.COMMAND_SET_CAPTURE, 0, 0, 0, 0, 0, 0)
+
+    def receive_capture(self, capture, timeout=None):
+        '''Adds the blocks that arrive to capture until it is complete.
+
+        Returns False if no block arrived within timeout seconds, the
+        serial timeout by default, the capture is then left running.
+        '''
+        while not capture.complete:
+            try:
+                capture.add_block(self.recv_capture(timeout))
+            except IpmiTimeoutError:
+                return False
+        return True
+
+    def capture(self, analog=(), digital=(), period=0.001, count=1000,
+                trigger=None, timeout=None):
+        '''Samples pins, see start_capture, returns the Capture.
+
+        Stops the capture and returns the samples that arrived if a block
+        takes more than timeout seconds, which includes the wait for the
+        trigger.
+        '''
+        capture = self.start_capture(analog, digital, period, count, trigger)
+        if not self.receive_capture(capture, timeout):
+            self.stop_capture()
+        return capture
+
+    def batch(self):
+        '''Returns a LocalBatch sending pin commands in one round trip.'''
+        return LocalBatch(self)
+
+    @staticmethod
+    def _split_batch(commands):
+        '''Groups commands in batches fitting in a message.'''
+        batches = [[]]
+        nargs = nresults = 0
+        for command in commands:
+            _, args, size = command
+            if nargs + 1 + len(args) > MAX_BATCH_ARGS or \
+                    nresults + size > MAX_BATCH_RESULTS:
+                batches.append([])
+                nargs = nresults = 0
+            batches[-1].append(command)
+            nargs += 1 + len(args)
+            nresults += size
+        return batches
+
+    @staticmethod
+    def _batch_args(commands):
+        args = []
+        for command_id, command_args, _ in commands:
+            args.append(command_id)
+            args.extend(command_args)
+        return args
+
+    def _batch_results(self, commands, ans):
+        ans = self._check_answer(self.COMMAND_BATCH, ans)
+        if len(ans) != 3 + sum(size for _, _, size in commands):
             raise IOError(f'Invalid answer: {ans}')
+        results = []
+        pos = 3
+        for _, _, size in commands:
+            if size == 0:
+                results.append(None)
+            elif size == 1:
+                results.append(ans[pos])
+            else:
+                results.append((ans[pos] & 0xff) | (ans[pos + 1] << 8))
+            pos += size
+        return results
+
+    def _batch_unsupported(self, ans):
+        if len(ans) == 2 and ans[1] == ERR_NO_COMMAND:
+            self.batch_supported = False
+            return True
+        return False
+
+    def _single_result(self, size, ans):
+        if size == 0:
+            return None
+        if size == 1:
+            return ans[3]
+        return self._analog_value(ans)
+
+    def run_batch(self, commands):
+        '''Runs (command id, args, result size) commands, see LocalBatch.
+
+        One at a time if the firmware does not support batches.
+        '''
+        results = []
+        for batch in self._split_batch(commands):
+            if batch and self.batch_supported:
+                ans = self.send_and_receive(self._command(
+                    self.COMMAND_BATCH, *self._batch_args(batch)))
+                if not self._batch_unsupported(ans):
+                    results.extend(self._batch_results(batch, ans))
+                    continue
+            for command_id, args, size in batch:
+                results.append(self._single_result(
+                    size, self.execute(command_id, *args)))
+        return results
+
+    @staticmethod
+    def _analog_value(ans):
         return (ans[3] & 0xff) | (ans[4] << 8)
+
+
+class LocalBatch(object):
+    '''Pin commands queued to be sent in one go.
+
+    The methods of ArduinoLocalCommand which change or read pins queue the
+    command instead, flush sends them in as few batch commands as fit in a
+    message and returns their results: the value of each read, None for
+    the other commands. Used as a context manager it flushes on exit,
+    the results are then in results.
+    '''
+
+    def __init__(self, arduino):
+        self.arduino = arduino
+        # (command id, args, result size)
+        self.commands = []
+        self.results = None
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def pin_mode(self, pin, mode):
+        self.commands.append((ArduinoLocalCommand.COMMAND_PIN_MODE,
+                              (pin, mode), 0))
+
+    def digital_write(self, pin, val):
+        self.commands.append((ArduinoLocalCommand.COMMAND_DIG_WRITE,
+                              (pin, val), 0))
+
+    def digital_read(self, pin):
+        self.commands.append((ArduinoLocalCommand.COMMAND_DIG_READ,
+                              (pin,), 1))
+
+    def analog_write(self, pin, val):
+        self.commands.append((ArduinoLocalCommand.COMMAND_AN_WRITE,
+                              (pin, val & 0xff), 0))
+
+    def analog_read(self, pin):
+        self.commands.append((ArduinoLocalCommand.COMMAND_AN_READ,
+                              (pin,), 2))
+
+    def _take(self):
+        commands = self.commands
+        self.commands = []
+        return commands
+
+    def flush(self):
+        self.results = self.arduino.run_batch(self._take())
+        return self.results
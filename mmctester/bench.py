@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+import argparse
+import itertools
+import json
+import sys
+import time
+
+import pyipmi
+
+from pyipmi.errors import IpmiTimeoutError
+
+from mmctester.cache import SdrCache
+from mmctester.fru import FruReader
+from mmctester.interface import FRAMINGS, MMCTesterBoard
+from mmctester.metrics import rtt_line
+from mmctester.results import format_stats, latency_stats
+from mmctester.sensors import (create_sensor_reading_request,
+                               decode_sensor_reading)
+from mmctester.util import hex_or_int
+
+DEFAULT_TARGET = 0xa2
+WORKLOADS = ('ping', 'sensors', 'fru', 'digital-read', 'analog-read',
+             'mixed')
+DEFAULT_WORKLOADS = ('ping', 'sensors', 'digital-read')
+# workloads taking turns in mixed
+MIXED_WORKLOADS = ('ping', 'sensors', 'ping', 'digital-read', 'ping',
+                   'analog-read')
+DEFAULT_DURATION = 5.0
+# operations run before measuring, e.g. to fill the SDR cache
+WARMUP_OPS = 3
+BASELINE_VERSION = 1
+# relative change of the throughput or the p95 latency reported as a
+# regression
+DEFAULT_TOLERANCE = 0.1
+
+
+class WorkloadResult(object):
+    '''Measurements of a workload run.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.ops = 0
+        self.elapsed = 0.0
+        self.latencies = []
+        self.timeouts = 0
+        self.errors = 0
+        self.retries = 0
+        self.requests = 0
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+
+    def _per_op(self, value):
+        return value / self.ops if self.ops else 0.0
+
+    def to_dict(self):
+        return {
+            'ops': self.ops,
+            'elapsed': self.elapsed,
+            'ops_per_second': self.ops / self.elapsed if self.elapsed else 0,
+            'latency': latency_stats(self.latencies),
+            'requests_per_op': self._per_op(self.requests),
+            'tx_bytes_per_op': self._per_op(self.tx_bytes),
+            'rx_bytes_per_op': self._per_op(self.rx_bytes),
+            'retry_rate': (self.retries / self.requests
+                           if self.requests else 0.0),
+            'timeout_rate': self._per_op(self.timeouts),
+            'error_rate': self._per_op(self.errors),
+        }
+
+    def line(self):
+        d = self.to_dict()
+        text = (f'{self.name}: {self.ops} ops in {self.elapsed:.1f}s, '
+                f'{d["ops_per_second"]:.1f} ops/s')
+        if d['latency'] is not None:
+            text += f', {format_stats(d["latency"])}'
+        text += (f', {d["requests_per_op"]:.1f} requests/op'
+                 f', {d["tx_bytes_per_op"]:.1f} B/op tx'
+                 f' {d["rx_bytes_per_op"]:.1f} B/op rx'
+                 f', retries {d["retry_rate"]:.2%}'
+                 f', timeouts {d["timeout_rate"]:.2%}')
+        if self.errors:
+            text += f', errors {d["error_rate"]:.2%}'
+        return text
+
+
+class Bench(object):
+    '''Runs workloads against a target through the board.'''
+
+    def __init__(self, port, target, framing='auto', window=None, pin=2,
+                 analog_pin=0, sdr_cache=True):
+        self.interface = MMCTesterBoard(port=port, framing=framing)
+        if window is not None:
+            self.interface.pipeline_window = window
+        self.ipmi = pyipmi.create_connection(self.interface)
+        self.ipmi.target = pyipmi.Target(target)
+        self.pin = pin
+        self.analog_pin = analog_pin
+        self.sdr_cache = SdrCache() if sdr_cache else None
+        self._sensor_reqs = None
+        self._mixed = itertools.cycle(MIXED_WORKLOADS)
+        self.workloads = {
+            'ping': self.ping,
+            'sensors': self.sensors,
+            'fru': self.fru,
+            'digital-read': self.digital_read,
+            'analog-read': self.analog_read,
+            'mixed': self.mixed,
+        }
+
+    def ping(self):
+        self.ipmi.get_device_id()
+
+    def sensor_requests(self):
+        if self.sdr_cache is None:
+            sdrs = list(self.ipmi.device_sdr_entries())
+        else:
+            sdrs = self.sdr_cache.device_sdr_entries(self.ipmi)
+        return [create_sensor_reading_request(
+            self.ipmi.target, s.number, getattr(s, 'owner_lun', 0))
+            for s in sdrs
+            if s.type in (pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD,
+                          pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD)]
+
+    # a sweep of all the sensors, pipelined
+    def sensors(self):
+        if self._sensor_reqs is None:
+            self._sensor_reqs = self.sensor_requests()
+        for rsp in self.interface.send_and_receive_many(self._sensor_reqs):
+            decode_sensor_reading(rsp)
+
+    def fru(self):
+        FruReader(self.ipmi).read_fru_data(0)
+
+    def digital_read(self):
+        self.interface.arduino.digital_read(self.pin)
+
+    def analog_read(self):
+        self.interface.arduino.analog_read(self.analog_pin)
+
+    def mixed(self):
+        self.workloads[next(self._mixed)]()
+
+    def run(self, name, duration=DEFAULT_DURATION, count=None):
+        '''Runs a workload for duration seconds or count operations.'''
+        op = self.workloads[name]
+        for _ in range(WARMUP_OPS):
+            try:
+                op()
+            except Exception:
+                pass
+
+        result = WorkloadResult(name)
+        metrics = self.interface.metrics
+        retries = metrics.retries
+        frames_sent = metrics.frames_sent
+        bytes_sent = metrics.bytes_sent
+        bytes_received = metrics.bytes_received
+        started = time.perf_counter()
+        deadline = started + duration
+        while True:
+            op_started = time.perf_counter()
+            try:
+                op()
+            except IpmiTimeoutError:
+                result.timeouts += 1
+            except Exception:
+                result.errors += 1
+            else:
+                result.latencies.append(time.perf_counter() - op_started)
+            result.ops += 1
+            if count is not None:
+                if result.ops >= count:
+                    break
+            elif time.perf_counter() >= deadline:
+                break
+        result.elapsed = time.perf_counter() - started
+        result.retries = metrics.retries - retries
+        result.requests = metrics.frames_sent - frames_sent - result.retries
+        result.tx_bytes = metrics.bytes_sent - bytes_sent
+        result.rx_bytes = metrics.bytes_received - bytes_received
+        return result
+
+    def close(self):
+        self.interface.close_session()
+
+
+def save_baseline(path, results, properties):
+    with open(path, 'w') as f:
+        json.dump({'version': BASELINE_VERSION,
+                   'created': time.time(),
+                   'properties': properties,
+                   'workloads': {r.name: r.to_dict() for r in results}},
+                  f, indent=2)
+        f.write('\n')
+
+
+def _change(value, reference):
+    if not reference:
+        return 0.0
+    return value / reference - 1
+
+
+def compare_baseline(path, results, tolerance=DEFAULT_TOLERANCE):
+    '''Compares results with a saved baseline.
+
+    Returns the comparison lines and whether any workload regressed: lost
+    more than tolerance of its throughput or its p95 latency grew more
+    than tolerance.
+    '''
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get('version') != BASELINE_VERSION:
+        raise ValueError(f'Unknown baseline version in {path}')
+    lines = []
+    regressed = False
+    for result in results:
+        reference = baseline['workloads'].get(result.name)
+        if reference is None:
+            lines.append(f'{result.name}: not in baseline')
+            continue
+        current = result.to_dict()
+        throughput = _change(current['ops_per_second'],
+                             reference['ops_per_second'])
+        text = (f'{result.name}: {current["ops_per_second"]:.1f} ops/s '
+                f'({throughput:+.1%})')
+        worse = throughput < -tolerance
+        if current['latency'] and reference['latency']:
+            p95 = _change(current['latency']['p95'],
+                          reference['latency']['p95'])
+            text += (f', p95 {current["latency"]["p95"] * 1000:.1f}ms '
+                     f'({p95:+.1%})')
+            worse = worse or p95 > tolerance
+        if worse:
+            text += ' REGRESSION'
+            regressed = True
+        lines.append(text)
+    return lines, regressed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measure what the board and a target can sustain')
+    parser.add_argument(
+        '--port', help='Serial port device node e.g. /dev/ttyACM0',
+        required=True)
+    parser.add_argument(
+        '--target', type=hex_or_int, default=DEFAULT_TARGET,
+        help='IPMB address of target device')
+    parser.add_argument(
+        '--workload', choices=WORKLOADS, action='append',
+        help=f'Workload to run, can be repeated, '
+             f'{" ".join(DEFAULT_WORKLOADS)} by default')
+    parser.add_argument(
+        '--duration', type=float, default=DEFAULT_DURATION,
+        help='Seconds to run each workload for')
+    parser.add_argument(
+        '--count', type=int,
+        help='Operations to run of each workload, instead of a duration')
+    parser.add_argument(
+        '--framing', choices=FRAMINGS, default='auto',
+        help='Serial framing, binary if the board supports it by default')
+    parser.add_argument(
+        '--window', type=int,
+        help='Requests in flight of the sensors workload')
+    parser.add_argument(
+        '--pin', type=int, default=2,
+        help='Pin of the digital-read workload')
+    parser.add_argument(
+        '--analog-pin', type=int, default=0,
+        help='Pin of the analog-read workload')
+    parser.add_argument(
+        '--no-sdr-cache', dest='sdr_cache', action='store_false',
+        help="Read the SDRs from the device even if they are cached")
+    parser.add_argument(
+        '--save-baseline', metavar='FILE',
+        help='Save the results to FILE, to compare later runs with them')
+    parser.add_argument(
+        '--baseline', metavar='FILE',
+        help='Compare the results with a baseline saved before, exits with '
+             'an error if a workload regressed')
+    parser.add_argument(
+        '--tolerance', type=float, default=DEFAULT_TOLERANCE * 100,
+        help='Change in percent of the throughput or p95 latency taken as a '
+             'regression')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    bench = Bench(args.port, args.target, args.framing, args.window,
+                  args.pin, args.analog_pin, args.sdr_cache)
+    results = []
+    try:
+        for name in args.workload or DEFAULT_WORKLOADS:
+            result = bench.run(name, args.duration, args.count)
+            print(result.line(), flush=True)
+            results.append(result)
+        for estimator in bench.interface.rtt.snapshot():
+            print(rtt_line(estimator))
+        framing = bench.interface.framing
+    finally:
+        bench.close()
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results,
+                      {'port': args.port, 'target': f'0x{args.target:02x}',
+                       'framing': framing})
+    if args.baseline:
+        lines, regressed = compare_baseline(args.baseline, results,
+                                            args.tolerance / 100)
+        print(f'Compared with {args.baseline}:')
+        for line in lines:
+            print(line)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
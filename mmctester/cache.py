@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+import hashlib
+import json
+import os
+
+from pyipmi.fru import FruInventory
+from pyipmi.logger import log
+from pyipmi.msgs import constants
+from pyipmi.sdr import SdrCommon
+
+from mmctester.fru import FruReader
+
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'mmctester')
+
+
+def device_identity(ipmi):
+    '''Identifies what a target currently provides, None if it can not.
+
+    The Get Device ID response (device, firmware and manufacturer fields)
+    and the Get Device SDR Info response (number of sensors and sensor
+    population change indicator) are enough to tell whether data read from
+    the device before is still valid, for two requests.
+    '''
+    try:
+        device_id = ipmi.send_raw(0, constants.NETFN_APP,
+                                  bytes((constants.CMDID_GET_DEVICE_ID,)))
+        sdr_info = ipmi.send_raw(
+            0, constants.NETFN_SENSOR_EVENT,
+            bytes((constants.CMDID_GET_DEVICE_SDR_INFO, 0x00)))
+    except Exception as e:
+        log().debug('No device identity: %s', e)
+        return None
+    if device_id[0] != constants.CC_OK or sdr_info[0] != constants.CC_OK:
+        return None
+    return [bytes(device_id).hex(), bytes(sdr_info).hex()]
+
+
+class DeviceCache(object):
+    '''Data read from devices, stored on disk per device identity.
+
+    Every entry is a JSON file named after the target address and a digest
+    of the device identity, so different devices, or the same device after
+    a firmware update or a sensor population change, never share an entry.
+    '''
+
+    NAME = None
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = CACHE_DIR
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, address, identity):
+        digest = hashlib.sha1(
+            json.dumps([CACHE_VERSION, identity]).encode()).hexdigest()
+        return os.path.join(self.directory,
+                            f'{self.NAME}-{address:02x}-{digest[:16]}.json')
+
+    def load(self, address, identity):
+        '''Returns the cached data of a device, None if there is none.'''
+        path = self._path(address, identity)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            log().debug('Ignoring cache entry %s: %s', path, e)
+            self.misses += 1
+            return None
+        if entry.get('version') != CACHE_VERSION or \
+                entry.get('identity') != identity:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['data']
+
+    def store(self, address, identity, data):
+        path = self._path(address, identity)
+        entry = {'version': CACHE_VERSION, 'identity': identity,
+                 'data': data}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # a reader never sees a partially written entry, nor do the
+            # writers of several processes share their temporary file
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log().debug('Could not write cache entry %s: %s', path, e)
+
+
+class SdrCache(DeviceCache):
+    '''Device SDRs of the targets, reused while the device is unchanged.'''
+
+    NAME = 'sdr'
+
+    def device_sdr_entries(self, ipmi, identity=None):
+        '''Returns the device SDRs of ipmi.target as a list.
+
+        The records are read from the device only when the cache has none
+        for its current identity, which is requested if it is not given.
+        '''
+        address = ipmi.target.ipmb_address
+        if identity is None:
+            identity = device_identity(ipmi)
+        if identity is not None:
+            records = self.load(address, identity)
+            if records is not None:
+                log().debug('Using cached SDRs of 0x%02x', address)
+                return [SdrCommon.from_data(bytes.fromhex(record))
+                        for record in records]
+
+        sdrs = list(ipmi.device_sdr_entries())
+        if identity is not None:
+            self.store(address, identity,
+                       [bytes(s.data).hex() for s in sdrs])
+        return sdrs
+
+
+class FruCache(DeviceCache):
+    '''FRU inventories of the targets, reused while the device is unchanged.
+
+    A FRU written without a firmware update or a sensor population change
+    keeps the same identity, disable the cache after writing one.
+    '''
+
+    NAME = 'fru'
+
+    def get_fru_inventory(self, ipmi, fru_id=0, identity=None):
+        '''Returns the FRU inventory of ipmi.target.
+
+        The inventory is read with a FruReader only when the cache has none
+        for the current identity of the device.
+        '''
+        address = ipmi.target.ipmb_address
+        if identity is None:
+            identity = device_identity(ipmi)
+        if identity is not None:
+            identity = identity + [fru_id]
+            data = self.load(address, identity)
+            if data is not None:
+                log().debug('Using cached FRU %d of 0x%02x', fru_id, address)
+                return FruInventory(bytes.fromhex(data))
+
+        data = FruReader(ipmi).read_fru_data(fru_id)
+        if identity is not None:
+            self.store(address, identity, data.hex())
+        return FruInventory(data)
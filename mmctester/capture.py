@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+from array import array
+
+# mirrors mmctester-board/commands.h
+CAPTURE_BLOCK = 0x91
+MAX_CAPTURE_PINS = 4
+CAPTURE_ANALOG = 0x80
+CAPTURE_HEADER_SIZE = 6
+CAPTURE_BLOCK_SIZE = 31
+TRIGGER_NONE = 0x00
+TRIGGER_RISING = 0x01
+TRIGGER_FALLING = 0x02
+TRIGGERS = {'rising': TRIGGER_RISING, 'falling': TRIGGER_FALLING}
+MAX_CAPTURE_PERIOD = 0xffff / 1e6
+MAX_CAPTURE_SAMPLES = 0xffff
+# the board time in us wraps around
+TIMESTAMP_MODULO = 1 << 32
+
+
+def capture_command_args(analog, digital, period, count, trigger=None):
+    '''Arguments of the set capture command.
+
+    analog: pins whose analog value is sampled
+    digital: pins whose digital level is sampled
+    period: seconds between two samples
+    count: number of samples, 0 stops the capture
+    trigger: (pin, 'rising' or 'falling') starting the capture when the
+    pin changes so, None to start at once
+    '''
+    pins = [pin | CAPTURE_ANALOG for pin in analog] + list(digital)
+    if count and not pins:
+        raise ValueError('No pins to capture')
+    if len(pins) > MAX_CAPTURE_PINS:
+        raise ValueError(f'At most {MAX_CAPTURE_PINS} pins can be captured')
+    if not 0 <= count <= MAX_CAPTURE_SAMPLES:
+        raise ValueError(f'Invalid number of samples: {count}')
+    period_us = round(period * 1e6)
+    if count and not 0 < period_us <= 0xffff:
+        raise ValueError(f'Invalid capture period: {period}')
+    trigger_pin, trigger_mode = 0, TRIGGER_NONE
+    if trigger is not None:
+        trigger_pin, edge = trigger
+        if edge not in TRIGGERS:
+            raise ValueError(f'Unknown trigger: {edge}')
+        trigger_mode = TRIGGERS[edge]
+    return [period_us & 0xff, period_us >> 8, count & 0xff, count >> 8,
+            trigger_pin, trigger_mode] + pins
+
+
+def sample_size(analog, digital):
+    return 2 * len(analog) + (1 if digital else 0)
+
+
+class Capture(object):
+    '''Samples of a capture, in arrays.
+
+    times holds the seconds of each sample since the first one, which is
+    the trigger if there was one. analog and digital hold the values of
+    each pin by pin number, an array per pin in the order of the samples.
+    Blocks lost by the board are counted in lost_blocks, the times of the
+    samples after them are still right.
+    '''
+
+    def __init__(self, analog, digital, period, count):
+        self.analog_pins = list(analog)
+        self.digital_pins = list(digital)
+        # as the board keeps it, in us
+        self.period = round(period * 1e6) / 1e6
+        self.count = count
+        self.times = array('d')
+        self.analog = {pin: array('H') for pin in self.analog_pins}
+        self.digital = {pin: array('B') for pin in self.digital_pins}
+        self.lost_blocks = 0
+        self._sample_size = sample_size(analog, digital)
+        self._first_timestamp = None
+        self._next_sequence = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return (f'Capture(samples={len(self)}/{self.count}, '
+                f'period={self.period}, lost_blocks={self.lost_blocks})')
+
+    @property
+    def complete(self):
+        '''True once all the samples arrived or were lost.
+
+        Lost blocks are taken as full.
+        '''
+        per_block = (CAPTURE_BLOCK_SIZE - CAPTURE_HEADER_SIZE) // \
+            self._sample_size
+        return len(self) + self.lost_blocks * per_block >= self.count
+
+    def add_block(self, data):
+        '''Adds the samples of a block frame, with its LOCAL_ADDR.'''
+        sequence = data[2]
+        self.lost_blocks += (sequence - self._next_sequence) % 256
+        self._next_sequence = (sequence + 1) % 256
+        timestamp = int.from_bytes(data[3:7], 'little')
+        if self._first_timestamp is None:
+            self._first_timestamp = timestamp
+        start = (timestamp - self._first_timestamp) % TIMESTAMP_MODULO / 1e6
+        samples = memoryview(data)[1 + CAPTURE_HEADER_SIZE:]
+        nsamples = len(samples) // self._sample_size
+        for i in range(nsamples):
+            sample = samples[i * self._sample_size:
+                             (i + 1) * self._sample_size]
+            self.times.append(start + i * self.period)
+            for j, pin in enumerate(self.analog_pins):
+                self.analog[pin].append(
+                    sample[2 * j] | (sample[2 * j + 1] << 8))
+            if self.digital_pins:
+                bits = sample[-1]
+                for j, pin in enumerate(self.digital_pins):
+                    self.digital[pin].append((bits >> j) & 1)
+
+    def first_time(self, values, level, rising=True):
+        '''Time of the first sample reaching level, None if none does.
+
+        values: one of the arrays of analog or digital
+        rising: reaching is being at or above level, else at or below it
+        '''
+        for time, value in zip(self.times, values):
+            if (value >= level) if rising else (value <= level):
+                return time
+        return None
+
+    def rows(self):
+        '''(time, analog values ..., digital values ...) of each sample.'''
+        columns = [self.analog[pin] for pin in self.analog_pins] + \
+            [self.digital[pin] for pin in self.digital_pins]
+        return zip(self.times, *columns)
+
+
+# the functions below mirror mmctester-board/commands.cpp for the emulator
+def capture_block(sequence, timestamp_us, samples):
+    '''Block frame without LOCAL_ADDR, samples is the encoded samples.'''
+    return bytes((CAPTURE_BLOCK, sequence & 0xff)) + \
+        (timestamp_us & 0xffffffff).to_bytes(4, 'little') + bytes(samples)
+
+
+def encode_sample(analog_values, digital_values):
+    sample = bytearray()
+    for value in analog_values:
+        sample.extend((value & 0xff, (value >> 8) & 0xff))
+    if digital_values:
+        sample.append(sum(1 << i for i, level in enumerate(digital_values)
+                          if level))
+    return bytes(sample)
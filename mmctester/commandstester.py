@@ -1,183 +1,206 @@
 #!/usr/bin/env python
 import argparse
+import sys
+import time
 
 import pyipmi
-import pyipmi.interfaces
 import pyipmi.msgs.picmg
 from pyipmi.utils import check_completion_code
 
+from mmctester.cache import SdrCache
 from mmctester.interface import MMCTesterBoard
 from mmctester.led import set_led_long
+from mmctester.mch import bridged_target, open_rmcp_session
+from mmctester.results import (CheckResult, Suite, format_stats,
+                               text_output, write_json, write_junit)
 from mmctester.util import hex_or_int
 
 DEFAULT_TARGET = 0xa2
 
 
+def create_target_connection(port_or_ip, target, interface=None):
+    '''Connection to target through a board or bridged by a MCH.
+
+    port_or_ip: serial port of the board or IP of the MCH
+    interface: used instead of opening one, e.g. a MchSessionPool
+    '''
+    local = port_or_ip.startswith('/dev/')
+    if interface is None:
+        if local:
+            interface = MMCTesterBoard(port=port_or_ip)
+        else:
+            interface = open_rmcp_session(port_or_ip)
+    ipmi = pyipmi.create_connection(interface)
+    if local:
+        ipmi.target = pyipmi.Target(target)
+    else:
+        ipmi.target = bridged_target(target)
+    return ipmi
+
+
+class SkipCheck(Exception):
+    '''Raised by a check that can not be done on the target.'''
+
+
 class CommandsTester(object):
-    def __init__(self, port_or_ip: str, target: str):
-        if port_or_ip.startswith('/dev/'):
-            self.interface = MMCTesterBoard(port=port_or_ip)
-            self.ipmi = pyipmi.create_connection(self.interface)
-            self.ipmi.target = pyipmi.Target(target)
+    '''Checks the most important IPMI commands of a target.
+
+    The outcome of each check is printed to output, unless it is None, and
+    recorded in results.
+    '''
+
+    def __init__(self, port_or_ip: str, target: str, sdr_cache=True,
+                 output=sys.stdout, interface=None, repeat=1):
+        self.output = output
+        self.repeat = repeat
+        self.results = []
+        self.sdr_cache = SdrCache() if sdr_cache else None
+        # a shared interface, e.g. a MchSessionPool, is closed by its owner
+        self._owns_interface = interface is None
+        self.ipmi = create_target_connection(port_or_ip, target, interface)
+        self.interface = self.ipmi.interface
+
+    def _print(self, *args, **kwargs):
+        if self.output is not None:
+            print(*args, file=self.output, **kwargs)
+
+    # runs a check repeat times, prints and records its outcome, returns
+    # what func returned the last time it succeeded
+    # prepare: called once before, untimed, returns the func to time, e.g.
+    # after looking up what the command needs
+    def _check(self, name, func=None, show=False, prepare=None):
+        self._print(f'{name}: ', end='')
+        result = CheckResult(name, True, completion_code=0, attempts=0)
+        retries = getattr(self.interface, 'retries', None)
+        value = None
+        started = time.perf_counter()
+        for _ in range(self.repeat):
+            result.attempts += 1
+            attempt_started = time.perf_counter()
+            try:
+                if prepare is not None:
+                    func = prepare()
+                    prepare = None
+                    attempt_started = time.perf_counter()
+                value = func()
+            except SkipCheck as e:
+                result.ok = None
+                result.detail = str(e)
+                result.completion_code = None
+                break
+            except Exception as e:
+                result.ok = False
+                result.failures += 1
+                result.detail = str(e)
+                result.completion_code = getattr(e, 'cc', None)
+                if prepare is not None:
+                    break
+                continue
+            result.latencies.append(time.perf_counter() - attempt_started)
+        result.duration = time.perf_counter() - started
+        if retries is not None:
+            result.retries = self.interface.retries - retries
+        self.results.append(result)
+
+        if result.ok is None:
+            self._print(result.detail)
+            return None
+        if result.ok:
+            self._print('OK', end='')
+        elif result.failures < result.attempts:
+            self._print(f'FAIL ({result.failures}/{result.attempts}, '
+                        f'{result.detail})', end='')
         else:
-            self.interface = pyipmi.interfaces.create_interface(
-                interface='rmcp', slave_address=0x81, host_target_address=0x20)
-            self.ipmi = pyipmi.create_connection(self.interface)
-            self.ipmi.session.set_session_type_rmcp(host=port_or_ip, port=623)
-            self.ipmi.session.set_auth_type_user(username='', password='')
-            self.ipmi.target = pyipmi.Target(
-                ipmb_address=target,
-                routing=[(0x81, 0x20, 0),
-                         (0x20, 0x82, 7),
-                         (0x82, target, None)])
-            self.ipmi.session.establish()
+            self._print(f'FAIL ({result.detail})', end='')
+        if self.repeat > 1 and result.latencies:
+            self._print(f' {format_stats(result.stats())}', end='')
+        self._print()
+        if show and result.latencies:
+            self._print(value)
+        return value if result.latencies else None
 
     def try_get_device_id(self):
-        print('Get Device ID: ', end='')
-        try:
-            device_id = self.ipmi.get_device_id()
-            print('OK')
-            print(device_id)
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Get Device ID', self.ipmi.get_device_id,
+                           show=True)
 
     def try_get_device_guid(self):
-        print('Get Device GUID: ', end='')
-        try:
-            guid = self.ipmi.get_device_guid()
-            print('OK')
-            print(guid)
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Get Device GUID', self.ipmi.get_device_guid,
+                           show=True)
 
     def try_get_fru_data(self):
-        print('Get FRU Data: ', end='')
-        try:
-            self.ipmi.get_fru_inventory_header(0)
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Get FRU Data',
+                           lambda: self.ipmi.get_fru_inventory_header(0))
 
     def try_get_sdr_repository_info(self):
-        print('Get SDR Repository Info: ', end='')
-        try:
-            self.ipmi.get_sdr_repository_info()
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Get SDR Repository Info',
+                           self.ipmi.get_sdr_repository_info)
 
     def try_get_sdr_repository_allocation_info(self):
-        print('Get SDR Repository Allocation Info: ', end='')
-        try:
-            self.ipmi.get_sdr_repository_allocation_info()
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Get SDR Repository Allocation Info',
+                           self.ipmi.get_sdr_repository_allocation_info)
 
     def try_reserve_sdr_repository(self):
-        print('Reserve SDR Repository: ', end='')
-        try:
-            self.ipmi.reserve_sdr_repository()
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Reserve SDR Repository',
+                           self.ipmi.reserve_sdr_repository)
 
     def try_get_sdr(self):
-        print('Get SDR: ', end='')
-        try:
-            next(self.ipmi.sdr_repository_entries())
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Get SDR',
+                           lambda: next(self.ipmi.sdr_repository_entries()))
 
     def try_reserve_device_sdr_repository(self):
-        print('Reserve SDR Repository: ', end='')
-        try:
-            self.ipmi.reserve_device_sdr_repository()
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Reserve SDR Repository',
+                           self.ipmi.reserve_device_sdr_repository)
 
     def try_get_device_sdr(self):
-        print('Get Device SDR: ', end='')
-        try:
-            next(self.ipmi.device_sdr_entries())
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Get Device SDR',
+                           lambda: next(self.ipmi.device_sdr_entries()))
 
-    def try_get_sensor_reading(self):
-        print('Get Sensor Reading: ', end='')
-        try:
-            sdr = None
-            for item in self.ipmi.device_sdr_entries():
-                if hasattr(item, 'number'):
-                    sdr = item
-                    break
+    # the reading of the first sensor, looked up once
+    def _sensor_reading_func(self):
+        sdr = None
+        if self.sdr_cache is None:
+            sdrs = self.ipmi.device_sdr_entries()
+        else:
+            sdrs = self.sdr_cache.device_sdr_entries(self.ipmi)
+        for item in sdrs:
+            if hasattr(item, 'number'):
+                sdr = item
+                break
+
+        if sdr is None:
+            raise SkipCheck('No readable sensor found')
+        return lambda: self.ipmi.get_sensor_reading(sdr.number, sdr.owner_lun)
 
-            if sdr and hasattr(sdr, 'number'):
-                self.ipmi.get_sensor_reading(sdr.number, sdr.owner_lun)
-                print('OK')
-            else:
-                print('No readable sensor found')
-        except Exception as e:
-            print(f'FAIL ({e})')
+    def try_get_sensor_reading(self):
+        return self._check('Get Sensor Reading',
+                           prepare=self._sensor_reading_func)
 
     def try_fru_control_warm_reset(self):
-        print('FRU Control Warm Reset: ', end='')
-        try:
-            self.ipmi.fru_control_warm_reset()
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('FRU Control Warm Reset',
+                           self.ipmi.fru_control_warm_reset)
 
     def try_fru_control_cold_reset(self):
-        print('FRU Control Cold Reset: ', end='')
-        try:
-            self.ipmi.fru_control_cold_reset()
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('FRU Control Cold Reset',
+                           self.ipmi.fru_control_cold_reset)
 
     def try_fru_control_graceful_reboot(self):
-        print('FRU Control Graceful Reboot: ', end='')
-        try:
-            self.ipmi.fru_control_graceful_reboot()
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('FRU Control Graceful Reboot',
+                           self.ipmi.fru_control_graceful_reboot)
 
     def try_set_event_receiver(self):
-        print('Set Event Receiver: ', end='')
-        try:
-            self.ipmi.set_event_receiver(0x20, 0)
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Set Event Receiver',
+                           lambda: self.ipmi.set_event_receiver(0x20, 0))
 
     def try_get_event_receiver(self):
-        print('Get Event Receiver: ', end='')
-        try:
-            self.ipmi.get_event_receiver()
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Get Event Receiver',
+                           self.ipmi.get_event_receiver)
 
     def try_get_picmg_properties(self):
-        print('Get PICMG Properties: ', end='')
-        try:
-            self.ipmi.get_picmg_properties()
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Get PICMG Properties',
+                           self.ipmi.get_picmg_properties)
 
     def try_set_led_state(self):
-        print('Set LED State: ', end='')
-        try:
-            set_led_long(self.ipmi)
-            print('OK')
-        except Exception as e:
-            print(f'FAIL ({e})')
+        return self._check('Set LED State', lambda: set_led_long(self.ipmi))
 
     def run(self):
         self.try_get_device_id()
@@ -197,6 +220,11 @@ class CommandsTester(object):
         # self.try_fru_control_cold_reset()
         # self.try_fru_control_warm_reset()
         # self.try_fru_control_graceful_reboot()
+        return self.results
+
+    def close(self):
+        if self._owns_interface:
+            self.interface.close_session()
 
 
 def parse_args():
@@ -207,13 +235,37 @@ def parse_args():
     parser.add_argument(
         '--target', type=hex_or_int, default=DEFAULT_TARGET,
         help="IPMB address of target device")
+    parser.add_argument(
+        '--no-sdr-cache', dest='sdr_cache', action='store_false',
+        help="Read the SDRs from the device even if they are cached")
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='Run every command REPEAT times and print latency statistics')
+    parser.add_argument(
+        '--json', metavar='FILE',
+        help='Write the results as JSON to FILE, - for standard output')
+    parser.add_argument(
+        '--junit', metavar='FILE',
+        help='Write the results as JUnit XML to FILE, - for standard output')
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    main = CommandsTester(args.port, args.target)
-    main.run()
+    main = CommandsTester(args.port, args.target, args.sdr_cache,
+                          output=text_output(args.json, args.junit),
+                          repeat=max(1, args.repeat))
+    try:
+        results = main.run()
+    finally:
+        main.close()
+    suites = [Suite(f'{args.port} 0x{args.target:02x}', results,
+                    {'port': args.port, 'target': f'0x{args.target:02x}',
+                     'repeat': main.repeat})]
+    if args.json:
+        write_json(args.json, suites)
+    if args.junit:
+        write_junit(args.junit, suites)
 
 
 if __name__ == '__main__':
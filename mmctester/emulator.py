@@ -0,0 +1,903 @@
+#!/usr/bin/env python
+import argparse
+import heapq
+import itertools
+import math
+import os
+import pty
+import random
+import select
+import threading
+import time
+import tty
+
+from pyipmi.interfaces.ipmb import IpmbHeaderReq, checksum
+from pyipmi.logger import log
+from pyipmi.msgs import constants
+from pyipmi.sensor import SENSOR_TYPE_MODULE_HOT_SWAP
+
+from mmctester.arduino import (HIGH, LOW, MAX_BATCH_RESULTS,
+                               ArduinoLocalCommand)
+from mmctester.capture import (CAPTURE_ANALOG, CAPTURE_BLOCK_SIZE,
+                               CAPTURE_HEADER_SIZE, MAX_CAPTURE_PINS,
+                               TRIGGER_FALLING, TRIGGER_NONE, TRIGGER_RISING,
+                               capture_block, encode_sample)
+from mmctester.framing import (FRAME_OVERHEAD, FRAME_START, FRAMING_BINARY,
+                               FRAMING_HEX, BinaryFraming, HexFraming,
+                               frame_checksum)
+from mmctester.scan import (MAX_SCAN_ENTRIES, is_scan_response,
+                            scan_request, scan_result)
+from mmctester.util import hex_or_int, hex_to_bin
+
+# mirrors mmctester-board/commands.h and mmctester-board.ino
+IPMB_ADDR = 0x20
+LOCAL_ADDR = 0x00
+MAX_I2C_MSG_SIZE = 32
+MAX_SERIAL_MSG_SIZE = MAX_I2C_MSG_SIZE * 3
+TERMINATOR = b'\n'
+SCAN_RESPONSE_TIMEOUT = 0.05
+ERR_INVALID_FORMAT = 0x81
+ERR_NO_DATA = 0x83
+ERR_NO_COMMAND = 0x85
+ERR_TOO_LONG = 0x86
+# arguments and result bytes of the commands allowed in a batch
+BATCH_OPS = {
+    ArduinoLocalCommand.COMMAND_PIN_MODE: (2, 0),
+    ArduinoLocalCommand.COMMAND_DIG_WRITE: (2, 0),
+    ArduinoLocalCommand.COMMAND_DIG_READ: (1, 1),
+    ArduinoLocalCommand.COMMAND_AN_WRITE: (2, 0),
+    ArduinoLocalCommand.COMMAND_AN_READ: (1, 2),
+}
+
+DEFAULT_TARGET = 0xa2
+# seconds the emulated payload rail takes to reach full scale
+RAIL_RAMP_TIME = 0.01
+ANALOG_FULL_SCALE = 1023
+UART_BITS_PER_BYTE = 10
+I2C_BITS_PER_BYTE = 9
+
+CC_OK = constants.CC_OK
+CC_INV_CMD = constants.CC_INV_CMD
+CC_CANT_RET_NUM_REQ_BYTES = constants.CC_CANT_RET_NUM_REQ_BYTES
+CC_PARAM_OUT_OF_RANGE = constants.CC_PARAM_OUT_OF_RANGE
+CC_REQ_DATA_NOT_PRESENT = constants.CC_REQ_DATA_NOT_PRESENT
+
+HEX_LOWER = b'0123456789abcdef'
+HS_HANDLE_CLOSED = 0
+HS_HANDLE_OPEN = 1
+
+
+def type_length_string(string):
+    data = string.encode()
+    return bytes([0xc0 | len(data)]) + data
+
+
+def is_hex_line(line):
+    '''Mirrors is_hex_line of mmctester-board/utils.cpp.'''
+    digits = line.translate(None, b' \r\n')
+    return bool(digits) and not digits.translate(None, HEX_LOWER)
+
+
+class EmulatedSensor(object):
+    '''Sensor of the emulated MMC.
+
+    Full sensor records use `M * raw * 10^K2` to convert raw readings, the
+    raw reading is produced by `reading(now)`.
+    '''
+
+    def __init__(self, number, name, reading, m=1, k2=0, sensor_type=0x01,
+                 compact=False):
+        self.number = number
+        self.name = name
+        self.reading = reading
+        self.m = m
+        self.k2 = k2
+        self.sensor_type = sensor_type
+        self.compact = compact
+
+    def sdr(self, record_id, owner_id):
+        name = type_length_string(self.name)
+        if self.compact:
+            body = bytes((
+                owner_id, 0, self.number,
+                0xc1, 0x00,  # entity id, instance
+                0x7f, 0x68, self.sensor_type, 0x6f,
+                0x03, 0x00, 0x03, 0x00, 0x03, 0x00,  # event masks
+                0x00, 0x00, 0x00,  # units
+                0x00, 0x00,  # record sharing
+                0x00, 0x00,  # hysteresis
+                0x00, 0x00, 0x00, 0x00))  # reserved, oem
+            sdr_type = 0x02
+        else:
+            body = bytes((
+                owner_id, 0, self.number,
+                0xc1, 0x00,  # entity id, instance
+                0x7f, 0x68, self.sensor_type, 0x01,
+                0x00, 0x00, 0x00, 0x00, 0x00, 0x00,  # event masks
+                0x00, 0x00, 0x00,  # units
+                0x00,  # linear
+                self.m & 0xff, (self.m >> 2) & 0xc0,
+                0x00, 0x00, 0x00,  # B, accuracy
+                (self.k2 & 0xf) << 4,
+                0x00,  # analog characteristics
+                0x00, 0x00, 0x00, 0xff, 0x00,  # nominal, normal, sensor range
+                0xff, 0xff, 0xff, 0x00, 0x00, 0x00,  # thresholds
+                0x00, 0x00,  # hysteresis
+                0x00, 0x00, 0x00))  # reserved, oem
+            sdr_type = 0x01
+        body += name
+        header = bytes((record_id & 0xff, record_id >> 8, 0x51, sdr_type,
+                        len(body)))
+        return header + body
+
+
+class MMCModel(object):
+    '''Scripted MMC behind the emulated board.
+
+    It answers the IPMI commands used by mmctester and mmccommandstester
+    and generates hot-swap Platform Events when the handle changes.
+    '''
+
+    def __init__(self, address=DEFAULT_TARGET, board_address=IPMB_ADDR,
+                 max_msg_size=MAX_I2C_MSG_SIZE):
+        self.address = address
+        self.board_address = board_address
+        self.max_msg_size = max_msg_size
+        self.start_time = time.monotonic()
+        self.handle = HS_HANDLE_OPEN
+        self.payload_power = False
+        self.led = (0, 0)
+        self.next_seq = 0
+        self.reservation_id = 1
+        self.sdr_change_indicator = int(time.time())
+        self.sensors = [
+            EmulatedSensor(1, 'HOTSWAP AMC', self._hotswap_reading,
+                           sensor_type=SENSOR_TYPE_MODULE_HOT_SWAP,
+                           compact=True),
+            EmulatedSensor(2, 'P12V', self._p12v_reading, m=6, k2=-2,
+                           sensor_type=0x02),
+            EmulatedSensor(3, 'P3V3', self._p3v3_reading, m=2, k2=-2,
+                           sensor_type=0x02),
+            EmulatedSensor(4, 'TEMP UC', self._temp_reading, m=5, k2=-1),
+        ]
+        self._sdrs = [s.sdr(i, address) for i, s in enumerate(self.sensors)]
+        self.fru = self._build_fru()
+        self.handlers = {
+            (constants.NETFN_APP, constants.CMDID_GET_DEVICE_ID):
+                self._get_device_id,
+            (constants.NETFN_APP, constants.CMDID_GET_DEVICE_GUID):
+                self._get_device_guid,
+            (constants.NETFN_SENSOR_EVENT, constants.CMDID_SET_EVENT_RECEIVER):
+                self._ok,
+            (constants.NETFN_SENSOR_EVENT, constants.CMDID_GET_EVENT_RECEIVER):
+                lambda data: bytes((CC_OK, self.board_address, 0)),
+            (constants.NETFN_SENSOR_EVENT,
+             constants.CMDID_GET_DEVICE_SDR_INFO):
+                self._get_device_sdr_info,
+            (constants.NETFN_SENSOR_EVENT,
+             constants.CMDID_RESERVE_DEVICE_SDR_REPOSITORY):
+                self._reserve_device_sdr_repository,
+            (constants.NETFN_SENSOR_EVENT, constants.CMDID_GET_DEVICE_SDR):
+                self._get_device_sdr,
+            (constants.NETFN_SENSOR_EVENT, constants.CMDID_GET_SENSOR_READING):
+                self._get_sensor_reading,
+            (constants.NETFN_STORAGE,
+             constants.CMDID_GET_FRU_INVENTORY_AREA_INFO):
+                lambda data: bytes((CC_OK, len(self.fru) & 0xff,
+                                    len(self.fru) >> 8, 0)),
+            (constants.NETFN_STORAGE, constants.CMDID_READ_FRU_DATA):
+                self._read_fru_data,
+            (constants.NETFN_GROUP_EXTENSION,
+             constants.CMDID_GET_PICMG_PROPERTIES):
+                lambda data: bytes((CC_OK, 0x00, 0x14, 0x00, 0x00)),
+            (constants.NETFN_GROUP_EXTENSION,
+             constants.CMDID_SET_FRU_LED_STATE):
+                self._set_fru_led_state,
+            (constants.NETFN_GROUP_EXTENSION, constants.CMDID_FRU_CONTROL):
+                lambda data: bytes((CC_OK, 0x00)),
+        }
+
+    @staticmethod
+    def _build_fru():
+        fields = b''.join(type_length_string(s) for s in (
+            'EMULATOR', 'MMCEMULATOR', 'MMCEMULATOR:1.0', '1.0', 'EMU0001',
+            '', ''))
+        area = bytes((0x01, 0x00, 0x00)) + fields + b'\xc1'
+        area += bytes(-(len(area) + 1) % 8)
+        area = bytearray(area + b'\x00')
+        area[1] = len(area) // 8
+        area[-1] = checksum(area[:-1])
+        header = bytearray((0x01, 0x00, 0x00, 0x00, 0x01, 0x00, 0x00))
+        header.append(checksum(header))
+        return bytes(header + area)
+
+    def _uptime(self, now):
+        return now - self.start_time
+
+    def _hotswap_reading(self, now):
+        return 0, 1 << self.handle
+
+    def _p12v_reading(self, now):
+        return (200 if self.payload_power else 0), 0
+
+    def _p3v3_reading(self, now):
+        return 165, 0
+
+    def _temp_reading(self, now):
+        return int(45 + 4 * math.sin(self._uptime(now) / 30)), 0
+
+    @staticmethod
+    def _ok(data):
+        return bytes((CC_OK,))
+
+    def _get_device_id(self, data):
+        return bytes((CC_OK, 0x00, 0x80, 0x01, 0x10, 0x02, 0x29,
+                      0x5a, 0x31, 0x00, 0x00, 0x00))
+
+    def _get_device_guid(self, data):
+        return bytes((CC_OK,)) + bytes(range(16))
+
+    def _get_device_sdr_info(self, data):
+        change = self.sdr_change_indicator
+        return bytes((CC_OK, len(self.sensors), 0x01)) + \
+            change.to_bytes(4, 'little')
+
+    def _reserve_device_sdr_repository(self, data):
+        self.reservation_id = (self.reservation_id % 0xffff) + 1
+        return bytes((CC_OK, self.reservation_id & 0xff,
+                      self.reservation_id >> 8))
+
+    def _get_device_sdr(self, data):
+        if len(data) != 6:
+            return bytes((constants.CC_REQ_DATA_INV_LENGTH,))
+        record_id = data[2] | (data[3] << 8)
+        offset = data[4]
+        count = data[5]
+        if record_id >= len(self._sdrs):
+            return bytes((CC_REQ_DATA_NOT_PRESENT,))
+        record = self._sdrs[record_id]
+        if count == 0xff:
+            count = len(record) - offset
+        # header, completion code, next record id and checksum
+        if count + 10 > self.max_msg_size:
+            return bytes((CC_CANT_RET_NUM_REQ_BYTES,))
+        next_id = record_id + 1 if record_id + 1 < len(self._sdrs) else 0xffff
+        return bytes((CC_OK, next_id & 0xff, next_id >> 8)) + \
+            record[offset:offset + count]
+
+    def _read_fru_data(self, data):
+        if len(data) != 4:
+            return bytes((constants.CC_REQ_DATA_INV_LENGTH,))
+        offset = data[1] | (data[2] << 8)
+        count = data[3]
+        if offset >= len(self.fru):
+            return bytes((CC_PARAM_OUT_OF_RANGE,))
+        # header, completion code, count and checksum
+        if count + 9 > self.max_msg_size:
+            return bytes((CC_CANT_RET_NUM_REQ_BYTES,))
+        chunk = self.fru[offset:offset + count]
+        return bytes((CC_OK, len(chunk))) + chunk
+
+    def _get_sensor_reading(self, data):
+        if len(data) != 1:
+            return bytes((constants.CC_REQ_DATA_INV_LENGTH,))
+        for sensor in self.sensors:
+            if sensor.number == data[0]:
+                raw, states = sensor.reading(time.monotonic())
+                return bytes((CC_OK, raw & 0xff, 0xc0, states & 0xff,
+                              0x80 | (states >> 8)))
+        return bytes((CC_REQ_DATA_NOT_PRESENT,))
+
+    def _set_fru_led_state(self, data):
+        if len(data) != 6:
+            return bytes((constants.CC_REQ_DATA_INV_LENGTH,))
+        self.led = (data[3], data[4])
+        return bytes((CC_OK, 0x00))
+
+    def handle_message(self, msg):
+        '''Process a message written by the board, returns the answer.'''
+        if len(msg) < 7 or checksum(msg[0:3]) or checksum(msg[3:]):
+            log().debug('MMC: invalid message [%s]', msg.hex())
+            return None
+
+        header = IpmbHeaderReq(msg)
+        if header.netfn & 1:
+            # acknowledge of one of our requests (Platform Event)
+            return None
+
+        handler = self.handlers.get((header.netfn, header.cmdid))
+        if handler is None:
+            rsp_data = bytes((CC_INV_CMD,))
+        else:
+            rsp_data = handler(msg[6:-1])
+
+        rsp = bytearray((
+            header.rq_sa,
+            ((header.netfn | 1) << 2) | header.rq_lun))
+        rsp.append(checksum(rsp))
+        rsp.extend((self.address, (header.rq_seq << 2) | header.rs_lun,
+                    header.cmdid))
+        rsp.extend(rsp_data)
+        rsp.append(checksum(rsp[3:]))
+        return bytes(rsp)
+
+    def set_handle(self, handle):
+        '''Change the handle state, returns the Platform Event message.'''
+        if handle == self.handle:
+            return None
+        self.handle = handle
+        hs_sensor = self.sensors[0]
+        msg = bytearray((
+            self.board_address, constants.NETFN_SENSOR_EVENT << 2))
+        msg.append(checksum(msg))
+        msg.extend((self.address, self.next_seq << 2,
+                    constants.CMDID_PLATFORM_EVENT,
+                    0x04, hs_sensor.sensor_type, hs_sensor.number, 0x6f,
+                    handle, 0xff, 0xff))
+        msg.append(checksum(msg[3:]))
+        self.next_seq = (self.next_seq + 1) % 64
+        return bytes(msg)
+
+
+class BoardEmulator(object):
+    '''Emulated mmctester-board on a pseudo-terminal.
+
+    Speaks the serial protocol of mmctester-board.ino on the slave side of
+    a pty and forwards IPMB messages to an `MMCModel`. Serial and I2C
+    transfer times are simulated from the configured bit rates, so request
+    rates measured against the emulator are reproducible.
+    '''
+
+    def __init__(self, mmc=None, bitrate=115200, i2c_bitrate=100000,
+                 i2c_delay=0.001, drop_rate=0.0, corrupt_rate=0.0,
+                 event_delay=0.05, pin_hs=None, pin_pg=None, seed=None,
+                 binary_framing=True, batch=True, pin_rail=None):
+        self.mmc = mmc or MMCModel()
+        self.bitrate = bitrate
+        self.i2c_bitrate = i2c_bitrate
+        self.i2c_delay = i2c_delay
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.event_delay = event_delay
+        self.pin_hs = pin_hs
+        self.pin_pg = pin_pg
+        self.pin_rail = pin_rail
+        self._power_on = None
+        self.random = random.Random(seed)
+        self.pins = {}
+        self.analog_values = {}
+        self.stats = dict(rx_frames=0, tx_frames=0, i2c_requests=0,
+                          dropped=0, corrupted=0)
+        self.master = None
+        self.slave = None
+        self.port = None
+        self._rx_buffer = bytearray()
+        self._frame_buffer = None
+        self._rx_discard = False
+        self.framing = FRAMING_HEX
+        self.encoders = {FRAMING_HEX: HexFraming(),
+                         FRAMING_BINARY: BinaryFraming()}
+        self._rx_free = 0.0
+        self._tx_free = 0.0
+        self._i2c_free = 0.0
+        self._timers = []
+        self._timer_ids = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = time.monotonic()
+        self.scan_entries = []
+        self.scan_period = 0.0
+        self._scan_index = 0
+        self._scan_waiting = False
+        self._scan_sweep = 0.0
+        self._scan_sent = 0.0
+        self._scan_wake = None
+        self.capture_pins = []
+        self.capture_period = 0.0
+        self.capture_remaining = 0
+        self._capture_trigger = None
+        self._capture_sequence = 0
+        self._capture_generation = 0
+        self.commands = {
+            ArduinoLocalCommand.COMMAND_PIN_MODE: self._pin_mode,
+            ArduinoLocalCommand.COMMAND_DIG_WRITE: self._dig_write,
+            ArduinoLocalCommand.COMMAND_DIG_READ: self._dig_read,
+            ArduinoLocalCommand.COMMAND_AN_WRITE: self._an_write,
+            ArduinoLocalCommand.COMMAND_AN_READ: self._an_read,
+            ArduinoLocalCommand.COMMAND_SET_SCAN: self._set_scan,
+            ArduinoLocalCommand.COMMAND_SET_CAPTURE: self._set_capture,
+        }
+        if binary_framing:
+            self.commands[ArduinoLocalCommand.COMMAND_SET_FRAMING] = \
+                self._set_framing
+        if batch:
+            self.commands[ArduinoLocalCommand.COMMAND_BATCH] = self._batch
+
+    def open(self):
+        '''Create the pty, returns the path to pass as --port.'''
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        return self.port
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def start(self):
+        '''Serve in a background thread, returns the port path.'''
+        if self.master is None:
+            self.open()
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, when, callback, *args):
+        heapq.heappush(self._timers, (when, next(self._timer_ids),
+                                      callback, args))
+
+    def serve_forever(self):
+        if self.master is None:
+            self.open()
+        while not self._stop.is_set():
+            timeout = 0.1
+            if self._timers:
+                timeout = min(timeout,
+                              max(0.0, self._timers[0][0] - time.monotonic()))
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if readable:
+                self._on_serial_data(os.read(self.master, 4096))
+            self._run_timers()
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self._timers)
+            callback(*args)
+
+    def _uart_time(self, nbytes):
+        return nbytes * UART_BITS_PER_BYTE / self.bitrate
+
+    def _i2c_time(self, nbytes):
+        return nbytes * I2C_BITS_PER_BYTE / self.i2c_bitrate
+
+    def _send_message(self, msg, framing=None):
+        framing = self.framing if framing is None else framing
+        data = bytearray(self.encoders[framing].encode(msg))
+        if self.random.random() < self.corrupt_rate:
+            if framing == FRAMING_BINARY:
+                data[2 + self.random.randrange(len(msg))] ^= 0x01
+            else:
+                # replace the high nibble of one of the bytes
+                i = 3 * self.random.randrange(len(msg))
+                data[i] = ord('0') if data[i] != ord('0') else ord('1')
+            self.stats['corrupted'] += 1
+        self._serial_write(bytes(data))
+
+    def _send_status(self, status):
+        self._send_message(bytes((LOCAL_ADDR, status)))
+
+    def _serial_write(self, data):
+        # frames leave the board one after the other at the serial bit rate
+        now = time.monotonic()
+        self._tx_free = max(now, self._tx_free) + self._uart_time(len(data))
+        self.schedule(self._tx_free, self._deliver, data)
+
+    def _deliver(self, data):
+        self.stats['tx_frames'] += 1
+        os.write(self.master, data)
+
+    def _feed_frame(self, byte):
+        # mirrors frame_parser_feed, returns True while inside of a frame
+        if self._frame_buffer is None:
+            if byte != FRAME_START:
+                return False
+            self._frame_buffer = bytearray()
+            return True
+        self._frame_buffer.append(byte)
+        length = self._frame_buffer[0]
+        if length == 0 or length > MAX_I2C_MSG_SIZE:
+            self._frame_buffer = None
+            self._rx_discard = True
+        elif len(self._frame_buffer) == length + FRAME_OVERHEAD - 1:
+            frame = self._frame_buffer
+            self._frame_buffer = None
+            if frame_checksum(frame):
+                self._rx_discard = True
+            else:
+                self.schedule(self._rx_free, self._process_message,
+                              bytes(frame[1:-1]))
+        return True
+
+    def _on_serial_data(self, data):
+        now = time.monotonic()
+        for byte in data:
+            self._rx_free = max(now, self._rx_free) + self._uart_time(1)
+            # mirrors line_collector_feed
+            if self.framing == FRAMING_BINARY and self._feed_frame(byte):
+                self._rx_buffer.clear()
+                continue
+            if self._rx_discard:
+                self._rx_discard = byte != TERMINATOR[0]
+                continue
+            if len(self._rx_buffer) >= MAX_SERIAL_MSG_SIZE:
+                self._rx_buffer.clear()
+                self.schedule(self._rx_free, self._send_status, ERR_TOO_LONG)
+                continue
+            self._rx_buffer.append(byte)
+            if byte == TERMINATOR[0]:
+                line = bytes(self._rx_buffer)
+                self._rx_buffer.clear()
+                if self.framing == FRAMING_BINARY and not is_hex_line(line):
+                    continue
+                self.framing = FRAMING_HEX
+                self.schedule(self._rx_free, self._process_serial_message,
+                              line)
+
+    def _process_serial_message(self, line):
+        buffer = hex_to_bin(line)
+        if not buffer:
+            self.stats['rx_frames'] += 1
+            self._send_status(ERR_NO_DATA)
+        else:
+            self._process_message(buffer)
+
+    def _process_message(self, buffer):
+        self.stats['rx_frames'] += 1
+        if buffer[0] == LOCAL_ADDR:
+            self._handle_local_command(buffer)
+        else:
+            self._handle_i2c_command(buffer)
+
+    def _handle_local_command(self, buffer):
+        # the reply uses the framing of the request, even if it changes it
+        framing = self.framing
+        if len(buffer) == 1:
+            self._send_message(buffer, framing)
+            return
+        command = self.commands.get(buffer[1])
+        if command is None:
+            reply = bytes((ERR_NO_COMMAND,))
+        else:
+            reply = bytes((buffer[1],)) + command(buffer[2:])
+        self._send_message(bytes((LOCAL_ADDR,)) + reply, framing)
+
+    def _pin_mode(self, args):
+        if len(args) != 2:
+            return bytes((ERR_INVALID_FORMAT,))
+        return bytes((ArduinoLocalCommand.OK,))
+
+    def _dig_write(self, args):
+        if len(args) != 2:
+            return bytes((ERR_INVALID_FORMAT,))
+        pin, val = args
+        previous = self.pins.get(pin, LOW)
+        self.pins[pin] = val
+        if pin == self.pin_hs:
+            self.set_handle(
+                HS_HANDLE_CLOSED if val == HIGH else HS_HANDLE_OPEN)
+        elif pin == self.pin_pg:
+            self.mmc.payload_power = val != LOW
+            if val == LOW:
+                self._power_on = None
+            elif self._power_on is None:
+                self._power_on = time.monotonic()
+        self._check_capture_trigger(pin, previous, val)
+        return bytes((ArduinoLocalCommand.OK,))
+
+    def _dig_read(self, args):
+        if len(args) != 1:
+            return bytes((ERR_INVALID_FORMAT,))
+        return bytes((ArduinoLocalCommand.OK, self.pins.get(args[0], LOW)))
+
+    def _an_write(self, args):
+        if len(args) != 2:
+            return bytes((ERR_INVALID_FORMAT,))
+        self.analog_values[args[0]] = args[1] * 4
+        return bytes((ArduinoLocalCommand.OK,))
+
+    def _an_read(self, args):
+        if len(args) != 1:
+            return bytes((ERR_INVALID_FORMAT,))
+        val = self._analog_value(args[0], time.monotonic())
+        return bytes((ArduinoLocalCommand.OK, val & 0xff, (val >> 8) & 0xff))
+
+    def _batch(self, args):
+        # mirrors batch_command, every command is checked before any runs
+        commands = []
+        nresults = 0
+        i = 0
+        while i < len(args):
+            op = BATCH_OPS.get(args[i])
+            if op is None or i + 1 + op[0] > len(args):
+                return bytes((ERR_INVALID_FORMAT,))
+            commands.append((args[i], args[i + 1:i + 1 + op[0]]))
+            nresults += op[1]
+            i += 1 + op[0]
+        if nresults > MAX_BATCH_RESULTS:
+            return bytes((ERR_TOO_LONG,))
+        reply = bytearray((ArduinoLocalCommand.OK,))
+        for command_id, command_args in commands:
+            reply.extend(self.commands[command_id](command_args)[1:])
+        return bytes(reply)
+
+    def _set_framing(self, args):
+        if len(args) != 1 or args[0] > FRAMING_BINARY:
+            return bytes((ERR_INVALID_FORMAT,))
+        self.framing = args[0]
+        return bytes((ArduinoLocalCommand.OK,))
+
+    def _set_scan(self, args):
+        if len(args) < 2 or (len(args) - 2) % 3 or \
+                (len(args) - 2) // 3 > MAX_SCAN_ENTRIES:
+            return bytes((ERR_INVALID_FORMAT,))
+        self.scan_period = (args[0] | (args[1] << 8)) / 1000
+        self.scan_entries = [(args[i], args[i + 1], args[i + 2] & 0x03)
+                             for i in range(2, len(args), 3)]
+        self._schedule_scan(time.monotonic())
+        return bytes((ArduinoLocalCommand.OK,))
+
+    def _schedule_scan(self, when):
+        # only the latest wake up of the scan runs, like the loop() of the
+        # firmware there is one scan step at a time
+        self._scan_wake = when
+        self.schedule(when, self._scan_step, when)
+
+    def _scan_step(self, wake):
+        # mirrors scan_if_needed
+        if wake != self._scan_wake:
+            return
+        if not self.scan_entries:
+            self._scan_index = 0
+            self._scan_waiting = False
+            return
+        now = time.monotonic()
+        if self._scan_waiting and \
+                now - self._scan_sent < SCAN_RESPONSE_TIMEOUT:
+            self._schedule_scan(self._scan_sent + SCAN_RESPONSE_TIMEOUT)
+            return
+        self._scan_waiting = False
+        if self._scan_index >= len(self.scan_entries):
+            if now - self._scan_sweep < self.scan_period:
+                self._schedule_scan(self._scan_sweep + self.scan_period)
+                return
+            self._scan_index = 0
+        if self._scan_index == 0:
+            self._scan_sweep = now
+        msg = scan_request(self.scan_entries[self._scan_index],
+                           self._scan_index, IPMB_ADDR)
+        self._scan_index += 1
+        self._scan_sent = now
+        self._scan_waiting = self._i2c_send(msg)
+        self._schedule_scan(
+            now + (SCAN_RESPONSE_TIMEOUT if self._scan_waiting else 0))
+
+    def _analog_value(self, pin, now):
+        if pin == self.pin_rail:
+            # the payload rail ramps up once the payload is powered
+            if self._power_on is None:
+                return 0
+            return min(ANALOG_FULL_SCALE, int(
+                ANALOG_FULL_SCALE * (now - self._power_on) / RAIL_RAMP_TIME))
+        return self.analog_values.get(pin, 512)
+
+    def _set_capture(self, args):
+        # mirrors set_capture_command
+        if len(args) < 6 or len(args) - 6 > MAX_CAPTURE_PINS or \
+                args[5] > TRIGGER_FALLING:
+            return bytes((ERR_INVALID_FORMAT,))
+        period_us = args[0] | (args[1] << 8)
+        count = args[2] | (args[3] << 8)
+        if count and (period_us == 0 or len(args) == 6):
+            return bytes((ERR_INVALID_FORMAT,))
+        self.capture_pins = list(args[6:])
+        self.capture_period = period_us / 1e6
+        self.capture_remaining = count
+        self._capture_sequence = 0
+        # pending blocks of a previous capture are dropped
+        self._capture_generation += 1
+        if not count:
+            self._capture_trigger = None
+        elif args[5] == TRIGGER_NONE:
+            self._capture_trigger = None
+            self._start_capture(time.monotonic())
+        else:
+            self._capture_trigger = (args[4], args[5])
+        return bytes((ArduinoLocalCommand.OK,))
+
+    def _check_capture_trigger(self, pin, previous, val):
+        if self._capture_trigger is None or \
+                self._capture_trigger[0] != pin or \
+                (previous != LOW) == (val != LOW):
+            return
+        if (val != LOW) == (self._capture_trigger[1] == TRIGGER_RISING):
+            self._capture_trigger = None
+            self._start_capture(time.monotonic())
+
+    def _capture_samples_per_block(self):
+        analog = sum(1 for pin in self.capture_pins if pin & CAPTURE_ANALOG)
+        size = 2 * analog + (1 if analog < len(self.capture_pins) else 0)
+        return (CAPTURE_BLOCK_SIZE - CAPTURE_HEADER_SIZE) // size
+
+    def _start_capture(self, start):
+        self._schedule_capture_block(start, self._capture_generation)
+
+    def _schedule_capture_block(self, start, generation):
+        # the samples of a block are taken on the emulated clock and the
+        # block leaves when it is full, like capture_if_needed
+        nsamples = min(self.capture_remaining,
+                       self._capture_samples_per_block())
+        self.schedule(start + (nsamples - 1) * self.capture_period,
+                      self._send_capture_block, start, nsamples, generation)
+
+    def _send_capture_block(self, start, nsamples, generation):
+        if generation != self._capture_generation:
+            return
+        samples = bytearray()
+        for i in range(nsamples):
+            when = start + i * self.capture_period
+            analog = [self._analog_value(pin & ~CAPTURE_ANALOG, when)
+                      for pin in self.capture_pins if pin & CAPTURE_ANALOG]
+            digital = [self.pins.get(pin, LOW) for pin in self.capture_pins
+                       if not pin & CAPTURE_ANALOG]
+            samples.extend(encode_sample(analog, digital))
+        block = capture_block(self._capture_sequence,
+                              int((start - self._started) * 1e6), samples)
+        self._capture_sequence = (self._capture_sequence + 1) % 256
+        self._send_message(bytes((LOCAL_ADDR,)) + block)
+        self.capture_remaining -= nsamples
+        if self.capture_remaining:
+            self._schedule_capture_block(
+                start + nsamples * self.capture_period, generation)
+
+    def _forward_scan_result(self, msg):
+        now = time.monotonic()
+        result = scan_result(msg, self.scan_entries,
+                             int((now - self._started) * 1000))
+        if result is None:
+            return
+        if result[1] == self._scan_index - 1 and self._scan_waiting:
+            self._scan_waiting = False
+            self._schedule_scan(now)
+        self._send_message(bytes((LOCAL_ADDR,)) + result)
+
+    def _forward_i2c(self, msg):
+        if is_scan_response(msg):
+            self._forward_scan_result(msg)
+        else:
+            self._send_message(msg)
+
+    def _handle_i2c_command(self, buffer):
+        if len(buffer) > MAX_I2C_MSG_SIZE:
+            self._send_status(ERR_TOO_LONG)
+            return
+        self._i2c_send(buffer)
+
+    def _i2c_send(self, buffer):
+        self.stats['i2c_requests'] += 1
+        now = time.monotonic()
+        self._i2c_free = max(now, self._i2c_free) + self._i2c_time(
+            len(buffer))
+        if buffer[0] != self.mmc.address or \
+                self.random.random() < self.drop_rate:
+            # not acknowledged on the bus, the firmware stays silent
+            self.stats['dropped'] += 1
+            return False
+        self.schedule(self._i2c_free + self.i2c_delay, self._mmc_answer,
+                      buffer)
+        return True
+
+    def _mmc_answer(self, buffer):
+        rsp = self.mmc.handle_message(buffer)
+        if rsp is not None:
+            self._i2c_receive(rsp)
+
+    def _i2c_receive(self, msg):
+        # the board prefixes its own address and keeps MAX_I2C_MSG_SIZE bytes
+        now = time.monotonic()
+        self._i2c_free = max(now, self._i2c_free) + self._i2c_time(len(msg))
+        self.schedule(self._i2c_free, self._forward_i2c,
+                      msg[:MAX_I2C_MSG_SIZE])
+
+    def set_handle(self, handle):
+        '''Move the emulated hot-swap handle, the MMC reports it later.'''
+        self.schedule(time.monotonic() + self.event_delay,
+                      self._send_handle_event, handle)
+
+    def _send_handle_event(self, handle):
+        event = self.mmc.set_handle(handle)
+        if event is not None:
+            self._i2c_receive(event)
+
+    def toggle_handle_every(self, period):
+        def toggle():
+            handle = HS_HANDLE_OPEN if self.mmc.handle == HS_HANDLE_CLOSED \
+                else HS_HANDLE_CLOSED
+            self._send_handle_event(handle)
+            self.schedule(time.monotonic() + period, toggle)
+        self.schedule(time.monotonic() + period, toggle)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Emulate mmctester-board and a MMC on a pseudo-terminal')
+    parser.add_argument(
+        '--target', type=hex_or_int, default=DEFAULT_TARGET,
+        help='IPMB address of the emulated MMC')
+    parser.add_argument(
+        '--bitrate', type=int, default=115200,
+        help='Emulated serial bit rate')
+    parser.add_argument(
+        '--i2c-bitrate', type=int, default=100000,
+        help='Emulated IPMB bit rate')
+    parser.add_argument(
+        '--i2c-delay', type=float, default=0.001,
+        help='MMC response time in seconds')
+    parser.add_argument(
+        '--drop-rate', type=float, default=0.0,
+        help='Probability of losing an IPMB request')
+    parser.add_argument(
+        '--corrupt-rate', type=float, default=0.0,
+        help='Probability of corrupting a serial frame')
+    parser.add_argument(
+        '--pin-hs', type=int,
+        help='Board pin connected to the emulated hot-swap handle')
+    parser.add_argument(
+        '--pin-pg', type=int,
+        help='Board pin that powers the emulated payload')
+    parser.add_argument(
+        '--pin-rail', type=int,
+        help='Analog pin reading the emulated payload rail, which ramps up '
+             'once the payload is powered')
+    parser.add_argument(
+        '--hs-period', type=float,
+        help='Toggle the hot-swap handle every HS_PERIOD seconds')
+    parser.add_argument(
+        '--hex-only', action='store_true',
+        help='Emulate firmware without support for binary framing')
+    parser.add_argument(
+        '--no-batch', dest='batch', action='store_false',
+        help='Emulate firmware without support for the batch command')
+    parser.add_argument(
+        '--seed', type=int, help='Seed for drop and corruption decisions')
+    parser.add_argument(
+        '--link', help='Create a symlink to the pty with this path')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    emulator = BoardEmulator(
+        MMCModel(address=args.target), bitrate=args.bitrate,
+        i2c_bitrate=args.i2c_bitrate, i2c_delay=args.i2c_delay,
+        drop_rate=args.drop_rate, corrupt_rate=args.corrupt_rate,
+        pin_hs=args.pin_hs, pin_pg=args.pin_pg, seed=args.seed,
+        binary_framing=not args.hex_only, batch=args.batch,
+        pin_rail=args.pin_rail)
+    port = emulator.open()
+    if args.link:
+        os.symlink(port, args.link)
+    if args.hs_period:
+        emulator.toggle_handle_every(args.hs_period)
+    print(port, flush=True)
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.link:
+            os.unlink(args.link)
+        emulator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+import binascii
+import logging
+
+from array import array
+
+from pyipmi.errors import IpmiTimeoutError
+from pyipmi.logger import log
+
+from mmctester.util import NON_HEX, hex_dump
+
+TERMINATOR = b'\n'
+FRAME_START = 0xa5
+FRAME_OVERHEAD = 3
+MAX_FRAME_PAYLOAD = 32
+
+FRAMING_HEX = 0x0
+FRAMING_BINARY = 0x1
+# deleted from hex lines before decoding them
+NON_HEX_LINE = NON_HEX.replace(TERMINATOR, b'')
+
+
+def frame_checksum(data):
+    return -sum(data) % 256
+
+
+class StreamFraming(object):
+    '''Splits the byte stream of the serial port into frames.
+
+    Whatever the port has is read into a buffer kept across reads, every
+    frame completed by the read is decoded in one pass and the bytes of an
+    incomplete frame stay buffered for the next read.
+    '''
+
+    def __init__(self, buffer=None):
+        self.buffer = buffer if buffer is not None else bytearray()
+
+    def read_frames(self, ser):
+        '''Returns the frames completed by reading what ser has waiting.
+
+        Blocks until at least one byte arrives, raises IpmiTimeoutError if
+        none does within the serial timeout. The list is empty if the bytes
+        only continued a frame.
+        '''
+        received = ser.read(max(1, ser.in_waiting))
+        if not received:
+            raise IpmiTimeoutError()
+        self.buffer += received
+        return self._parse(log().isEnabledFor(logging.DEBUG))
+
+
+class HexFraming(StreamFraming):
+    '''Hex lines, "xx xx xx\\n", understood by every firmware version.'''
+
+    NAME = 'hex'
+    ID = FRAMING_HEX
+
+    def encode(self, raw_bytes):
+        return b' '.join([b'%02x' % b for b in raw_bytes]) + TERMINATOR
+
+    def _parse(self, debug):
+        end = self.buffer.rfind(TERMINATOR) + 1
+        if not end:
+            return []
+        lines = self.buffer if end == len(self.buffer) else self.buffer[:end]
+        # the separators of all the lines go in one pass
+        digits = lines.translate(None, NON_HEX_LINE)
+        del self.buffer[:end]
+
+        frames = []
+        view = memoryview(digits)
+        start = 0
+        while start < len(digits):
+            stop = digits.find(TERMINATOR, start)
+            try:
+                rx_data = array('B', binascii.unhexlify(view[start:stop]))
+            except binascii.Error:
+                log().debug('Invalid hex line [%s]', digits[start:stop])
+            else:
+                if debug:
+                    log().debug('I2C RX [%s]', hex_dump(rx_data))
+                frames.append(rx_data)
+            start = stop + 1
+        view.release()
+        return frames
+
+
+class BinaryFraming(StreamFraming):
+    '''Length-prefixed frames: <start> <length> <payload ...> <checksum>.
+
+    The checksum makes the sum of length, payload and checksum 0 modulo 256.
+    Frames with an invalid length or checksum are skipped, the parser then
+    resynchronises on the next start byte.
+    '''
+
+    NAME = 'binary'
+    ID = FRAMING_BINARY
+
+    def encode(self, raw_bytes):
+        frame = bytearray((FRAME_START, len(raw_bytes)))
+        frame.extend(raw_bytes)
+        frame.append(frame_checksum(frame[1:]))
+        return bytes(frame)
+
+    def _parse(self, debug):
+        buffer = self.buffer
+        frames = []
+        pos = 0
+        with memoryview(buffer) as view:
+            while pos < len(buffer):
+                start = buffer.find(FRAME_START, pos)
+                if start < 0:
+                    start = len(buffer)
+                if start > pos:
+                    log().debug('Skipping %d bytes outside of frame',
+                                start - pos)
+                    pos = start
+                if len(buffer) - start < 2:
+                    break
+                length = buffer[start + 1]
+                if length == 0 or length > MAX_FRAME_PAYLOAD:
+                    log().debug('Invalid frame length %d', length)
+                    pos = start + 1
+                    continue
+                end = start + length + FRAME_OVERHEAD
+                if end > len(buffer):
+                    break
+                if frame_checksum(view[start + 1:end]):
+                    log().debug('Invalid frame checksum [%s]',
+                                hex_dump(view[start + 1:end]))
+                    pos = start + 1
+                    continue
+                rx_data = array('B')
+                rx_data.frombytes(view[start + 2:end - 1])
+                if debug:
+                    log().debug('I2C RX [%s]', hex_dump(rx_data))
+                frames.append(rx_data)
+                pos = end
+        del buffer[:pos]
+        return frames
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+from pyipmi.errors import CompletionCodeError
+from pyipmi.fru import FruInventory
+from pyipmi.logger import log
+from pyipmi.msgs import constants
+
+from mmctester.interface import MAX_I2C_MSG_SIZE
+
+# IPMB header, completion code, count and checksum around the data of a
+# Read FRU Data response
+READ_FRU_DATA_OVERHEAD = 9
+# answers to a read larger than what the device can return at once
+BACK_OFF_CCS = (constants.CC_CANT_RET_NUM_REQ_BYTES,
+                constants.CC_REQ_DATA_FIELD_EXCEED)
+BACK_OFF_STEP = 2
+
+
+def max_fru_read_size(max_msg_size=MAX_I2C_MSG_SIZE):
+    '''Largest Read FRU Data count whose response fits in one message.'''
+    return max_msg_size - READ_FRU_DATA_OVERHEAD
+
+
+class FruReader(object):
+    '''Reads a whole FRU inventory with as few Read FRU Data as possible.
+
+    Each read asks for as many bytes as fit in one message of the interface,
+    MAX_I2C_MSG_SIZE for the board, and the size is reduced when the device
+    answers that it can not return that many. The size that worked is kept
+    for the next reads.
+    '''
+
+    def __init__(self, ipmi):
+        self.ipmi = ipmi
+        self.read_size = max_fru_read_size(getattr(
+            ipmi.interface, 'max_msg_size', MAX_I2C_MSG_SIZE))
+        self.reads = 0
+
+    def read_fru_data(self, fru_id=0):
+        '''Returns the whole FRU inventory area as bytes.'''
+        area_size = self.ipmi.get_fru_inventory_area_info(fru_id)
+        data = bytearray()
+        while len(data) < area_size:
+            count = min(self.read_size, area_size - len(data))
+            try:
+                rsp = self.ipmi.send_message_by_name(
+                    'ReadFruData', fru_id=fru_id, offset=len(data),
+                    count=count)
+            except CompletionCodeError as e:
+                if e.cc not in BACK_OFF_CCS or count <= 1:
+                    raise
+                self.read_size = max(1, count - BACK_OFF_STEP)
+                log().debug('FRU read size reduced to %d', self.read_size)
+                continue
+            self.reads += 1
+            if rsp.count == 0:
+                raise IOError(f'Empty FRU read at offset {len(data)}')
+            data.extend(rsp.data[:rsp.count])
+        return bytes(data)
+
+    def get_fru_inventory(self, fru_id=0):
+        return FruInventory(self.read_fru_data(fru_id))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+from pyipmi.logger import log
+
+# until the first handle event, the module may have been inserted and
+# activated before the tester started
+STATE_UNKNOWN = None
+STATE_OFF = 'off'
+STATE_ACTIVATING = 'activating'
+STATE_ON = 'on'
+STATE_DEACTIVATING = 'deactivating'
+# timed states and the state entered once their delay has elapsed
+NEXT_STATES = {
+    STATE_ACTIVATING: STATE_ON,
+    STATE_DEACTIVATING: STATE_OFF,
+}
+# seconds spent in each timed state, e.g. negotiating power with the LED
+# blinking before the payload is enabled
+DEFAULT_DELAYS = {
+    STATE_ACTIVATING: 3.0,
+    STATE_DEACTIVATING: 3.0,
+}
+
+
+def delay_override(text):
+    '''Parses STATE=SECONDS, the delay of a timed hot-swap state.'''
+    state, _, seconds = text.rpartition('=')
+    if state not in DEFAULT_DELAYS or float(seconds) < 0:
+        raise ValueError(f'Invalid hot-swap delay: {text}')
+    return state, float(seconds)
+
+
+class HotSwapSequencer(object):
+    '''State machine of the payload following the hot-swap handle.
+
+    Closing the handle enters STATE_ACTIVATING and, after its delay,
+    STATE_ON; opening it enters STATE_DEACTIVATING and then STATE_OFF. The
+    delays are timers, nothing blocks while they run. A handle event
+    cancels the pending transition of the opposite sequence, so a quick
+    open and close ends in the state of the last event. The state is
+    STATE_UNKNOWN until the first event, which starts its sequence
+    whatever it is.
+
+    call_later: schedules callback() after some seconds, returns an object
+    with a cancel() method, e.g. SelectorLoop.call_later or
+    asyncio loop.call_later
+    on_enter: called with the new state on every transition, does what the
+    state requires, e.g. blinking the LED or enabling the payload
+    delays: seconds spent in the timed states, by state
+    '''
+
+    def __init__(self, call_later, on_enter, delays=None):
+        self.call_later = call_later
+        self.on_enter = on_enter
+        self.delays = dict(DEFAULT_DELAYS)
+        self.delays.update(delays or {})
+        self.state = STATE_UNKNOWN
+        self._timer = None
+
+    def __repr__(self):
+        return f'HotSwapSequencer(state={self.state})'
+
+    def _enter(self, state):
+        self._timer = None
+        log().debug('Hot-swap state %s -> %s', self.state, state)
+        self.state = state
+        self.on_enter(state)
+        if state in NEXT_STATES:
+            self._timer = self.call_later(self.delays[state], self._enter,
+                                          NEXT_STATES[state])
+
+    def cancel(self):
+        '''Drops the pending transition, the state stays as it is.'''
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def handle_closed(self):
+        if self.state in (STATE_ACTIVATING, STATE_ON):
+            return
+        self.cancel()
+        self._enter(STATE_ACTIVATING)
+
+    def handle_open(self):
+        if self.state in (STATE_DEACTIVATING, STATE_OFF):
+            return
+        self.cancel()
+        self._enter(STATE_DEACTIVATING)
@@ -1,61 +1,300 @@
 #!/usr/bin/env python
+import logging
+import os
 import pyipmi
+import select
 import serial
+import threading
 import time
 
 from array import array
+from collections import deque
 from pyipmi.errors import IpmiTimeoutError
 from pyipmi.interfaces.ipmb import (IpmbHeaderReq, IpmbHeaderRsp, checksum,
-                                    rx_filter, encode_ipmb_msg)
+                                    encode_ipmb_msg)
 from pyipmi.logger import log
 from pyipmi.msgs import (create_message, constants, encode_message,
                          decode_message)
 from pyipmi.msgs.registry import create_request_by_name
 
 from mmctester.arduino import ArduinoLocalCommand
-from mmctester.util import hex_to_bin
+from mmctester.framing import BinaryFraming, HexFraming
+from mmctester.metrics import BoardMetrics, MeteredSerial
+from mmctester.rtt import RttTable
+from mmctester.rxqueue import ReceiveQueue, response_key
+from mmctester.scan import decode_scan_result
+from mmctester.util import hex_dump
 
 TERMINATOR = b'\n'
 LOCAL_ADDR = 0x0
+# the board forwards IPMB messages of up to this size
+MAX_I2C_MSG_SIZE = 32
+# half of the 6-bit sequence space, so a late response is not taken for the
+# response of a newer request
+MAX_PIPELINE_WINDOW = 32
+FRAMINGS = ('auto', 'hex', 'binary')
 
 
-class MMCTesterBoard(object):
+def board_ready(ser, retries):
+    '''Ping handshake of mmctester-board on an open serial port.
+
+    Returns False if the board did not answer to any of the retries.
+    '''
+    for _ in range(retries):
+        ser.write(b'00\n')
+        if ser.read_until(TERMINATOR) == b'00\n':
+            return True
+    return False
+
+
+class BoardProtocol(object):
+    '''Serial framing and IPMB encoding of the mmctester-board.
+
+    Shared by the blocking and the asyncio interfaces, which open self._ser
+    and wait for the frames pushed to self._recv_queue.
+    '''
+
+    def __init__(self, address, max_queue_size):
+        self.address = address
+        self.max_msg_size = MAX_I2C_MSG_SIZE
+        self.next_sequence_number = 0
+        self._recv_queue = ReceiveQueue(address, max_queue_size)
+        self._framing = HexFraming()
+        # the ones of the sensor scan, to tell which sensor a result is of
+        self.scan_entries = []
+        self.metrics = BoardMetrics()
+        # the timeouts of the requests follow their round trip time
+        self.rtt = RttTable()
+
+    @property
+    def retries(self):
+        '''Requests sent again after a timeout.'''
+        return self.metrics.retries
+
+    def metrics_snapshot(self):
+        '''Current values of the metrics of the board, see BoardMetrics.'''
+        snapshot = self.metrics.snapshot(self._recv_queue)
+        snapshot['rtt'] = self.rtt.snapshot()
+        return snapshot
+
+    @property
+    def framing(self):
+        return self._framing.NAME
+
+    def _framing_request(self):
+        return bytes((LOCAL_ADDR, ArduinoLocalCommand.COMMAND_SET_FRAMING,
+                      BinaryFraming.ID))
+
+    # firmware without support for binary framing answers with an unknown
+    # command error and hex is kept
+    def _framing_answer(self, ans, required):
+        if ans is not None and len(ans) >= 3 and \
+                ans[1] == ArduinoLocalCommand.COMMAND_SET_FRAMING and \
+                ans[2] == ArduinoLocalCommand.OK:
+            # keeps what was read after the answer, if anything
+            self._framing = BinaryFraming(self._framing.buffer)
+        elif required:
+            raise IOError(f'Board does not support binary framing: {ans}')
+        log().debug('Serial framing: %s', self._framing.NAME)
+
+    def _inc_sequence_number(self):
+        self.next_sequence_number = (self.next_sequence_number + 1) % 64
+
+    @staticmethod
+    def _encode_ipmb_msg_req(header, cmd_data):
+        data = header.encode()
+        data.extend(cmd_data)
+        data.append(checksum(data[2:]))
+
+        return data
+
+    def _send_raw(self, header, raw_bytes):
+        full_raw_bytes = encode_ipmb_msg(header, raw_bytes)
+        self._serial_send_raw(full_raw_bytes)
+
+    def _serial_send_raw(self, raw_bytes):
+        if log().isEnabledFor(logging.DEBUG):
+            log().debug('I2C TX [%s]', hex_dump(raw_bytes))
+        self._ser.write(self._framing.encode(raw_bytes))
+
+    def is_platform_event(self, data):
+        return IpmbHeaderReq(data).cmdid == constants.CMDID_PLATFORM_EVENT
+
+    # decodes a Platform Event request and sends its response
+    def _ack_event(self, raw_rx_data):
+        header = IpmbHeaderReq(raw_rx_data)
+        req = create_message(header.netfn, header.cmdid, None)
+        decode_message(req, raw_rx_data[6:-1])
+        rsp_header = IpmbHeaderReq()
+        rsp_header.netfn = header.netfn | 1
+        rsp_header.rs_lun = header.rq_lun
+        rsp_header.rs_sa = header.rq_sa
+        rsp_header.rq_seq = header.rq_seq
+        rsp_header.rq_lun = header.rs_lun
+        rsp_header.rq_sa = header.rs_sa
+        rsp_header.cmdid = header.cmdid
+        rsp = create_message(rsp_header.netfn, rsp_header.cmdid, None)
+        rsp.completion_code = constants.CC_OK
+        self._send_raw(rsp_header, encode_message(rsp))
+
+        return req
+
+    def _request_header(self, target, lun, netfn, cmdid):
+        self._inc_sequence_number()
+
+        # assemble IPMB header
+        header = IpmbHeaderReq()
+        header.netfn = netfn
+        header.rs_lun = lun
+        header.rs_sa = target.ipmb_address
+        header.rq_seq = self.next_sequence_number
+        header.rq_lun = 0
+        header.rq_sa = self.address
+        header.cmdid = cmdid
+        return header
+
+    @staticmethod
+    def _request_key(header):
+        return (header.rs_sa, header.netfn | 1, header.cmdid, header.rq_seq)
+
+    @staticmethod
+    def _decode_response(req, rx_data):
+        rsp = create_message(req.netfn + 1, req.cmdid, req.group_extension)
+        decode_message(rsp, rx_data)
+        log().debug('IPMI Response [%s])', rsp)
+        return rsp
+
+
+class MMCTesterBoard(BoardProtocol):
     '''mmctester-board forwards between serial and IPMB.'''
 
     NAME = 'mmctester-board'
 
-    def __init__(self, port='/dev/ttyACM0', baudrate=115200, address=0x20):
-        self.address = address
+    def __init__(self, port='/dev/ttyACM0', baudrate=115200, address=0x20,
+                 framing='auto', max_queue_size=256, reader_thread=False):
+        if framing not in FRAMINGS:
+            raise ValueError(f'Unknown framing: {framing}')
+        super().__init__(address, max_queue_size)
         self.port = port
-        self.next_sequence_number = 0
         self.timeout = 1.0
         self.max_retries = 3
-        self._ser = serial.Serial(
-            port, baudrate=baudrate, timeout=self.timeout)
-        self._recv_queue = []
+        self.pipeline_window = 4
+        self._ser = MeteredSerial(serial.Serial(
+            port, baudrate=baudrate, timeout=self.timeout), self.metrics)
+        self._rx_cond = threading.Condition()
+        self._reader = None
+        self._reader_stop = threading.Event()
+        self._reader_error = None
+        # readable when the reader thread pushed frames, see fileno
+        self._wakeup = None
         self._wait_until_ready()
+        if framing != 'hex':
+            self._negotiate_framing(framing == 'binary')
         self.arduino = ArduinoLocalCommand(
-            self._serial_send_raw, self._local_receive_raw, LOCAL_ADDR)
-        self.received_acc = bytearray()
+            self._serial_send_raw, self._local_receive_raw, LOCAL_ADDR,
+            self.metrics, self._capture_receive_raw)
+        if reader_thread:
+            self.start_reader()
+
+    def start_reader(self):
+        '''Read the serial port in a background thread.
+
+        Frames are pushed to the receive queue as soon as they arrive and the
+        callers waiting for them are woken up, instead of each caller reading
+        the port itself.
+        '''
+        if self._reader is not None:
+            return
+        if self._wakeup is None:
+            self._wakeup = os.pipe()
+            for fd in self._wakeup:
+                os.set_blocking(fd, False)
+        # short reads so the thread notices when it has to stop
+        self._ser.timeout = 0.1
+        self._reader_stop.clear()
+        self._reader = threading.Thread(target=self._reader_loop,
+                                        name='mmctester-reader', daemon=True)
+        self._reader.start()
+
+    def stop_reader(self):
+        if self._reader is None:
+            return
+        self._reader_stop.set()
+        self._reader.join()
+        self._reader = None
+        self._ser.timeout = self.timeout
+
+    def _reader_loop(self):
+        while not self._reader_stop.is_set():
+            try:
+                frames = self._framing.read_frames(self._ser)
+            except IpmiTimeoutError:
+                continue
+            except Exception as e:
+                log().debug('Reader thread failed: %s', e)
+                with self._rx_cond:
+                    self._reader_error = e
+                    self._rx_cond.notify_all()
+                return
+            if not frames:
+                continue
+            with self._rx_cond:
+                for rx_data in frames:
+                    self._recv_queue.push(rx_data)
+                self._rx_cond.notify_all()
+            try:
+                os.write(self._wakeup[1], b'\0')
+            except BlockingIOError:
+                # the pipe is full, it is readable anyway
+                pass
+
+    def fileno(self):
+        '''File descriptor that is readable when frames may have arrived.
+
+        For select and selectors: the serial port, or a pipe written by the
+        reader thread after every frame if it is running. Call drain_wakeup
+        before taking the frames from the receive queue.
+        '''
+        if self._reader is not None:
+            return self._wakeup[0]
+        return self._ser.fileno()
+
+    def drain_wakeup(self):
+        if self._reader is None:
+            return
+        try:
+            while os.read(self._wakeup[0], 4096):
+                pass
+        except BlockingIOError:
+            pass
 
     # sends ping command until it is answered
     # as a side effect, it flushes old messages
     def _wait_until_ready(self):
-        retries = 0
-        while True:
-            self._ser.write(b'00\n')
-            retries += 1
-            if self._ser.read_until(TERMINATOR) == b'00\n':
-                break
-            elif retries >= self.max_retries:
-                raise IOError('Board not ready to accept serial commands')
+        if not board_ready(self._ser, self.max_retries):
+            raise IOError('Board not ready to accept serial commands')
+
+    # asks the board to switch to binary framing, firmware without support
+    # for it answers with an unknown command error and hex is kept
+    def _negotiate_framing(self, required):
+        self._serial_send_raw(self._framing_request())
+        try:
+            ans = self._local_receive_raw()
+        except IpmiTimeoutError:
+            ans = None
+        self._framing_answer(ans, required)
 
     def establish_session(self, session):
         # just remember session parameters here
         self._session = session
 
     def close_session(self):
+        self.stop_reader()
         self._ser.close()
+        if self._wakeup is not None:
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
 
     def is_ipmc_accessible(self, target):
         header = IpmbHeaderReq()
@@ -70,91 +309,85 @@ class MMCTesterBoard(object):
         self._receive_raw(header)
         return True
 
-    def _inc_sequence_number(self):
-        self.next_sequence_number = (self.next_sequence_number + 1) % 64
-
-    @staticmethod
-    def _encode_ipmb_msg_req(header, cmd_data):
-        data = header.encode()
-        data.extend(cmd_data)
-        data.append(checksum(data[2:]))
-
-        return data
-
-    def _send_raw(self, header, raw_bytes):
-        full_raw_bytes = encode_ipmb_msg(header, raw_bytes)
-        self._serial_send_raw(full_raw_bytes)
-
     def _receive_raw(self, header):
+        key = self._request_key(header)
         return self._serial_receive_raw(
-            lambda data: data[0] == self.address and rx_filter(header, data))
+            lambda: self._recv_queue.pop_response(key))
 
     def _local_receive_raw(self):
-        return self._serial_receive_raw(lambda data: data[0] == LOCAL_ADDR)
-
-    def _serial_send_raw(self, raw_bytes):
-        hex_data = b' '.join([b'%02x' % b for b in raw_bytes])
-        log().debug('I2C TX [%s]', hex_data.decode())
-        self._ser.write(hex_data + b'\n')
-
-    def _serial_receive_raw(self, filter_func=None):
-        rsp_received = False
-
-        # first search in receive queue
-        for rx_data in self._recv_queue[:]:
-            if filter_func is None or filter_func(rx_data):
-                self._recv_queue.remove(rx_data)
-                return rx_data
+        return self._serial_receive_raw(self._recv_queue.pop_local)
 
-        while not rsp_received:
+    def _capture_receive_raw(self, timeout=None):
+        return self._serial_receive_raw(self._recv_queue.pop_capture,
+                                        timeout)
 
-            received = self._ser.read_until(TERMINATOR)
+    def _serial_receive_raw(self, pop, timeout=None):
+        '''Returns the first frame given by pop, reading until there is one.
 
-            self.received_acc.extend(received)
-
-            if not received.endswith(TERMINATOR):
-                raise IpmiTimeoutError()
-
-            hex_data = self.received_acc.decode()
-
-            self.received_acc = bytearray()
-            log().debug('I2C RX [%s]', hex_data[:-1])
-            rx_data = array('B', hex_to_bin(hex_data))
-
-            rsp_received = filter_func is None or filter_func(rx_data)
-
-            if not rsp_received:
-                self._recv_queue.append(rx_data)
+        pop: takes a frame of the wanted kind from the receive queue, None
+        if there is none
+        timeout: seconds to wait for the frame, the serial timeout between
+        bytes by default, 0 only takes what has already arrived
+        '''
+        if self._reader is not None:
+            return self._wait_for_frame(pop, timeout)
+
+        rx_data = pop()
+        if timeout is None:
+            while rx_data is None:
+                self._push_frames()
+                rx_data = pop()
+            return rx_data
+
+        deadline = time.monotonic() + timeout
+        while rx_data is None:
+            if not self._ser.in_waiting:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select(
+                        [self._ser.fileno()], [], [], remaining)[0]:
+                    raise IpmiTimeoutError()
+            self._push_frames()
+            rx_data = pop()
+        return rx_data
 
+    # reads what has arrived, a burst of frames is queued in one go
+    def _push_frames(self):
+        for rx_data in self._framing.read_frames(self._ser):
+            self._recv_queue.push(rx_data)
+
+    def _wait_for_frame(self, pop, timeout):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        with self._rx_cond:
+            rx_data = pop()
+            while rx_data is None:
+                if self._reader_error is not None:
+                    raise IOError(
+                        f'Serial reader failed: {self._reader_error}')
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise IpmiTimeoutError()
+                self._rx_cond.wait(remaining)
+                rx_data = pop()
         return rx_data
 
-    def is_platform_event(self, data):
-        return IpmbHeaderReq(data).cmdid == constants.CMDID_PLATFORM_EVENT
+    def _receive_event_raw(self, timeout=None):
+        return self._serial_receive_raw(self._recv_queue.pop_event, timeout)
 
-    def _receive_event_raw(self):
-        return self._serial_receive_raw(self.is_platform_event)
+    def receive_and_ack_event(self, timeout=None):
+        '''Returns the next Platform Event request, after acknowledging it.
 
-    def receive_and_ack_event(self):
+        timeout: seconds to wait for an event, the serial timeout by default,
+        0 polls without blocking
+
+        Returns None if no event arrived in time.
+        '''
         try:
-            raw_rx_data = self._receive_event_raw()
+            raw_rx_data = self._receive_event_raw(timeout)
         except IpmiTimeoutError:
             return None
-        header = IpmbHeaderReq(raw_rx_data)
-        req = create_message(header.netfn, header.cmdid, None)
-        decode_message(req, raw_rx_data[6:-1])
-        rsp_header = IpmbHeaderReq()
-        rsp_header.netfn = header.netfn | 1
-        rsp_header.rs_lun = header.rq_lun
-        rsp_header.rs_sa = header.rq_sa
-        rsp_header.rq_seq = header.rq_seq
-        rsp_header.rq_lun = header.rs_lun
-        rsp_header.rq_sa = header.rs_sa
-        rsp_header.cmdid = header.cmdid
-        rsp = create_message(rsp_header.netfn, rsp_header.cmdid, None)
-        rsp.completion_code = constants.CC_OK
-        self._send_raw(rsp_header, encode_message(rsp))
-
-        return req
+        return self._ack_event(raw_rx_data)
 
     def _send_and_receive(self, target, lun, netfn, cmdid, payload):
         '''Send and receive data using ipmb-dev-int interface.
@@ -167,39 +400,91 @@ class MMCTesterBoard(object):
 
         Returns the received data as bytestring
         '''
-        self._inc_sequence_number()
+        return self._send_and_receive_many(
+            [(target, lun, netfn, cmdid, payload)], 1)[0]
 
-        # assemble IPMB header
-        header = IpmbHeaderReq()
-        header.netfn = netfn
-        header.rs_lun = lun
-        header.rs_sa = target.ipmb_address
-        header.rq_seq = self.next_sequence_number
-        header.rq_lun = 0
-        header.rq_sa = self.address
-        header.cmdid = cmdid
+    def _send_and_receive_many(self, requests, window):
+        '''Send requests keeping up to window of them in flight.
 
-        retries = 0
-        while retries < self.max_retries:
-            try:
-                self._send_raw(header, payload)
-                rx_data = self._receive_raw(header)
-                break
-            except IpmiTimeoutError:
-                pass
-            except IOError:
-                pass
+        requests: list of (target, lun, netfn, cmdid, payload)
+        window: maximum number of requests waiting for a response
 
-            retries += 1
-            time.sleep(retries * 0.2)
+        Returns the received data of each request, in the same order
+        '''
+        results = [None] * len(requests)
+        waiting = deque(range(len(requests)))
+        # response key -> [request index, header, retries, time first sent,
+        # deadline of the last attempt, RttEstimator, samples when sent,
+        # timeout of the last attempt]
+        in_flight = {}
+
+        def pop_pending_response():
+            for key in in_flight:
+                rx_data = self._recv_queue.pop_response(key)
+                if rx_data is not None:
+                    return rx_data
+            return None
 
-        else:
-            log().debug('Recv queue: %s', self._recv_queue)
-            raise IpmiTimeoutError()
+        while waiting or in_flight:
+            while waiting and len(in_flight) < window:
+                index = waiting.popleft()
+                target, lun, netfn, cmdid, payload = requests[index]
+                header = self._request_header(target, lun, netfn, cmdid)
+                rtt = self.rtt.get(header.rs_sa, netfn, cmdid)
+                sent = time.perf_counter()
+                in_flight[self._request_key(header)] = [
+                    index, header, 0, sent, sent + rtt.timeout, rtt,
+                    rtt.samples, rtt.timeout]
+                self._send_raw(header, payload)
 
-        # returns only from completion code to (excluding) payload checksum
-        # the excluded data has already been used for validation
-        return rx_data[6:-1]
+            deadline = min(entry[4] for entry in in_flight.values())
+            try:
+                rx_data = self._serial_receive_raw(
+                    pop_pending_response,
+                    max(0, deadline - time.perf_counter()))
+            except IpmiTimeoutError:
+                rx_data = None
+
+            if rx_data is not None:
+                index, _, retries, sent, _, rtt, samples, _ = in_flight.pop(
+                    response_key(rx_data))
+                elapsed = time.perf_counter() - sent
+                self.metrics.request_seconds.observe(elapsed)
+                if retries:
+                    rtt.answered_after_retry(samples)
+                else:
+                    rtt.observe(elapsed)
+                # returns only from completion code to (excluding) payload
+                # checksum, the excluded data has already been used for
+                # validation
+                results[index] = rx_data[6:-1]
+                continue
+
+            # resend the requests whose timeout expired
+            now = time.perf_counter()
+            expired = [entry for entry in in_flight.values()
+                       if entry[4] <= now]
+            if not expired:
+                continue
+            for entry in expired:
+                entry[2] += 1
+                entry[7] = entry[5].timed_out(entry[7])
+                if entry[2] >= self.max_retries:
+                    log().debug('Recv queue: %s', self._recv_queue)
+                    self.metrics.timeouts += 1
+                    self.metrics.abandoned += len(in_flight) - 1
+                    raise IpmiTimeoutError()
+            retries = max(entry[2] for entry in expired)
+            time.sleep(expired[0][5].backoff(retries))
+            for entry in expired:
+                log().debug('Resending request %d after %.3fs, timeout '
+                            'now %.3fs', entry[0], now - entry[3],
+                            entry[7])
+                self.metrics.retries += 1
+                entry[4] = time.perf_counter() + entry[7]
+                self._send_raw(entry[1], requests[entry[0]][4])
+
+        return results
 
     def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
         '''Interface function to send and receive raw message.
@@ -232,14 +517,62 @@ class MMCTesterBoard(object):
                                          netfn=req.netfn,
                                          cmdid=req.cmdid,
                                          payload=encode_message(req))
-        rsp = create_message(req.netfn + 1, req.cmdid, req.group_extension)
-        decode_message(rsp, rx_data)
+        return self._decode_response(req, rx_data)
 
-        log().debug('IPMI Response [%s])', rsp)
+    def send_and_receive_many(self, reqs, window=None):
+        '''Send IPMI requests keeping several of them in flight.
 
-        return rsp
+        reqs: IPMI message requests
+        window: maximum number of requests in flight, pipeline_window by
+        default
+
+        Responses are matched to their request by responder address, netfn,
+        command and sequence number, so the serial and IPMB latencies of
+        the requests overlap.
+
+        Returns the IPMI message responses in the order of the requests.
+        '''
+        if window is None:
+            window = self.pipeline_window
+        requests = [(req.target, req.lun, req.netfn, req.cmdid,
+                     encode_message(req)) for req in reqs]
+        for req in reqs:
+            log().debug('IPMI Request [%s]', req)
+        return [self._decode_response(req, rx_data)
+                for req, rx_data in zip(reqs, self._send_and_receive_many(
+                    requests, max(1, min(window, MAX_PIPELINE_WINDOW))))]
+
+    def start_scan(self, entries, period):
+        '''Makes the board read sensors on its own, see scan_results.
+
+        The board sends Get Sensor Reading requests itself, one after the
+        other, and a compact result frame per reading, so polling sensors
+        takes no host round trips.
+
+        entries: (target address, sensor number, lun) of up to
+        MAX_SCAN_ENTRIES sensors
+        period: seconds between the start of two sweeps over the entries
+        '''
+        self.arduino.set_scan(entries, period)
+        self.scan_entries = list(entries)
+
+    def stop_scan(self):
+        self.arduino.stop_scan()
+
+    def scan_results(self, timeout=None):
+        '''Yields a ScanResult per reading done by the board.
+
+        Stops when no reading arrives within timeout seconds, the serial
+        timeout by default, 0 only yields what has already arrived.
+        '''
+        while True:
+            try:
+                data = self._serial_receive_raw(self._recv_queue.pop_scan,
+                                                timeout)
+            except IpmiTimeoutError:
+                return
+            yield decode_scan_result(data, self.scan_entries)
 
     def pop_unprocessed_messages(self):
-        result = self._recv_queue
-        self._recv_queue = []
-        return result
+        with self._rx_cond:
+            return self._recv_queue.pop_unprocessed()
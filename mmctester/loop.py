@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+import heapq
+import itertools
+import selectors
+import time
+
+
+class Timer(object):
+    '''A callback scheduled on a SelectorLoop.'''
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SelectorLoop(object):
+    '''Runs callbacks when files are readable or timers are due.
+
+    The loop sleeps in a single select until a registered file is readable
+    or the next timer is due, so it takes no CPU while there is nothing to
+    do and reacts to input as soon as it arrives.
+    '''
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._selector = selectors.DefaultSelector()
+        self._timers = []
+        self._timer_ids = itertools.count()
+        self._stop = False
+
+    def add_reader(self, fileobj, callback, *args):
+        '''Calls callback(*args) whenever fileobj is readable.
+
+        fileobj: a file descriptor or an object with a fileno() method
+        '''
+        self._selector.register(fileobj, selectors.EVENT_READ,
+                                (callback, args))
+
+    def remove_reader(self, fileobj):
+        self._selector.unregister(fileobj)
+
+    def call_at(self, when, callback, *args):
+        '''Calls callback(*args) once the clock reaches when.
+
+        Returns a Timer that can be cancelled.
+        '''
+        timer = Timer(when, callback, args)
+        heapq.heappush(self._timers, (when, next(self._timer_ids), timer))
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def stop(self):
+        '''Makes run_forever return after the current iteration.'''
+        self._stop = True
+
+    def _timeout(self):
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0.0, self._timers[0][0] - self.clock())
+
+    def run_once(self):
+        '''Waits for the next readable file or due timer and dispatches.'''
+        for key, _ in self._selector.select(self._timeout()):
+            callback, args = key.data
+            callback(*args)
+        now = self.clock()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+
+    def run_forever(self):
+        self._stop = False
+        while not self._stop:
+            self.run_once()
+
+    def close(self):
+        self._selector.close()
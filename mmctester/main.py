@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 import argparse
+import asyncio
+import sys
 import time
 
 import pyipmi
@@ -7,25 +9,82 @@ import pyipmi
 from pyipmi.sensor import SENSOR_TYPE_MODULE_HOT_SWAP
 
 from mmctester.arduino import (HIGH, LOW, OUTPUT)
+from mmctester.cache import FruCache, SdrCache, device_identity
+from mmctester.fru import FruReader
+from mmctester.hotswap import (STATE_ACTIVATING, STATE_DEACTIVATING,
+                               STATE_OFF, STATE_ON, HotSwapSequencer,
+                               delay_override)
 from mmctester.interface import MMCTesterBoard
 from mmctester.led import set_led_long, set_led_off, set_led_short
+from mmctester.loop import SelectorLoop
+from mmctester.metrics import (DEFAULT_EXPORT_INTERVAL, TextfileExporter,
+                               metrics_lines)
+from mmctester.recorder import Recorder
+from mmctester.scheduler import (DEFAULT_BUDGET, PollScheduler,
+                                 interval_override)
+from mmctester.sensors import (alarm_names, create_sensor_reading_request,
+                               decode_sensor_reading, sensor_luts)
 from mmctester.tui import TuiManager
 from mmctester.util import hex_or_int
 
 
 DEFAULT_TARGET = 0xa2
-PAYLOAD_SLEEP = 3
+# log lines, LED setting and payload power of each hot-swap state
+HOTSWAP_ACTIONS = {
+    STATE_ACTIVATING: (("Handle closed", "Negotiating power"), set_led_long,
+                       None),
+    STATE_ON: (("Enabling payload",), set_led_off, True),
+    STATE_DEACTIVATING: (("Handle open",), set_led_short, None),
+    STATE_OFF: (("Disabling payload",), set_led_off, False),
+}
+# longest time between two refreshes while no sensor is due, it is also
+# how late a terminal resize may be noticed
+STATUS_PERIOD = 1.0
 
 
 class Main(object):
-    def __init__(self, port, target, pin_pg, pin_hs, pin_pwm):
+    def __init__(self, port, target, pin_pg, pin_hs, pin_pwm,
+                 reader_thread=True, sdr_cache=True, fru_cache=True,
+                 poll_budget=DEFAULT_BUDGET, poll_intervals=None, record=None,
+                 hotswap_delays=None, metrics_file=None,
+                 metrics_interval=DEFAULT_EXPORT_INTERVAL):
+        self._init_state(pin_pg, pin_hs, pin_pwm, sdr_cache, fru_cache,
+                         poll_budget, poll_intervals, record, hotswap_delays,
+                         metrics_file, metrics_interval)
+        self.interface = MMCTesterBoard(port=port, reader_thread=reader_thread)
+        self.ipmi = pyipmi.create_connection(self.interface)
+        self.ipmi.target = pyipmi.Target(target)
+        self.identify()
+        self.sdr = self.read_sdr()
+        self.luts = sensor_luts(self.sdr)
+        self.scheduler = self.create_scheduler()
+        self.recorder = self.create_recorder()
+        self.exporter = self.create_exporter(port, target)
+        self.loop = SelectorLoop()
+        self.hotswap = self.create_hotswap(self.loop.call_later)
+        self._init_tui()
+
+    def _init_state(self, pin_pg, pin_hs, pin_pwm, sdr_cache, fru_cache,
+                    poll_budget, poll_intervals, record, hotswap_delays,
+                    metrics_file, metrics_interval):
+        self.poll_budget = poll_budget
+        self.poll_intervals = poll_intervals
+        self.record_path = record
+        self.recorder = None
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.exporter = None
+        self.luts = []
+        self._poll_timer = None
+        self._redraw_timer = None
+        self.hotswap_delays = hotswap_delays
+        self.hotswap = None
+        self.sdr_cache = SdrCache() if sdr_cache else None
+        self.fru_cache = FruCache() if fru_cache else None
+        self.identity = None
         self.pin_pg = pin_pg
         self.pin_hs = pin_hs
         self.pin_pwm = pin_pwm
-        self.interface = MMCTesterBoard(port=port)
-        self.ipmi = pyipmi.create_connection(self.interface)
-        self.ipmi.target = pyipmi.Target(target)
-        self.sdr = list(self.ipmi.device_sdr_entries())
         self.help_lines = [
             "Keys:  "
             + ("1 => set HS HIGH    2 => set HS LOW   "
@@ -41,46 +100,121 @@ class Main(object):
         self.sensor_lines = []
         self.log_lines = []
         self.payload_lines = []
+        self.metrics_lines = []
         self.max_log_size = 8
+        self.want_quit = False
+
+    def _init_tui(self):
         self.tui = TuiManager()
         self.tui.add_draw_callback(self.draw)
         self.tui.add_key_callback(self.on_key_press)
-        self.want_quit = False
 
-    def draw(self):
-        self.tui.clear()
-        self.tui.add_str(
-            ["HELP"] +
-            self.help_lines +
-            ["===", "DEVICE"] +
-            self.device_lines +
-            ["===", "FRU"] +
-            self.fru_lines +
-            ["===", "SENSORS"] +
-            self.sensor_lines +
-            ["===", "PAYLOAD"] +
-            self.payload_lines +
-            ["===", "LOGS"] +
-            self.log_lines)
+    # the caches share one check of the device identity
+    def identify(self):
+        if self.sdr_cache is not None or self.fru_cache is not None:
+            self.identity = device_identity(self.ipmi)
+
+    def read_sdr(self):
+        if self.sdr_cache is None:
+            return list(self.ipmi.device_sdr_entries())
+        return self.sdr_cache.device_sdr_entries(self.ipmi, self.identity)
+
+    def create_scheduler(self):
+        return PollScheduler(self.sdr, self.poll_budget, self.poll_intervals)
+
+    def create_recorder(self):
+        if self.record_path is None:
+            return None
+        return Recorder(self.record_path, self.sdr,
+                        self.ipmi.target.ipmb_address)
+
+    # appends the readings of a batch of the scheduler to the recording
+    def record_batch(self, batch):
+        if self.recorder is None:
+            return
+        now = time.time()
+        for schedule in batch:
+            self.recorder.record(now, schedule.sdr.number, schedule.raw,
+                                 schedule.states)
+
+    def close_recorder(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def create_exporter(self, port, target):
+        if self.metrics_file is None:
+            return None
+        return TextfileExporter(self.metrics_file, self.interface,
+                                {'port': port, 'target': f'0x{target:02x}'},
+                                self.metrics_interval)
+
+    def export_metrics(self):
+        if self.exporter is None:
+            return
+        try:
+            self.exporter.write()
+        except OSError as e:
+            self.log(f'Metrics export failed: {e}')
+
+    def show_metrics(self):
+        self.metrics_lines = metrics_lines(self.interface)
+
+    def read_fru(self):
+        if self.fru_cache is None:
+            return FruReader(self.ipmi).get_fru_inventory(0)
+        return self.fru_cache.get_fru_inventory(self.ipmi, 0, self.identity)
+
+    # only the sections that changed are redrawn, force draws even if the
+    # previous frame was just drawn, e.g. before blocking
+    def draw(self, force=False):
+        self.tui.set_section("HELP", self.help_lines)
+        self.tui.set_section("DEVICE", self.device_lines)
+        self.tui.set_section("FRU", self.fru_lines)
+        self.tui.set_section("SENSORS", self.sensor_lines)
+        self.tui.set_section("PAYLOAD", self.payload_lines)
+        self.tui.set_section("METRICS", self.metrics_lines)
+        self.tui.set_section("LOGS", self.log_lines)
+        self.tui.render(force)
+        # a frame skipped by the frame rate limit is drawn as soon as the
+        # limit allows, not by whatever draws next
+        delay = self.tui.pending_delay()
+        if delay is not None and self._redraw_timer is None:
+            self._redraw_timer = self.call_later(delay, self._redraw)
+
+    def _redraw(self):
+        self._redraw_timer = None
+        self.draw()
+
+    def call_later(self, delay, callback):
+        return self.loop.call_later(delay, callback)
 
     def on_key_press(self, key):
+        action = self.key_action(key)
+        if action is not None:
+            command, args = action
+            command(*args)
+
+    # returns the arduino command bound to a key and its arguments
+    def key_action(self, key):
+        arduino = self.interface.arduino
         if key == ord('q'):
             self.want_quit = True
         elif key == ord('1') and self.pin_hs is not None:
-            self.interface.arduino.digital_write(self.pin_hs, HIGH)
+            return arduino.digital_write, (self.pin_hs, HIGH)
         elif key == ord('2') and self.pin_hs is not None:
-            self.interface.arduino.digital_write(self.pin_hs, LOW)
+            return arduino.digital_write, (self.pin_hs, LOW)
         elif key == ord('+') and self.pin_pwm is not None:
             self.duty = self.duty + 32
             if self.duty > 255:
                 self.duty = 255
 
-            self.interface.arduino.analog_write(self.pin_pwm, self.duty)
+            return arduino.analog_write, (self.pin_pwm, self.duty)
         elif key == ord('-') and self.pin_pwm is not None:
             self.duty = self.duty - 32
             if self.duty < 0:
                 self.duty = 0
-            self.interface.arduino.analog_write(self.pin_pwm, self.duty)
+            return arduino.analog_write, (self.pin_pwm, self.duty)
+        return None
 
     def log(self, line):
         ts = time.strftime('%H:%M:%S - ')
@@ -96,7 +230,7 @@ class Main(object):
             f"Device Rev: {device_id.revision}",
             f"Firmware Rev: {device_id.fw_revision}"
         ]
-        fru = self.ipmi.get_fru_inventory(0)
+        fru = self.read_fru()
         product = fru.product_info_area
         self.fru_lines = []
         if product:
@@ -116,88 +250,206 @@ class Main(object):
         if self.pin_pg is not None:
             self.ipmi.interface.arduino.digital_write(self.pin_pg, LOW)
 
-    def process_handle_closed(self):
-        self.log("Handle closed")
-        set_led_long(self.ipmi)
-        self.log("Negotiating power")
-        self.draw()
-        time.sleep(PAYLOAD_SLEEP)
-        set_led_off(self.ipmi)
-        self.log("Enabling payload")
-        self.enable_payload()
-
-    def process_handle_open(self):
-        self.log("Handle open")
-        set_led_short(self.ipmi)
-        self.draw()
-        time.sleep(PAYLOAD_SLEEP)
-        set_led_off(self.ipmi)
-        self.log("Disabling payload")
-        self.disable_payload()
-
+    def create_hotswap(self, call_later):
+        return HotSwapSequencer(call_later, self.enter_hotswap_state,
+                                self.hotswap_delays)
+
+    def enter_hotswap_state(self, state):
+        lines, set_led, payload = HOTSWAP_ACTIONS[state]
+        for line in lines:
+            self.log(line)
+        set_led(self.ipmi)
+        if payload is True:
+            self.enable_payload()
+        elif payload is False:
+            self.disable_payload()
+        self.show_payload_status()
+        self.draw(force=True)
+        # the requests above may have queued events
+        self.loop.call_later(0, self._on_serial_ready)
+
+    # returns whether the event was a hot-swap handle event
+    def handle_event(self, event):
+        if event.sensor_type != SENSOR_TYPE_MODULE_HOT_SWAP or \
+                event.event_type.dir != 0:
+            return False
+        self.scheduler.expire(SENSOR_TYPE_MODULE_HOT_SWAP)
+        if event.event_data[0] == 0:
+            self.hotswap.handle_closed()
+        elif event.event_data[0] == 1:
+            self.hotswap.handle_open()
+        return True
+
+    # all the readings are requested at once, so that their serial and IPMB
+    # latencies overlap
+    def read_sensors(self, sdrs):
+        return self.sensor_readings(sdrs, self.interface.send_and_receive_many(
+            self.sensor_requests(sdrs)))
+
+    def sensor_requests(self, sdrs):
+        reqs = []
+        for s in sdrs:
+            if s.type is pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD:
+                reqs.append(create_sensor_reading_request(
+                    self.ipmi.target, s.number, s.owner_lun))
+            elif s.type is pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD:
+                reqs.append(create_sensor_reading_request(
+                    self.ipmi.target, s.number))
+        return reqs
+
+    # matches the responses to sensor_requests with their records
+    def sensor_readings(self, sdrs, rsps):
+        rsps = iter(rsps)
+        readings = []
+        for s in sdrs:
+            if s.type in (pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD,
+                          pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD):
+                readings.append(decode_sensor_reading(next(rsps)))
+            else:
+                readings.append((None, None))
+        return readings
+
+    # reads the sensors that are due, the others show their last reading
     def show_sensors(self):
-        self.sensor_lines = []
-        for sdr_entry in self.sdr:
-            self.show_sensor_value(sdr_entry)
+        self.record_batch(self.scheduler.poll(self.read_sensors))
+        self.show_readings(self.scheduler.readings())
 
-    def show_sensor_value(self, s):
-        if s.type is pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD:
-            (raw, states) = self.ipmi.get_sensor_reading(s.number, s.owner_lun)
-            value = s.convert_sensor_raw_to_value(raw)
+    def show_readings(self, readings):
+        self.sensor_lines = []
+        for sdr_entry, lut, (raw, states, age) in zip(self.sdr, self.luts,
+                                                      readings):
+            self.show_sensor_value(sdr_entry, raw, states, age, lut)
+
+    # lut: SensorLut of a full sensor record, the alarms are only checked
+    # with one
+    def show_sensor_value(self, s, raw, states, age=None, lut=None):
+        if s.type in (pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD,
+                      pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD) and \
+                age is None:
+            self.sensor_lines.append(f"{s.device_id_string}: not read yet")
+        elif s.type is pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD:
+            if lut is None:
+                value = s.convert_sensor_raw_to_value(raw)
+                alarms = 0
+            else:
+                value = lut.value(raw)
+                alarms = lut.alarms(raw)
             if value is None:
                 value = "na"
-            self.sensor_lines.append(
-                f"{s.device_id_string}: value={value}")
+            line = f"{s.device_id_string}: value={value} ({age:.1f}s ago)"
+            if alarms:
+                line += f" ALARM {','.join(alarm_names(alarms)).upper()}"
+            self.sensor_lines.append(line)
         elif s.type is pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD:
-            (raw, states) = self.ipmi.get_sensor_reading(s.number)
             # TODO: interpret hotswap sensor and make sure it makes sense
             # Does the HS sensor provided by carrier differ?
             self.sensor_lines.append(f"{s.device_id_string}: raw_value={raw} "
-                f"state=0x{states:x}")
+                f"state=0x{states:x} ({age:.1f}s ago)")
         else:
             self.sensor_lines.append(
                 f"{s.device_id_string}: unknown")
 
-    def show_payload_status(self):
-        self.payload_lines = []
-        if self.pin_pg is not None:
-            pg_val = self.interface.arduino.digital_read(self.pin_pg)
-            self.payload_lines.append(f'PG value: {pg_val}')
+    # the pins read back for the PAYLOAD section, by name
+    def payload_pins(self):
+        return [(name, pin) for name, pin in (('PG', self.pin_pg),
+                                              ('HS', self.pin_hs))
+                if pin is not None]
+
+    def payload_status_batch(self):
+        batch = self.interface.arduino.batch()
+        for _, pin in self.payload_pins():
+            batch.digital_read(pin)
+        return batch
+
+    def set_payload_lines(self, values):
+        self.payload_lines = [f'{name} value: {value}' for (name, _), value
+                              in zip(self.payload_pins(), values)]
         if self.pin_pwm is not None:
             self.payload_lines.append(f'PWM value: {self.duty}')
 
+    def output_pins(self):
+        return [pin for pin in (self.pin_pg, self.pin_hs, self.pin_pwm)
+                if pin is not None]
+
+    # one round trip for all the pins
+    def show_payload_status(self):
+        self.set_payload_lines(self.payload_status_batch().flush())
+
     def setup_pins(self):
-        if self.pin_pg is not None:
-            self.interface.arduino.pin_mode(self.pin_pg, OUTPUT)
-        if self.pin_hs is not None:
-            self.interface.arduino.pin_mode(self.pin_hs, OUTPUT)
-        if self.pin_pwm is not None:
-            self.interface.arduino.pin_mode(self.pin_pwm, OUTPUT)
+        with self.interface.arduino.batch() as batch:
+            for pin in self.output_pins():
+                batch.pin_mode(pin, OUTPUT)
+
+    def log_unprocessed(self):
+        unprocessed = self.interface.pop_unprocessed_messages()
+        if unprocessed:
+            self.log(f"Unknown messages: {unprocessed}")
+
+    def schedule_poll(self, delay):
+        if self._poll_timer is not None:
+            self._poll_timer.cancel()
+        self._poll_timer = self.loop.call_later(delay, self._poll)
+
+    # reads the sensors that are due and sleeps until the next one is
+    def _poll(self):
+        self._poll_timer = None
+        # a resize is only noticed by reading the keys
+        self._on_keys()
+        self.show_sensors()
+        self.show_payload_status()
+        self.show_metrics()
+        # events read from the port along with the responses are queued and
+        # the port does not wake the loop for them
+        self.handle_events()
+        self.log_unprocessed()
+        self.draw()
+        time_to_next = self.scheduler.time_to_next()
+        if time_to_next is None or time_to_next > STATUS_PERIOD:
+            time_to_next = STATUS_PERIOD
+        self.schedule_poll(time_to_next)
+
+    def _export(self):
+        self.export_metrics()
+        self.loop.call_later(self.exporter.interval, self._export)
+
+    # handles the queued events, returns whether one was a hot-swap event
+    def handle_events(self):
+        hotswap = False
+        event = self.interface.receive_and_ack_event(timeout=0)
+        while event is not None:
+            hotswap = self.handle_event(event) or hotswap
+            event = self.interface.receive_and_ack_event(timeout=0)
+        return hotswap
+
+    def _on_serial_ready(self):
+        self.interface.drain_wakeup()
+        if self.handle_events():
+            self.schedule_poll(0)
+        self.log_unprocessed()
+        self.draw()
 
+    def _on_keys(self):
+        self.tui.process_events()
+        # a key command may have queued events
+        if self.handle_events():
+            self.schedule_poll(0)
+        if self.want_quit:
+            self.loop.stop()
+        else:
+            self.draw()
+
+    # sensor polls, key presses, events and the deferred payload changes
+    # are all dispatched from the loop, which sleeps until one of them is
+    # due
     def _run(self):
         self.setup_pins()
         self.show_general_info()
-        while True:
-            self.show_sensors()
-            self.show_payload_status()
-            event = self.interface.receive_and_ack_event()
-            unprocessed = self.interface.pop_unprocessed_messages()
-            if unprocessed:
-                self.log(f"Unknown messages: {unprocessed}")
-
-            if event and event.sensor_type == SENSOR_TYPE_MODULE_HOT_SWAP and \
-                    event.event_type.dir == 0:
-                if event.event_data[0] == 0:
-                    self.process_handle_closed()
-                elif event.event_data[0] == 1:
-                    self.process_handle_open()
-
-            self.tui.process_events()
-            if self.want_quit:
-                break
-
-            self.draw()
-
+        self.loop.add_reader(self.interface, self._on_serial_ready)
+        self.loop.add_reader(sys.stdin, self._on_keys)
+        self.schedule_poll(0)
+        if self.exporter is not None:
+            self.loop.call_later(self.exporter.interval, self._export)
+        self.loop.run_forever()
         self.tui.quit()
 
     def run(self):
@@ -208,6 +460,9 @@ class Main(object):
         except Exception:
             self.tui.quit()
             raise
+        finally:
+            self.close_recorder()
+            self.export_metrics()
 
 
 def parse_args():
@@ -226,12 +481,69 @@ def parse_args():
     parser.add_argument(
         '--pin-pwm', type=int,
         help="Arduino pin used for outputing a test PWM signal")
+    parser.add_argument(
+        '--no-reader-thread', dest='reader_thread', action='store_false',
+        help="Read the serial port only while waiting for an answer")
+    parser.add_argument(
+        '--asyncio', action='store_true',
+        help="Poll sensors, handle events and keys as concurrent asyncio "
+             "tasks")
+    parser.add_argument(
+        '--no-sdr-cache', dest='sdr_cache', action='store_false',
+        help="Read the SDRs from the device even if they are cached")
+    parser.add_argument(
+        '--no-fru-cache', dest='fru_cache', action='store_false',
+        help="Read the FRU from the device even if it is cached")
+    parser.add_argument(
+        '--poll-budget', type=float, default=DEFAULT_BUDGET,
+        help="Seconds of sensor reading per loop iteration")
+    parser.add_argument(
+        '--poll-interval', type=interval_override, action='append',
+        default=[], metavar='NAME=SECONDS',
+        help="Fixed poll interval of a sensor, can be repeated")
+    parser.add_argument(
+        '--record', metavar='FILE',
+        help="Record the sensor readings to FILE, see mmcrecording")
+    parser.add_argument(
+        '--hotswap-delay', type=delay_override, action='append', default=[],
+        metavar='STATE=SECONDS',
+        help="Seconds spent in a timed hot-swap state (activating or "
+             "deactivating), can be repeated")
+    parser.add_argument(
+        '--metrics-file', metavar='FILE',
+        help="Write the metrics of the board to FILE in the Prometheus text "
+             "format, e.g. for the textfile collector of node_exporter")
+    parser.add_argument(
+        '--metrics-interval', type=float, default=DEFAULT_EXPORT_INTERVAL,
+        help="Seconds between writes of the metrics file")
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    main = Main(args.port, args.target, args.pin_pg, args.pin_hs, args.pin_pwm)
+    if args.asyncio:
+        # imported here, mmctester.aio builds on this module
+        from mmctester.aio import AsyncMain
+        main = AsyncMain(args.port, args.target, args.pin_pg, args.pin_hs,
+                         args.pin_pwm, sdr_cache=args.sdr_cache,
+                         fru_cache=args.fru_cache,
+                         poll_budget=args.poll_budget,
+                         poll_intervals=dict(args.poll_interval),
+                         record=args.record,
+                         hotswap_delays=dict(args.hotswap_delay),
+                         metrics_file=args.metrics_file,
+                         metrics_interval=args.metrics_interval)
+        try:
+            asyncio.run(main.run())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    main = Main(args.port, args.target, args.pin_pg, args.pin_hs, args.pin_pwm,
+                args.reader_thread, args.sdr_cache, args.fru_cache,
+                args.poll_budget, dict(args.poll_interval), args.record,
+                dict(args.hotswap_delay), args.metrics_file,
+                args.metrics_interval)
     main.run()
 
 
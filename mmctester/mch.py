@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+import queue
+import threading
+
+import pyipmi
+import pyipmi.interfaces
+
+from pyipmi.logger import log
+
+RMCP_PORT = 623
+# addresses used to bridge requests through the MCH to an AMC
+SLAVE_ADDRESS = 0x81
+MCH_ADDRESS = 0x20
+CARRIER_ADDRESS = 0x82
+AMC_CHANNEL = 7
+# bridged requests in flight per MCH, more would congest its IPMB
+DEFAULT_WINDOW = 2
+
+
+def bridged_target(target):
+    '''Target behind the MCH, reached by double bridging.'''
+    return pyipmi.Target(
+        ipmb_address=target,
+        routing=[(SLAVE_ADDRESS, MCH_ADDRESS, 0),
+                 (MCH_ADDRESS, CARRIER_ADDRESS, AMC_CHANNEL),
+                 (CARRIER_ADDRESS, target, None)])
+
+
+def open_rmcp_session(host):
+    '''Returns a RMCP interface with a session established to host.'''
+    interface = pyipmi.interfaces.create_interface(
+        interface='rmcp', slave_address=SLAVE_ADDRESS,
+        host_target_address=MCH_ADDRESS)
+    ipmi = pyipmi.create_connection(interface)
+    ipmi.session.set_session_type_rmcp(host=host, port=RMCP_PORT)
+    ipmi.session.set_auth_type_user(username='', password='')
+    ipmi.session.establish()
+    return interface
+
+
+class MchSessionPool(object):
+    '''RMCP sessions to a MCH shared by the connections to its targets.
+
+    Can be used as the interface of several pyipmi connections at once,
+    e.g. one per thread. Each request borrows an established session, at
+    most window sessions are opened, so there are never more than window
+    bridged requests in flight to the MCH. Sessions are kept open and
+    reused until close.
+
+    connect: returns an interface with an established session to host
+    '''
+
+    def __init__(self, host, window=DEFAULT_WINDOW,
+                 connect=open_rmcp_session):
+        self.host = host
+        self.window = window
+        self.connect = connect
+        self.opened = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._sessions = []
+
+    def __repr__(self):
+        return f'MchSessionPool({self.host}, opened={self.opened})'
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self.opened < self.window
+            if can_open:
+                self.opened += 1
+        if not can_open:
+            return self._idle.get()
+        try:
+            interface = self.connect(self.host)
+        except Exception:
+            with self._lock:
+                self.opened -= 1
+            raise
+        log().debug('Opened session %d to %s', self.opened, self.host)
+        self._sessions.append(interface)
+        return interface
+
+    # runs func with a session, waiting for one while window are in use
+    def _call(self, func, *args):
+        interface = self._acquire()
+        try:
+            return func(interface, *args)
+        finally:
+            self._idle.put(interface)
+
+    def send_and_receive(self, req):
+        return self._call(lambda i: i.send_and_receive(req))
+
+    def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
+        return self._call(lambda i: i.send_and_receive_raw(
+            target, lun, netfn, raw_bytes))
+
+    def send_and_receive_many(self, reqs, window=None):
+        '''Responses of reqs, one after the other on a session.'''
+        return self._call(lambda i: [i.send_and_receive(r) for r in reqs])
+
+    def is_target_accessible(self, target):
+        return self._call(lambda i: i.is_target_accessible(target))
+
+    def close(self):
+        for interface in self._sessions:
+            try:
+                interface.close_session()
+                interface.close()
+            except Exception as e:
+                log().debug('Closing session to %s: %s', self.host, e)
+        self._sessions = []
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+import os
+import time
+
+from bisect import bisect_left
+
+from mmctester.rxqueue import KIND_OTHER
+
+# upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5)
+DEFAULT_EXPORT_INTERVAL = 15.0
+METRIC_PREFIX = 'mmctester_'
+# name, type and help of the exported metrics, by snapshot key
+METRICS = (
+    ('frames_sent', 'counter', 'Frames written to the serial port'),
+    ('frames_received', 'counter', 'Frames read from the serial port'),
+    ('bytes_sent', 'counter', 'Bytes written to the serial port'),
+    ('bytes_received', 'counter', 'Bytes read from the serial port'),
+    ('retries', 'counter', 'IPMB requests sent again after a timeout'),
+    ('timeouts', 'counter', 'Requests given up after their retries'),
+    ('abandoned', 'counter',
+     'Requests in flight dropped along with a request given up'),
+    ('local_commands', 'counter', 'Local commands answered by the board'),
+    ('unknown_messages', 'counter',
+     'Frames that are neither responses, events nor local answers'),
+    ('invalid_frames', 'counter', 'Frames with a wrong IPMB checksum'),
+    ('queue_overflows', 'counter', 'Frames evicted from the full queue'),
+    ('queue_depth', 'gauge', 'Frames waiting in the receive queue'),
+    ('read_seconds', 'histogram', 'Time blocked in serial reads'),
+    ('request_seconds', 'histogram',
+     'Time from sending an IPMB request to its response'),
+    ('local_command_seconds', 'histogram',
+     'Time from sending a local command to its answer'),
+)
+# gauges of each round trip time estimator, by estimator snapshot key
+RTT_METRICS = (
+    ('srtt', 'rtt_smoothed_seconds',
+     'Smoothed round trip time of the requests of a target and command'),
+    ('rttvar', 'rtt_variation_seconds',
+     'Mean deviation of the round trip time'),
+    ('timeout', 'request_timeout_seconds',
+     'Timeout of the next request of a target and command'),
+)
+
+
+class Histogram(object):
+    '''Number of observations per bucket, like a Prometheus histogram.'''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        '''Upper bound of the bucket holding the q quantile, None if empty.
+
+        Observations beyond the last bucket give infinity.
+        '''
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts),
+                'sum': self.sum, 'count': self.count}
+
+
+class BoardMetrics(object):
+    '''Counters of the traffic with the board.
+
+    Updated on every frame, so they only add a few attribute increments to
+    the hot paths. The frames received are counted by the receive queue,
+    see snapshot.
+    '''
+
+    def __init__(self):
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.abandoned = 0
+        self.local_commands = 0
+        self.read_seconds = Histogram()
+        self.request_seconds = Histogram()
+        self.local_command_seconds = Histogram()
+
+    def snapshot(self, queue):
+        '''Current values by metric name, see METRICS.
+
+        queue: the ReceiveQueue of the interface
+        '''
+        return {
+            'frames_sent': self.frames_sent,
+            'frames_received': sum(queue.received.values()),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'retries': self.retries,
+            'timeouts': self.timeouts,
+            'abandoned': self.abandoned,
+            'local_commands': self.local_commands,
+            'unknown_messages': queue.received[KIND_OTHER],
+            'invalid_frames': queue.invalid,
+            'queue_overflows': queue.overflows,
+            'queue_depth': len(queue),
+            'read_seconds': self.read_seconds.snapshot(),
+            'request_seconds': self.request_seconds.snapshot(),
+            'local_command_seconds': self.local_command_seconds.snapshot(),
+        }
+
+
+class MeteredSerial(object):
+    '''Serial port counting what goes through it in a BoardMetrics.
+
+    Every write is a frame. The time spent in reads is observed, with a
+    blocking port that is the time waiting for the board.
+    '''
+
+    def __init__(self, ser, metrics):
+        self._ser = ser
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+
+    # set on the port itself, e.g. by the reader thread
+    @property
+    def timeout(self):
+        return self._ser.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._ser.timeout = timeout
+
+    def write(self, data):
+        self._metrics.frames_sent += 1
+        self._metrics.bytes_sent += len(data)
+        return self._ser.write(data)
+
+    def read(self, size=1):
+        started = time.perf_counter()
+        data = self._ser.read(size)
+        self._metrics.read_seconds.observe(time.perf_counter() - started)
+        self._metrics.bytes_received += len(data)
+        return data
+
+    def read_until(self, *args, **kwargs):
+        started = time.perf_counter()
+        data = self._ser.read_until(*args, **kwargs)
+        self._metrics.read_seconds.observe(time.perf_counter() - started)
+        self._metrics.bytes_received += len(data)
+        return data
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    text = ','.join(f'{name}="{value}"' for name, value in labels.items())
+    return '{' + text + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else f'{bound:g}'
+
+
+def prometheus_text(snapshot, labels=None):
+    '''Formats a metrics snapshot in the Prometheus text format.'''
+    lines = []
+    for key, kind, description in METRICS:
+        name = METRIC_PREFIX + key
+        if kind == 'counter':
+            name += '_total'
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        value = snapshot[key]
+        if kind != 'histogram':
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+            continue
+        total = 0
+        bounds = value['buckets'] + [float('inf')]
+        for bound, count in zip(bounds, value['counts']):
+            total += count
+            bucket_labels = dict(labels or {}, le=_format_bound(bound))
+            lines.append(
+                f'{name}_bucket{_format_labels(bucket_labels)} {total}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {value["sum"]}')
+        lines.append(f'{name}_count{_format_labels(labels)} '
+                     f'{value["count"]}')
+    for key, name, description in RTT_METRICS:
+        name = METRIC_PREFIX + name
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} gauge')
+        for estimator in snapshot.get('rtt', []):
+            if estimator[key] is None:
+                continue
+            rtt_labels = dict(labels or {},
+                              target=f'0x{estimator["target"]:02x}',
+                              netfn=f'0x{estimator["netfn"]:02x}',
+                              cmd=f'0x{estimator["cmdid"]:02x}')
+            lines.append(f'{name}{_format_labels(rtt_labels)} '
+                         f'{estimator[key]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _quantile_ms(histogram, q):
+    bound = histogram.quantile(q)
+    if bound is None:
+        return '-'
+    return f'<{bound * 1000:g}ms'
+
+
+def metrics_lines(interface):
+    '''Summary of the metrics of an interface, for the TUI.'''
+    metrics = interface.metrics
+    snapshot = interface.metrics_snapshot()
+    return [
+        f"Frames tx {snapshot['frames_sent']} rx "
+        f"{snapshot['frames_received']}, bytes tx {snapshot['bytes_sent']} "
+        f"rx {snapshot['bytes_received']}, retries {snapshot['retries']}, "
+        f"timeouts {snapshot['timeouts']}",
+        f"Queue {snapshot['queue_depth']}, overflows "
+        f"{snapshot['queue_overflows']}, unknown "
+        f"{snapshot['unknown_messages']}, invalid "
+        f"{snapshot['invalid_frames']}",
+        f"Request p50 {_quantile_ms(metrics.request_seconds, 0.5)} p95 "
+        f"{_quantile_ms(metrics.request_seconds, 0.95)}, local p50 "
+        f"{_quantile_ms(metrics.local_command_seconds, 0.5)}, blocked in "
+        f"reads {metrics.read_seconds.sum:.1f}s",
+    ] + [rtt_line(estimator) for estimator in snapshot['rtt']]
+
+
+def rtt_line(estimator):
+    '''Summary of a round trip time estimator snapshot.'''
+    text = (f"RTT 0x{estimator['target']:02x} netfn "
+            f"0x{estimator['netfn']:02x} cmd 0x{estimator['cmdid']:02x}")
+    if estimator['srtt'] is not None:
+        text += (f" srtt {estimator['srtt'] * 1000:.1f}ms var "
+                 f"{estimator['rttvar'] * 1000:.1f}ms")
+    return (f"{text} timeout {estimator['timeout'] * 1000:.0f}ms, "
+            f"{estimator['samples']} samples, {estimator['timeouts']} "
+            f"timeouts")
+
+
+class TextfileExporter(object):
+    '''Writes the metrics of an interface to a file for Prometheus.
+
+    Meant for the textfile collector of node_exporter, the file is
+    replaced as a whole so it is never read half written. The owner calls
+    write every interval seconds.
+    '''
+
+    def __init__(self, path, interface, labels=None,
+                 interval=DEFAULT_EXPORT_INTERVAL):
+        self.path = path
+        self.interface = interface
+        self.labels = labels or {}
+        self.interval = interval
+
+    def write(self):
+        text = prometheus_text(self.interface.metrics_snapshot(), self.labels)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
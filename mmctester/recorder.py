@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+import argparse
+import csv
+import json
+import math
+import mmap
+import struct
+import sys
+import time
+
+from array import array
+from itertools import compress
+
+import pyipmi
+
+from pyipmi.sdr import SdrCommon
+
+from mmctester.sensors import SensorLut
+
+FILE_MAGIC = b'MMCR'
+CHUNK_MAGIC = b'CHNK'
+FORMAT_VERSION = 1
+# magic, version, reserved, length of the JSON metadata
+FILE_HEADER = struct.Struct('<4sHHI')
+# magic, number of readings
+CHUNK_HEADER = struct.Struct('<4sI')
+# one array per column, largest items first so every column stays aligned
+COLUMNS = (('time', 'd'), ('states', 'H'), ('number', 'B'), ('raw', 'B'),
+           ('flags', 'B'))
+FLAG_RAW = 0x01
+FLAG_STATES = 0x02
+# readings buffered before a chunk is written
+CHUNK_SIZE = 4096
+# seconds after which a partial chunk is written anyway
+FLUSH_INTERVAL = 10.0
+
+
+def _padding(nbytes):
+    return -nbytes % 8
+
+
+class Recorder(object):
+    '''Appends sensor readings to a columnar file.
+
+    Readings are buffered in one array per column and written as a chunk
+    when CHUNK_SIZE of them are buffered, or FLUSH_INTERVAL seconds after
+    the previous chunk, so a reading costs a few array appends. The file
+    starts with the SDRs of the target, a Recording can convert the raw
+    values without the device.
+    '''
+
+    def __init__(self, path, sdrs, target=None, chunk_size=CHUNK_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._columns = [array(typecode) for _, typecode in COLUMNS]
+        self._flushed = time.monotonic()
+        metadata = json.dumps({
+            'target': target,
+            'started': time.time(),
+            'byteorder': sys.byteorder,
+            'sdrs': [bytes(s.data).hex() for s in sdrs],
+        }).encode()
+        self._file = open(path, 'wb')
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION, 0,
+                                          len(metadata)))
+        self._file.write(metadata)
+        self._file.write(bytes(_padding(FILE_HEADER.size + len(metadata))))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, timestamp, number, raw, states):
+        '''Stores a reading, raw and states are None if not available.'''
+        times, states_column, numbers, raws, flags = self._columns
+        times.append(timestamp)
+        states_column.append(states or 0)
+        numbers.append(number)
+        raws.append(raw or 0)
+        flags.append((FLAG_RAW if raw is not None else 0) |
+                     (FLAG_STATES if states is not None else 0))
+        self.count += 1
+        if len(times) >= self.chunk_size or \
+                time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''Writes the buffered readings as a chunk.'''
+        self._flushed = time.monotonic()
+        count = len(self._columns[0])
+        if not count:
+            return
+        self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, count))
+        nbytes = 0
+        for column in self._columns:
+            column.tofile(self._file)
+            nbytes += column.itemsize * count
+            del column[:]
+        self._file.write(bytes(_padding(nbytes)))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+class Recording(object):
+    '''A file written by a Recorder, read through a memory map.
+
+    Only the chunk headers are read when opening it, the readings are read
+    from the map a chunk at a time, whatever the size of the file. A chunk
+    cut short, e.g. by a crash of the recorder, is ignored.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, length = FILE_HEADER.unpack_from(self._mm)
+        if magic != FILE_MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'Not a recording: {path}')
+        start = FILE_HEADER.size
+        self.metadata = json.loads(self._mm[start:start + length])
+        if self.metadata['byteorder'] != sys.byteorder:
+            raise ValueError(
+                f'Recording is {self.metadata["byteorder"]} endian')
+        self.sdrs = [SdrCommon.from_data(bytes.fromhex(data))
+                     for data in self.metadata['sdrs']]
+        self.luts = {number: SensorLut(sdr)
+                     for number, sdr in self.sensors().items()
+                     if sdr.type is pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD}
+        self._chunks = self._index(start + length + _padding(start + length))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return sum(count for _, count in self._chunks)
+
+    def _index(self, offset):
+        chunks = []
+        row_size = sum(array(typecode).itemsize for _, typecode in COLUMNS)
+        while offset + CHUNK_HEADER.size <= len(self._mm):
+            magic, count = CHUNK_HEADER.unpack_from(self._mm, offset)
+            nbytes = row_size * count
+            end = offset + CHUNK_HEADER.size + nbytes + _padding(nbytes)
+            if magic != CHUNK_MAGIC or end > len(self._mm):
+                break
+            chunks.append((offset + CHUNK_HEADER.size, count))
+            offset = end
+        return chunks
+
+    def chunks(self):
+        '''Yields the columns of every chunk, see COLUMNS.
+
+        The columns are memoryviews of the file, only valid until the next
+        chunk is yielded.
+        '''
+        with memoryview(self._mm) as view:
+            for offset, count in self._chunks:
+                columns = []
+                for _, typecode in COLUMNS:
+                    nbytes = count * array(typecode).itemsize
+                    columns.append(
+                        view[offset:offset + nbytes].cast(typecode))
+                    offset += nbytes
+                try:
+                    yield columns
+                finally:
+                    for column in columns:
+                        column.release()
+
+    def readings(self):
+        '''Yields (time, sensor number, raw, states) of every reading.'''
+        for times, states, numbers, raws, flags in self.chunks():
+            for i in range(len(times)):
+                yield (times[i], numbers[i],
+                       raws[i] if flags[i] & FLAG_RAW else None,
+                       states[i] if flags[i] & FLAG_STATES else None)
+
+    def sensors(self):
+        '''SDR of each sensor number, the first one if several share it.'''
+        sensors = {}
+        for sdr in self.sdrs:
+            if sdr.type in (pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD,
+                            pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD):
+                sensors.setdefault(sdr.number, sdr)
+        return sensors
+
+    def series(self, number):
+        '''Yields (times, values) arrays of a sensor, a pair per chunk.
+
+        The values are converted in bulk with the SensorLut of the sensor,
+        or are the raw readings if it has none. Readings without a raw
+        value are NaN.
+        '''
+        lut = self.luts.get(number)
+        for times, _, numbers, raws, flags in self.chunks():
+            selected = bytes(map(number.__eq__, numbers))
+            valid = array('B', compress(flags, selected))
+            raws = array('B', compress(raws, selected))
+            if lut is not None:
+                values = lut.convert(raws)
+            else:
+                values = array('d', raws)
+            if valid.count(0) or valid.count(FLAG_STATES):
+                for i, flag in enumerate(valid):
+                    if not flag & FLAG_RAW:
+                        values[i] = math.nan
+            yield array('d', compress(times, selected)), values
+
+    def close(self):
+        self._mm.close()
+
+
+def sensor_value(lut, raw):
+    '''Converted value of a reading, the raw value if there is no lut.'''
+    if lut is not None:
+        return lut.value(raw)
+    return raw
+
+
+def sensor_name(sdr, number):
+    if sdr is None:
+        return f'sensor {number}'
+    return sdr.device_id_string
+
+
+def export_csv(recording, output, names=None):
+    sensors = recording.sensors()
+    writer = csv.writer(output)
+    writer.writerow(('time', 'sensor', 'raw', 'value', 'states'))
+    for timestamp, number, raw, states in recording.readings():
+        sdr = sensors.get(number)
+        name = sensor_name(sdr, number)
+        if names and name not in names:
+            continue
+        value = sensor_value(recording.luts.get(number), raw)
+        writer.writerow((f'{timestamp:.3f}', name,
+                         '' if raw is None else raw,
+                         '' if value is None else f'{value:g}',
+                         '' if states is None else f'0x{states:04x}'))
+
+
+class SensorSummary(object):
+    '''Statistics of the readings of a sensor, from a histogram of raws.'''
+
+    def __init__(self, sdr, lut, number):
+        self.sdr = sdr
+        self.lut = lut
+        self.number = number
+        self.count = 0
+        self.missing = 0
+        self.state_changes = 0
+        self.first = None
+        self.last = None
+        self._states = None
+        self._histogram = [0] * 256
+
+    def add(self, timestamp, raw, states):
+        if self.first is None:
+            self.first = timestamp
+        self.last = timestamp
+        self.count += 1
+        if raw is None:
+            self.missing += 1
+        else:
+            self._histogram[raw] += 1
+        if states is not None:
+            if self._states is not None and states != self._states:
+                self.state_changes += 1
+            self._states = states
+
+    def values(self):
+        '''(value, count) of every raw value read.'''
+        result = []
+        for raw, count in enumerate(self._histogram):
+            if count:
+                value = sensor_value(self.lut, raw)
+                if value is not None:
+                    result.append((value, count))
+        return result
+
+    def alarms(self):
+        '''Number of readings beyond a threshold.'''
+        if self.lut is None:
+            return 0
+        # the thresholds are checked on the raw codes
+        return sum(count for raw, count in enumerate(self._histogram)
+                   if count and self.lut.alarms(raw))
+
+    def line(self):
+        name = sensor_name(self.sdr, self.number)
+        values = self.values()
+        text = f'{name}: {self.count} readings'
+        if values:
+            total = sum(count for _, count in values)
+            mean = sum(value * count for value, count in values) / total
+            text += (f', min={min(v for v, _ in values):g}'
+                     f' max={max(v for v, _ in values):g} mean={mean:g}')
+        alarms = self.alarms()
+        if alarms:
+            text += f', {alarms} in alarm'
+        if self.missing:
+            text += f', {self.missing} without value'
+        text += (f', {self.state_changes} state changes'
+                 f', {self.last - self.first:.1f}s')
+        return text
+
+
+def summarize(recording, names=None):
+    sensors = recording.sensors()
+    summaries = {}
+    for timestamp, number, raw, states in recording.readings():
+        summary = summaries.get(number)
+        if summary is None:
+            summary = summaries[number] = SensorSummary(
+                sensors.get(number), recording.luts.get(number), number)
+        summary.add(timestamp, raw, states)
+    return [summary for number, summary in sorted(summaries.items())
+            if not names or sensor_name(summary.sdr, number) in names]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Export sensor readings recorded by mmctester --record')
+    parser.add_argument('recording', help='Recorded file')
+    parser.add_argument(
+        '--summary', action='store_true',
+        help='Print statistics per sensor instead of the readings as CSV')
+    parser.add_argument(
+        '--sensor', action='append', default=[], metavar='NAME',
+        help='Only export this sensor, can be repeated')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with Recording(args.recording) as recording:
+        if args.summary:
+            for summary in summarize(recording, args.sensor):
+                print(summary.line())
+        else:
+            export_csv(recording, sys.stdout, args.sensor)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+import json
+import math
+import statistics
+import sys
+import time
+
+from xml.etree import ElementTree
+
+STATUS_PASS = 'pass'
+STATUS_FAIL = 'fail'
+STATUS_SKIP = 'skip'
+PERCENTILES = (95, 99)
+
+
+class CheckResult(object):
+    '''Outcome of a check, ok is None if it was skipped.
+
+    A check may be attempted several times, latencies holds the seconds
+    taken by each attempt that succeeded.
+
+    completion_code: of the last failed attempt, 0 if all succeeded, None
+    if the failures were not completion codes
+    retries: requests sent again by the interface, None if it does not
+    count them
+    '''
+
+    def __init__(self, name, ok, detail='', duration=0.0,
+                 completion_code=None, retries=None, attempts=1,
+                 failures=0, latencies=None):
+        self.name = name
+        self.ok = ok
+        self.detail = detail
+        self.duration = duration
+        self.completion_code = completion_code
+        self.retries = retries
+        self.attempts = attempts
+        self.failures = failures
+        self.latencies = latencies or []
+
+    def __repr__(self):
+        return f'CheckResult({self.name}, ok={self.ok})'
+
+    @property
+    def status(self):
+        if self.ok is None:
+            return STATUS_SKIP
+        return STATUS_PASS if self.ok else STATUS_FAIL
+
+    def stats(self):
+        return latency_stats(self.latencies)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'status': self.status,
+            'detail': self.detail,
+            'duration': self.duration,
+            'completion_code': self.completion_code,
+            'retries': self.retries,
+            'attempts': self.attempts,
+            'failures': self.failures,
+            'latency': self.stats(),
+            'latencies': self.latencies,
+        }
+
+
+def percentile(ordered, p):
+    '''Nearest-rank percentile of sorted values.'''
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def latency_stats(latencies):
+    '''min, median, mean, max and PERCENTILES of latencies, None if empty.'''
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+    stats = {
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'max': ordered[-1],
+    }
+    for p in PERCENTILES:
+        stats[f'p{p}'] = percentile(ordered, p)
+    return stats
+
+
+def format_stats(stats):
+    keys = ['min', 'median'] + [f'p{p}' for p in PERCENTILES]
+    return ' '.join(f'{key}={stats[key] * 1000:.1f}ms' for key in keys)
+
+
+class Suite(object):
+    '''The results of the checks of a target.'''
+
+    def __init__(self, name, results, properties=None):
+        self.name = name
+        self.results = results
+        self.properties = properties or {}
+
+    def count(self, status):
+        return sum(1 for r in self.results if r.status == status)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'properties': self.properties,
+            'checks': [r.to_dict() for r in self.results],
+        }
+
+
+def text_output(*paths):
+    '''Stream for the text report of a tool writing results to paths.
+
+    The standard error when a result goes to the standard output (-), so
+    that the results stay a valid document. Exits if more than one does.
+    '''
+    stdout_paths = [path for path in paths if path == '-']
+    if len(stdout_paths) > 1:
+        sys.exit('Only one result can be written to the standard output')
+    return sys.stderr if stdout_paths else sys.stdout
+
+
+def _open_output(path):
+    if path == '-':
+        return sys.stdout
+    return open(path, 'w')
+
+
+def write_json(path, suites):
+    '''Writes the suites as JSON to path, - for the standard output.'''
+    output = _open_output(path)
+    try:
+        json.dump({'created': time.time(),
+                   'suites': [s.to_dict() for s in suites]}, output,
+                  indent=2)
+        output.write('\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def junit_tree(suites):
+    root = ElementTree.Element('testsuites')
+    for suite in suites:
+        element = ElementTree.SubElement(
+            root, 'testsuite', name=suite.name,
+            tests=str(len(suite.results)),
+            failures=str(suite.count(STATUS_FAIL)),
+            skipped=str(suite.count(STATUS_SKIP)),
+            time=f'{sum(r.duration for r in suite.results):.6f}')
+        if suite.properties:
+            properties = ElementTree.SubElement(element, 'properties')
+            for name, value in suite.properties.items():
+                ElementTree.SubElement(properties, 'property', name=name,
+                                       value=str(value))
+        for result in suite.results:
+            case = ElementTree.SubElement(
+                element, 'testcase', classname=suite.name, name=result.name,
+                time=f'{result.duration:.6f}')
+            if result.status == STATUS_FAIL:
+                message = result.detail
+                if result.completion_code:
+                    message += f' (cc=0x{result.completion_code:02x})'
+                ElementTree.SubElement(case, 'failure', message=message)
+            elif result.status == STATUS_SKIP:
+                ElementTree.SubElement(case, 'skipped',
+                                       message=result.detail)
+            stats = result.stats()
+            if stats is not None:
+                out = ElementTree.SubElement(case, 'system-out')
+                out.text = (f'attempts={result.attempts} '
+                            f'failures={result.failures} '
+                            f'retries={result.retries} '
+                            f'{format_stats(stats)}')
+    return ElementTree.ElementTree(root)
+
+
+def write_junit(path, suites):
+    '''Writes the suites as JUnit XML to path, - for the standard output.'''
+    tree = junit_tree(suites)
+    output = _open_output(path)
+    try:
+        tree.write(output, encoding='unicode', xml_declaration=True)
+        output.write('\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import random
+
+# gains of the smoothed round trip time and of its variation, as in TCP
+# (RFC 6298)
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+RTT_K = 4
+# timeout until a request class has been measured
+INITIAL_TIMEOUT = 1.0
+MIN_TIMEOUT = 0.1
+MAX_TIMEOUT = 5.0
+# pause before the first resend, doubled on each further one
+BACKOFF_BASE = 0.02
+MAX_BACKOFF = 1.0
+
+
+class RttEstimator(object):
+    '''Round trip time of a class of requests and the timeout derived.
+
+    The timeout is the smoothed round trip time plus 4 times its mean
+    deviation. Only requests answered at their first attempt are measured,
+    the response to a request sent again could be the one to any of the
+    attempts. Instead, each expired attempt doubles the timeout of the next
+    one and the timeout of the estimator until the next measurement, as in
+    RFC 6298 5.5, and so does a request answered after a retry if it was
+    the only one answered, so a target slower than the timeout gets
+    measured.
+    '''
+
+    def __init__(self, initial=INITIAL_TIMEOUT, min_timeout=MIN_TIMEOUT,
+                 max_timeout=MAX_TIMEOUT):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = initial
+        self.samples = 0
+        self.timeouts = 0
+
+    def __repr__(self):
+        return (f'RttEstimator(srtt={self.srtt}, rttvar={self.rttvar}, '
+                f'timeout={self.timeout})')
+
+    def _clamp(self, timeout):
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    def observe(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += RTT_BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += RTT_ALPHA * (rtt - self.srtt)
+        self.samples += 1
+        self.timeout = self._clamp(self.srtt + RTT_K * self.rttvar)
+
+    def timed_out(self, timeout):
+        '''An attempt waited timeout seconds for its response in vain.
+
+        Returns the timeout of the next attempt, twice as long.
+        '''
+        self.timeouts += 1
+        timeout = self._clamp(timeout * 2)
+        self.timeout = max(self.timeout, timeout)
+        return timeout
+
+    def answered_after_retry(self, samples):
+        '''A request was answered after a retry.
+
+        samples: the samples when the request was first sent, the timeout
+        is not doubled if other requests were answered in time meanwhile,
+        the request was lost rather than slow
+        '''
+        if samples == self.samples:
+            self.timeout = self._clamp(self.timeout * 2)
+
+    def backoff(self, retries):
+        '''Seconds to pause before sending a request again.
+
+        Grows exponentially with the retries of the request, a random part
+        keeps the resends of several requests from lining up.
+        '''
+        limit = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (retries - 1))
+        return random.uniform(limit / 2, limit)
+
+    def snapshot(self):
+        return {'srtt': self.srtt, 'rttvar': self.rttvar,
+                'timeout': self.timeout, 'samples': self.samples,
+                'timeouts': self.timeouts}
+
+
+class RttTable(object):
+    '''A RttEstimator per target and command.
+
+    Commands of a netfn can take very different times, e.g. Get Device SDR
+    reads the EEPROM while Get Sensor Reading does not, so each command
+    has its own estimator. The estimators are created with the limits of
+    the table, which can be changed to tune them.
+    '''
+
+    def __init__(self, initial=INITIAL_TIMEOUT, min_timeout=MIN_TIMEOUT,
+                 max_timeout=MAX_TIMEOUT):
+        self.initial = initial
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.estimators = {}
+
+    def get(self, target, netfn, cmdid):
+        '''The estimator of requests of netfn and cmdid to the target.'''
+        # responses have the request netfn plus one
+        key = (target, netfn & ~1, cmdid)
+        estimator = self.estimators.get(key)
+        if estimator is None:
+            estimator = RttEstimator(self.initial, self.min_timeout,
+                                     self.max_timeout)
+            self.estimators[key] = estimator
+        return estimator
+
+    def snapshot(self):
+        '''Values of each estimator, sorted by target, netfn and cmdid.'''
+        return [dict(target=target, netfn=netfn, cmdid=cmdid,
+                     **estimator.snapshot())
+                for (target, netfn, cmdid), estimator
+                in sorted(self.estimators.items())]
@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+import argparse
+import glob
+import io
+import multiprocessing
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing.connection import wait
+
+import pyipmi
+import serial
+
+from pyipmi.errors import CompletionCodeError, IpmiTimeoutError, RetryError
+from pyipmi.logger import log
+
+from mmctester.cache import SdrCache
+from mmctester.commandstester import (DEFAULT_TARGET, CommandsTester,
+                                      create_target_connection)
+from mmctester.interface import board_ready
+from mmctester.mch import DEFAULT_WINDOW, MchSessionPool
+from mmctester.recorder import SensorSummary
+from mmctester.results import (CheckResult, Suite, text_output, write_json,
+                               write_junit)
+from mmctester.scheduler import PollScheduler
+from mmctester.sensors import (create_sensor_reading_request,
+                               decode_sensor_reading, sensor_luts)
+from mmctester.util import hex_or_int
+
+MODE_CHECK = 'check'
+MODE_MONITOR = 'monitor'
+MODES = (MODE_CHECK, MODE_MONITOR)
+STATUS_PASS = 'pass'
+STATUS_FAIL = 'fail'
+STATUS_ERROR = 'error'
+STATUS_TIMEOUT = 'timeout'
+DISCOVERY_PATTERN = '/dev/ttyACM*'
+# the boards reset when their port is opened, the first pings may be lost
+PING_RETRIES = 3
+PING_TIMEOUT = 1.0
+DEFAULT_DURATION = 60.0
+# seconds given to a board on top of the monitoring duration
+CHECK_TIMEOUT = 120.0
+
+
+class BoardReport(object):
+    '''Outcome of the run on a board, sent back by its worker process.'''
+
+    def __init__(self, port, target, status=STATUS_ERROR, detail=''):
+        self.port = port
+        self.target = target
+        self.status = status
+        self.detail = detail
+        self.results = []
+        self.log = ''
+        self.duration = 0.0
+
+    def __repr__(self):
+        return f'BoardReport({self.port}, 0x{self.target:02x}, {self.status})'
+
+    def count(self, ok):
+        return sum(1 for r in self.results if r.ok is ok)
+
+    def line(self):
+        text = (f'{self.port} 0x{self.target:02x}: {self.status.upper()}'
+                f' {self.count(True)} ok, {self.count(False)} failed')
+        skipped = self.count(None)
+        if skipped:
+            text += f', {skipped} skipped'
+        text += f' in {self.duration:.1f}s'
+        if self.detail:
+            text += f' ({self.detail})'
+        return text
+
+
+def board_spec(text):
+    '''Parses PORT[:TARGET], the port may also be the IP of a MCH.'''
+    port, _, target = text.partition(':')
+    if not port:
+        raise ValueError(f'Invalid board: {text}')
+    return port, hex_or_int(target) if target else DEFAULT_TARGET
+
+
+def _ping(port):
+    try:
+        with serial.Serial(port, timeout=PING_TIMEOUT) as ser:
+            return board_ready(ser, PING_RETRIES)
+    except OSError as e:
+        log().debug('Ignoring %s: %s', port, e)
+        return False
+
+
+def discover_boards(pattern=DISCOVERY_PATTERN):
+    '''Returns the ports matching pattern that answer the ping handshake.
+
+    The ports are pinged in parallel, as every board needs some time to
+    reset.
+    '''
+    ports = sorted(glob.glob(pattern))
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        answered = list(pool.map(_ping, ports))
+    return [port for port, ok in zip(ports, answered) if ok]
+
+
+class SensorMonitor(object):
+    '''Polls the sensors of a target and keeps statistics of the readings.'''
+
+    def __init__(self, interface, target, sdrs):
+        self.interface = interface
+        self.target = target
+        self.scheduler = PollScheduler(sdrs)
+        self.summaries = {}
+        self.errors = {}
+        self.events = 0
+        self.log_lines = []
+        for sdr, lut in zip(sdrs, sensor_luts(sdrs)):
+            if sdr.type in (pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD,
+                            pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD):
+                self.summaries.setdefault(
+                    sdr.number, SensorSummary(sdr, lut, sdr.number))
+                self.errors.setdefault(sdr.number, 0)
+
+    # a reading that fails only fails its sensor, not the batch
+    def read(self, sdrs):
+        reqs = [create_sensor_reading_request(
+            self.target, s.number, getattr(s, 'owner_lun', 0)) for s in sdrs]
+        readings = []
+        for sdr, rsp in zip(sdrs, self.interface.send_and_receive_many(reqs)):
+            try:
+                readings.append(decode_sensor_reading(rsp))
+            except CompletionCodeError as e:
+                self.errors[sdr.number] += 1
+                self.log_lines.append(f'{sdr.device_id_string}: {e}')
+                readings.append((None, None))
+        return readings
+
+    def poll(self):
+        try:
+            batch = self.scheduler.poll(self.read)
+        except (IpmiTimeoutError, RetryError):
+            batch = self.scheduler.next_batch()
+            for schedule in batch:
+                self.errors[schedule.sdr.number] += 1
+            self.log_lines.append(f'Timeout reading {len(batch)} sensors')
+            return
+        now = time.time()
+        for schedule in batch:
+            self.summaries[schedule.sdr.number].add(now, schedule.raw,
+                                                    schedule.states)
+
+    def run(self, duration):
+        deadline = time.monotonic() + duration
+        while True:
+            self.poll()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time_to_next = self.scheduler.time_to_next()
+            if time_to_next is None:
+                time_to_next = remaining
+            timeout = min(time_to_next, remaining)
+            # the MCH does not forward the events of its targets
+            if not hasattr(self.interface, 'receive_and_ack_event'):
+                time.sleep(timeout)
+                continue
+            event = self.interface.receive_and_ack_event(timeout=timeout)
+            if event is not None:
+                self.events += 1
+                self.log_lines.append(f'Event: {event}')
+
+    def results(self):
+        '''A CheckResult per sensor, failed if a reading failed or alarmed.'''
+        results = []
+        for number, summary in sorted(self.summaries.items()):
+            errors = self.errors[number]
+            detail = summary.line()
+            if errors:
+                detail += f', {errors} errors'
+            results.append(CheckResult(
+                summary.sdr.device_id_string,
+                summary.count > 0 and not errors and not summary.alarms(),
+                detail))
+        return results
+
+
+def check_board(port, target, sdr_cache=True, interface=None, repeat=1):
+    '''Runs the CommandsTester checks, returns the results and the output.'''
+    output = io.StringIO()
+    tester = CommandsTester(port, target, sdr_cache, output=output,
+                            interface=interface, repeat=repeat)
+    try:
+        return tester.run(), output.getvalue()
+    finally:
+        tester.close()
+
+
+def monitor_board(port, target, duration, sdr_cache=True, interface=None):
+    '''Polls the sensors for duration seconds, returns results and log.'''
+    ipmi = create_target_connection(port, target, interface)
+    try:
+        if sdr_cache:
+            sdrs = SdrCache().device_sdr_entries(ipmi)
+        else:
+            sdrs = list(ipmi.device_sdr_entries())
+        monitor = SensorMonitor(ipmi.interface, ipmi.target, sdrs)
+        monitor.run(duration)
+        lines = [r.detail for r in monitor.results()]
+        lines.append(f'{monitor.events} events')
+        lines.extend(monitor.log_lines)
+        return monitor.results(), '\n'.join(lines) + '\n'
+    finally:
+        if interface is None:
+            ipmi.interface.close_session()
+
+
+def run_board(port, target, mode, duration, sdr_cache, repeat=1,
+              interface=None):
+    report = BoardReport(port, target)
+    started = time.monotonic()
+    try:
+        if mode == MODE_MONITOR:
+            report.results, report.log = monitor_board(
+                port, target, duration, sdr_cache, interface)
+        else:
+            report.results, report.log = check_board(
+                port, target, sdr_cache, interface, repeat)
+        report.status = STATUS_FAIL if report.count(False) else STATUS_PASS
+    except Exception as e:
+        report.detail = str(e) or type(e).__name__
+    report.duration = time.monotonic() - started
+    return report
+
+
+def is_serial(port):
+    return port.startswith('/dev/')
+
+
+# a worker runs a board, or all the targets of a MCH, each in a thread and
+# sharing a pool of sessions
+def _worker(conn, boards, mode, duration, sdr_cache, repeat, window):
+    host = boards[0][0]
+    if is_serial(host):
+        conn.send(run_board(host, boards[0][1], mode, duration, sdr_cache,
+                            repeat))
+        conn.close()
+        return
+    pool = MchSessionPool(host, window)
+    try:
+        with ThreadPoolExecutor(max_workers=len(boards)) as executor:
+            futures = [executor.submit(run_board, port, target, mode,
+                                       duration, sdr_cache, repeat, pool)
+                       for port, target in boards]
+            for future in as_completed(futures):
+                conn.send(future.result())
+    finally:
+        pool.close()
+        conn.close()
+
+
+def worker_groups(boards):
+    '''Splits boards in the lists run by each worker process.
+
+    Every serial port gets a worker, the targets of a MCH share one.
+    '''
+    groups = []
+    hosts = {}
+    for port, target in boards:
+        if is_serial(port):
+            groups.append([(port, target)])
+        elif port in hosts:
+            hosts[port].append((port, target))
+        else:
+            hosts[port] = [(port, target)]
+            groups.append(hosts[port])
+    return groups
+
+
+def run_boards(boards, mode=MODE_CHECK, duration=DEFAULT_DURATION,
+               timeout=None, sdr_cache=True, repeat=1,
+               window=DEFAULT_WINDOW):
+    '''Runs mode on every board at once, yields the reports as they finish.
+
+    Each board gets a worker process of its own, and the targets of a MCH
+    one for all of them where they are run in parallel with up to window
+    requests in flight, so a slow or hung board only delays its own
+    report. The boards still running after timeout seconds are stopped
+    and reported as timed out.
+
+    boards: list of (port, target), port being a serial port or a MCH IP
+    '''
+    if timeout is None:
+        timeout = CHECK_TIMEOUT
+        if mode == MODE_MONITOR:
+            timeout += duration
+    # receiver -> (process, boards without a report yet)
+    workers = {}
+    try:
+        for group in worker_groups(boards):
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_worker, daemon=True,
+                args=(sender, group, mode, duration, sdr_cache, repeat,
+                      window))
+            process.start()
+            sender.close()
+            workers[receiver] = (process, list(group))
+
+        deadline = time.monotonic() + timeout
+        while workers:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for receiver in wait(list(workers), remaining):
+                process, pending = workers[receiver]
+                try:
+                    report = receiver.recv()
+                except EOFError:
+                    del workers[receiver]
+                    receiver.close()
+                    process.join()
+                    for port, target in pending:
+                        yield BoardReport(
+                            port, target, detail=f'Worker exited with code '
+                                                 f'{process.exitcode}')
+                    continue
+                pending.remove((report.port, report.target))
+                if not pending:
+                    del workers[receiver]
+                    receiver.close()
+                    process.join()
+                yield report
+
+        for receiver, (process, pending) in list(workers.items()):
+            del workers[receiver]
+            process.terminate()
+            process.join()
+            receiver.close()
+            for port, target in pending:
+                report = BoardReport(port, target, STATUS_TIMEOUT,
+                                     f'No result after {timeout:g}s')
+                report.duration = timeout
+                yield report
+    finally:
+        for receiver, (process, _) in workers.items():
+            process.terminate()
+            process.join()
+            receiver.close()
+
+
+def print_report(report, output=sys.stdout):
+    print(f'== {report.line()}', file=output)
+    if report.log:
+        print(report.log, end='', file=output)
+    if report.results and report.status != STATUS_PASS:
+        for result in report.results:
+            if result.ok is False:
+                print(f'FAILED {result.name}: {result.detail}', file=output)
+    print(file=output, flush=True)
+
+
+def report_suite(report):
+    '''Suite of a BoardReport, failing if the board could not be run.'''
+    results = list(report.results)
+    if report.status in (STATUS_ERROR, STATUS_TIMEOUT):
+        results.append(CheckResult('Run', False, report.detail,
+                                   report.duration))
+    return Suite(f'{report.port} 0x{report.target:02x}', results,
+                 {'port': report.port, 'target': f'0x{report.target:02x}',
+                  'status': report.status})
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run the commands tester or monitor the sensors of '
+                    'several boards at once')
+    parser.add_argument(
+        '--board', type=board_spec, action='append', default=[],
+        metavar='PORT[:TARGET]',
+        help=f'Serial port or MCH IP and IPMB address of the target, '
+             f'0x{DEFAULT_TARGET:02x} by default, can be repeated')
+    parser.add_argument(
+        '--discover', nargs='?', const=DISCOVERY_PATTERN, metavar='PATTERN',
+        help=f'Add the boards answering on the ports matching PATTERN, '
+             f'{DISCOVERY_PATTERN} by default')
+    parser.add_argument(
+        '--target', type=hex_or_int, default=DEFAULT_TARGET,
+        help='IPMB address of the targets of the discovered boards')
+    parser.add_argument(
+        '--mode', choices=MODES, default=MODE_CHECK,
+        help='Check the IPMI commands or monitor the sensors')
+    parser.add_argument(
+        '--duration', type=float, default=DEFAULT_DURATION,
+        help='Seconds to monitor the sensors for')
+    parser.add_argument(
+        '--timeout', type=float,
+        help='Seconds after which a board that did not finish is stopped')
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='Run every command REPEAT times, see mmccommandstester')
+    parser.add_argument(
+        '--json', metavar='FILE',
+        help='Write the results as JSON to FILE, - for standard output')
+    parser.add_argument(
+        '--junit', metavar='FILE',
+        help='Write the results as JUnit XML to FILE, - for standard output')
+    parser.add_argument(
+        '--mch-window', type=int, default=DEFAULT_WINDOW,
+        help='Maximum number of requests in flight to each MCH, which is '
+             'also the number of sessions opened to it')
+    parser.add_argument(
+        '--no-sdr-cache', dest='sdr_cache', action='store_false',
+        help="Read the SDRs from the device even if they are cached")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    boards = list(args.board)
+    if args.discover:
+        known = {port for port, _ in boards}
+        boards.extend((port, args.target)
+                      for port in discover_boards(args.discover)
+                      if port not in known)
+    if not boards:
+        sys.exit('No boards to run')
+
+    output = text_output(args.json, args.junit)
+    reports = []
+    for report in run_boards(boards, args.mode, args.duration, args.timeout,
+                             args.sdr_cache, max(1, args.repeat),
+                             args.mch_window):
+        print_report(report, output)
+        reports.append(report)
+
+    print('Summary:', file=output)
+    reports.sort(key=lambda r: (r.port, r.target))
+    for report in reports:
+        print(report.line(), file=output)
+    suites = [report_suite(r) for r in reports]
+    if args.json:
+        write_json(args.json, suites)
+    if args.junit:
+        write_junit(args.junit, suites)
+    if any(r.status != STATUS_PASS for r in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
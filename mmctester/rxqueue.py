@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+from collections import OrderedDict, deque
+
+from pyipmi.interfaces.ipmb import checksum
+from pyipmi.msgs import constants
+
+from mmctester.capture import CAPTURE_BLOCK
+from mmctester.scan import SCAN_RESULT
+
+LOCAL_ADDR = 0x0
+IPMB_MIN_MSG_LEN = 7
+
+KIND_RESPONSE = 'response'
+KIND_EVENT = 'event'
+KIND_LOCAL = 'local'
+KIND_SCAN = 'scan'
+KIND_CAPTURE = 'capture'
+KIND_OTHER = 'other'
+# least valuable frames are evicted first when the queue is full
+EVICTION_ORDER = (KIND_OTHER, KIND_SCAN, KIND_CAPTURE, KIND_RESPONSE,
+                  KIND_LOCAL, KIND_EVENT)
+
+
+def response_key(data):
+    '''(rs_sa, netfn, cmdid, rq_seq) of a response message.'''
+    return (data[3], data[1] >> 2, data[5], data[4] >> 2)
+
+
+class ReceiveQueue(object):
+    '''Received frames waiting for a consumer.
+
+    Frames are sorted on arrival into buckets: responses indexed by
+    (rs_sa, netfn, cmdid, rq_seq), Platform Event requests, local command
+    replies, sensor scan results, capture blocks and anything else. Pushing
+    and popping take constant time.
+    The queue holds at most max_size frames, when it is full the oldest
+    frame of the least valuable bucket is evicted and counted.
+    '''
+
+    def __init__(self, address, max_size=256):
+        self.address = address
+        self.max_size = max_size
+        self.responses = OrderedDict()
+        self.events = deque()
+        self.local = deque()
+        self.scans = deque()
+        self.captures = deque()
+        self.other = deque()
+        self._buckets = {KIND_EVENT: self.events, KIND_LOCAL: self.local,
+                         KIND_SCAN: self.scans, KIND_CAPTURE: self.captures,
+                         KIND_OTHER: self.other}
+        self.received = dict.fromkeys(EVICTION_ORDER, 0)
+        self.evicted = dict.fromkeys(EVICTION_ORDER, 0)
+        self.invalid = 0
+        self.overflows = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return (f'ReceiveQueue(responses={len(self.responses)}, '
+                f'events={len(self.events)}, local={len(self.local)}, '
+                f'scans={len(self.scans)}, captures={len(self.captures)}, '
+                f'other={len(self.other)}, overflows={self.overflows})')
+
+    def classify(self, data):
+        '''Returns the kind of a frame and, for responses, its key.'''
+        if len(data) and data[0] == LOCAL_ADDR:
+            if len(data) > 1 and data[1] == SCAN_RESULT:
+                return KIND_SCAN, None
+            if len(data) > 1 and data[1] == CAPTURE_BLOCK:
+                return KIND_CAPTURE, None
+            return KIND_LOCAL, None
+        if len(data) < IPMB_MIN_MSG_LEN or data[0] != self.address:
+            return KIND_OTHER, None
+        if checksum(data[0:3]) or checksum(data[3:]):
+            self.invalid += 1
+            return KIND_OTHER, None
+        if (data[1] >> 2) & 1:
+            return KIND_RESPONSE, response_key(data)
+        if data[5] == constants.CMDID_PLATFORM_EVENT:
+            return KIND_EVENT, None
+        return KIND_OTHER, None
+
+    def _evict(self):
+        self.overflows += 1
+        for kind in EVICTION_ORDER:
+            if kind == KIND_RESPONSE:
+                if self.responses:
+                    self.responses.popitem(last=False)
+                    break
+            else:
+                bucket = self._buckets[kind]
+                if bucket:
+                    bucket.popleft()
+                    break
+        self.evicted[kind] += 1
+        self._size -= 1
+
+    def push(self, data):
+        '''Store a frame, returns its kind and its response key.'''
+        kind, key = self.classify(data)
+        self.received[kind] += 1
+        if kind == KIND_RESPONSE and key in self.responses:
+            # a duplicate, e.g. of a retried request, replaces the stale
+            # response
+            self.pop_response(key)
+        if self._size >= self.max_size:
+            self._evict()
+        if kind == KIND_RESPONSE:
+            self.responses[key] = data
+        else:
+            self._buckets[kind].append(data)
+        self._size += 1
+        return kind, key
+
+    def pop_response(self, key):
+        data = self.responses.pop(key, None)
+        if data is not None:
+            self._size -= 1
+        return data
+
+    def _pop(self, bucket):
+        if bucket:
+            self._size -= 1
+            return bucket.popleft()
+        return None
+
+    def pop_event(self):
+        return self._pop(self.events)
+
+    def pop_local(self):
+        return self._pop(self.local)
+
+    def pop_scan(self):
+        return self._pop(self.scans)
+
+    def pop_capture(self):
+        return self._pop(self.captures)
+
+    def pop_unprocessed(self):
+        '''Removes and returns unknown frames and unclaimed responses.'''
+        result = list(self.other)
+        result.extend(self.responses.values())
+        self._size -= len(result)
+        self.other.clear()
+        self.responses.clear()
+        return result
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import pyipmi
+
+from pyipmi.interfaces.ipmb import checksum
+from pyipmi.msgs import constants
+
+# mirrors mmctester-board/commands.h
+SCAN_RESULT = 0x90
+MAX_SCAN_ENTRIES = 9
+SCAN_RQ_LUN = 0x02
+SCAN_RESULT_SIZE = 11
+MAX_SCAN_PERIOD = 0xffff / 1000
+
+SENSOR_RECORD_TYPES = (pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD,
+                       pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD)
+
+
+def sdr_scan_entries(address, sdrs):
+    '''(target, sensor number, lun) of the sensor records of a target.'''
+    return [(address, sdr.number, sdr.owner_lun) for sdr in sdrs
+            if sdr.type in SENSOR_RECORD_TYPES]
+
+
+def scan_command_args(entries, period):
+    '''Arguments of the set scan command.
+
+    entries: (target address, sensor number, lun) of the sensors to read
+    period: seconds between the start of two sweeps over the entries
+    '''
+    if len(entries) > MAX_SCAN_ENTRIES:
+        raise ValueError(f'At most {MAX_SCAN_ENTRIES} sensors can be scanned')
+    if not 0 <= period <= MAX_SCAN_PERIOD:
+        raise ValueError(f'Invalid scan period: {period}')
+    period_ms = round(period * 1000)
+    args = [period_ms & 0xff, period_ms >> 8]
+    for target, sensor, lun in entries:
+        args.extend((target, sensor, lun & 0x03))
+    return args
+
+
+class ScanResult(object):
+    '''A Get Sensor Reading done by the board on its own.
+
+    raw and states are as returned by decode_sensor_reading, timestamp is
+    the board time of the reading in milliseconds, it wraps around.
+    '''
+
+    def __init__(self, index, entry, completion_code, raw, states,
+                 timestamp):
+        self.index = index
+        self.entry = entry
+        self.completion_code = completion_code
+        self.raw = raw
+        self.states = states
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return (f'ScanResult(entry={self.entry}, '
+                f'cc=0x{self.completion_code:02x}, raw={self.raw}, '
+                f'states={self.states}, timestamp={self.timestamp})')
+
+
+def decode_scan_result(data, entries):
+    '''Decodes a result frame, entries are the ones given to the scan.'''
+    index = data[2]
+    entry = entries[index] if index < len(entries) else None
+    raw, config, states1, states2 = data[4:8]
+    states = states1 | (states2 << 8)
+    if data[3] != constants.CC_OK:
+        raw = states = None
+    elif config & 0x20:
+        # initial update in progress
+        raw = None
+    timestamp = int.from_bytes(data[8:12], 'little')
+    return ScanResult(index, entry, data[3], raw, states, timestamp)
+
+
+# the functions below mirror mmctester-board/commands.cpp for the emulator
+def scan_request(entry, index, rq_sa):
+    target, sensor, lun = entry
+    header = bytes((target, (constants.NETFN_SENSOR_EVENT << 2) | lun))
+    body = bytes((rq_sa, (index << 2) | SCAN_RQ_LUN,
+                  constants.CMDID_GET_SENSOR_READING, sensor))
+    return header + bytes((checksum(header),)) + body + \
+        bytes((checksum(body),))
+
+
+def is_scan_response(msg):
+    return len(msg) >= 8 and \
+        msg[1] == ((constants.NETFN_SENSOR_EVENT | 1) << 2) | SCAN_RQ_LUN \
+        and msg[5] == constants.CMDID_GET_SENSOR_READING
+
+
+def scan_result(msg, entries, timestamp):
+    '''Result of a scan response, None if it is not for the entries.'''
+    index = msg[4] >> 2
+    if index >= len(entries) or msg[3] != entries[index][0] or \
+            checksum(msg[0:3]) or checksum(msg[3:]):
+        return None
+    values = bytes(msg[7:-1][:4]).ljust(4, b'\x00')
+    return bytes((SCAN_RESULT, index, msg[6])) + values + \
+        (timestamp & 0xffffffff).to_bytes(4, 'little')
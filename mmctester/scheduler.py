@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+import time
+
+import pyipmi
+
+from pyipmi.sensor import (SENSOR_TYPE_CURRENT, SENSOR_TYPE_FAN,
+                           SENSOR_TYPE_FRU_HOT_SWAP,
+                           SENSOR_TYPE_MODULE_HOT_SWAP,
+                           SENSOR_TYPE_TEMPERATURE, SENSOR_TYPE_VOLTAGE)
+
+SENSOR_RECORD_TYPES = (pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD,
+                       pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD)
+
+# seconds between two readings of a sensor, by sensor type, before it is
+# adapted to how fast the readings change
+DEFAULT_INTERVAL = 1.0
+TYPE_INTERVALS = {
+    SENSOR_TYPE_VOLTAGE: 0.5,
+    SENSOR_TYPE_CURRENT: 0.5,
+    SENSOR_TYPE_FAN: 1.0,
+    SENSOR_TYPE_TEMPERATURE: 2.0,
+    # hot swap changes are also reported by events
+    SENSOR_TYPE_MODULE_HOT_SWAP: 5.0,
+    SENSOR_TYPE_FRU_HOT_SWAP: 5.0,
+}
+# the interval adapts within these factors of the type interval
+MIN_INTERVAL_FACTOR = 0.25
+MAX_INTERVAL_FACTOR = 4.0
+SPEED_UP = 0.5
+SLOW_DOWN = 1.5
+# seconds of reading time a poll may use
+DEFAULT_BUDGET = 0.1
+# first guess of the seconds taken by one reading of a batch
+INITIAL_READ_COST = 0.01
+
+
+def interval_override(text):
+    '''Parses NAME=SECONDS, the poll interval of a sensor.'''
+    name, _, seconds = text.rpartition('=')
+    if not name or float(seconds) <= 0:
+        raise ValueError(f'Invalid poll interval: {text}')
+    return name, float(seconds)
+
+
+class SensorSchedule(object):
+    '''When a sensor is read next and what it read last.'''
+
+    def __init__(self, sdr, interval, fixed=False):
+        self.sdr = sdr
+        self.base_interval = interval
+        self.interval = interval
+        self.fixed = fixed
+        self.next_time = 0.0
+        self.last_time = None
+        self.raw = None
+        self.states = None
+
+    def __repr__(self):
+        return (f'SensorSchedule({self.sdr.device_id_string}, '
+                f'interval={self.interval:.2f})')
+
+    def lateness(self, now):
+        '''Intervals elapsed since the reading was due.'''
+        return (now - self.next_time) / self.interval
+
+    def age(self, now):
+        if self.last_time is None:
+            return None
+        return now - self.last_time
+
+    def update(self, raw, states, now):
+        if not self.fixed and self.last_time is not None:
+            if raw != self.raw or states != self.states:
+                self.interval *= SPEED_UP
+            else:
+                self.interval *= SLOW_DOWN
+            self.interval = min(
+                max(self.interval, self.base_interval * MIN_INTERVAL_FACTOR),
+                self.base_interval * MAX_INTERVAL_FACTOR)
+        self.raw = raw
+        self.states = states
+        self.last_time = now
+        self.next_time = now + self.interval
+
+
+def sensor_interval(sdr):
+    return TYPE_INTERVALS.get(getattr(sdr, 'sensor_type_code', None),
+                              DEFAULT_INTERVAL)
+
+
+class PollScheduler(object):
+    '''Chooses which sensors to read on every iteration of a polling loop.
+
+    Every sensor has its own interval, given by its sensor type or by an
+    override per sensor name. Readings that change shorten the interval,
+    readings that stay the same lengthen it. The sensors that are due are
+    read most late first, as many as fit in the time budget according to
+    the measured cost of a reading; the others wait for the next poll.
+
+    sdrs: SDR records, the ones that are not sensors are never read
+    budget: seconds of reading time per poll, at least one sensor is read
+    overrides: fixed interval by sensor name
+    '''
+
+    def __init__(self, sdrs, budget=DEFAULT_BUDGET, overrides=None,
+                 clock=time.monotonic):
+        overrides = overrides or {}
+        self.budget = budget
+        self.clock = clock
+        self.read_cost = INITIAL_READ_COST
+        self.schedules = {}
+        for i, sdr in enumerate(sdrs):
+            if sdr.type not in SENSOR_RECORD_TYPES:
+                continue
+            if sdr.device_id_string in overrides:
+                self.schedules[i] = SensorSchedule(
+                    sdr, overrides[sdr.device_id_string], fixed=True)
+            else:
+                self.schedules[i] = SensorSchedule(sdr, sensor_interval(sdr))
+        self._count = len(sdrs)
+
+    def next_batch(self, now=None):
+        '''Returns the schedules to read now, most urgent first.'''
+        if now is None:
+            now = self.clock()
+        due = [s for s in self.schedules.values() if s.next_time <= now]
+        due.sort(key=lambda s: s.lateness(now), reverse=True)
+        return due[:max(1, int(self.budget / self.read_cost))]
+
+    def update(self, batch, readings, started, now=None):
+        '''Stores the readings of a batch read from started until now.'''
+        if now is None:
+            now = self.clock()
+        if batch:
+            # moving average of the time per reading, batches are pipelined
+            self.read_cost += ((now - started) / len(batch) -
+                               self.read_cost) / 4
+        for schedule, (raw, states) in zip(batch, readings):
+            schedule.update(raw, states, now)
+
+    def poll(self, read):
+        '''Reads the sensors that are due.
+
+        read: returns the (raw, states) readings of a list of SDRs
+        '''
+        started = self.clock()
+        batch = self.next_batch(started)
+        if batch:
+            readings = read([s.sdr for s in batch])
+            self.update(batch, readings, started)
+        return batch
+
+    def expire(self, sensor_type):
+        '''Makes the sensors of a type due, e.g. after one of their events.'''
+        for schedule in self.schedules.values():
+            if getattr(schedule.sdr, 'sensor_type_code', None) == sensor_type:
+                schedule.next_time = 0.0
+
+    def time_to_next(self, now=None):
+        '''Seconds until a sensor is due, None if there are no sensors.'''
+        if not self.schedules:
+            return None
+        if now is None:
+            now = self.clock()
+        return max(0.0, min(s.next_time for s in self.schedules.values()) -
+                   now)
+
+    def readings(self, now=None):
+        '''Returns (raw, states, age) of every SDR record, in order.
+
+        The age is in seconds, None if the sensor was never read.
+        '''
+        if now is None:
+            now = self.clock()
+        result = []
+        for i in range(self._count):
+            schedule = self.schedules.get(i)
+            if schedule is None:
+                result.append((None, None, None))
+            else:
+                result.append((schedule.raw, schedule.states,
+                               schedule.age(now)))
+        return result
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+import math
+
+from array import array
+
+import pyipmi
+
+from pyipmi.errors import DecodingError
+from pyipmi.msgs import create_request_by_name
+from pyipmi.utils import check_completion_code
+
+# bit of each threshold in the readable threshold mask of a full sensor
+# record, the same bits are used by SensorLut.alarms
+THRESHOLD_BITS = (('lnc', 0), ('lcr', 1), ('lnr', 2), ('unc', 3),
+                  ('ucr', 4), ('unr', 5))
+UPPER_THRESHOLDS = ('unc', 'ucr', 'unr')
+# event/reading type code of the sensors with thresholds, the others are
+# discrete
+EVENT_READING_TYPE_THRESHOLD = 0x01
+
+
+def create_sensor_reading_request(target, number, lun=0):
+    req = create_request_by_name('GetSensorReading')
+    req.target = target
+    req.sensor_number = number
+    req.lun = lun
+    return req
+
+
+# same result as pyipmi get_sensor_reading: (raw, states)
+def decode_sensor_reading(rsp):
+    check_completion_code(rsp.completion_code)
+    reading = rsp.sensor_reading
+    if rsp.config.initial_update_in_progress:
+        reading = None
+
+    states = None
+    if rsp.states1 is not None:
+        states = rsp.states1
+        if rsp.states2 is not None:
+            states |= (rsp.states2 << 8)
+    return (reading, states)
+
+
+class SensorLut(object):
+    '''Converted value and threshold alarms of every raw reading of a
+    full sensor record.
+
+    Readings are one byte, so the M/B/exponent/linearization formula and the
+    threshold comparisons are done once for the 256 raw codes, when the SDR
+    is loaded. Converting or checking a reading is then a table lookup.
+    Discrete sensors have no thresholds, their readings raise no alarms.
+    '''
+
+    def __init__(self, sdr):
+        self.sdr = sdr
+        self.values = [self._convert(raw) for raw in range(256)]
+        self._doubles = array('d', (math.nan if value is None else value
+                                    for value in self.values))
+        self.thresholds = {}
+        if sdr.event_reading_type_code == EVENT_READING_TYPE_THRESHOLD:
+            # the readable threshold mask of a threshold sensor
+            readable = sdr.discrete_reading_mask
+            for name, bit in THRESHOLD_BITS:
+                if readable & (1 << bit):
+                    self.thresholds[name] = self._convert(
+                        sdr.threshold[name])
+        self.alarm_masks = array('B', (self._alarms(value)
+                                       for value in self.values))
+
+    def _convert(self, raw):
+        try:
+            return self.sdr.convert_sensor_raw_to_value(raw)
+        except (ArithmeticError, ValueError, DecodingError):
+            return None
+
+    def _alarms(self, value):
+        mask = 0
+        if value is None:
+            return mask
+        for name, bit in THRESHOLD_BITS:
+            threshold = self.thresholds.get(name)
+            if threshold is None:
+                continue
+            if name in UPPER_THRESHOLDS:
+                crossed = value >= threshold
+            else:
+                crossed = value <= threshold
+            if crossed:
+                mask |= 1 << bit
+        return mask
+
+    def value(self, raw):
+        if raw is None:
+            return None
+        return self.values[raw]
+
+    def alarms(self, raw):
+        '''Mask of the thresholds crossed by a reading, see THRESHOLD_BITS.'''
+        if raw is None:
+            return 0
+        return self.alarm_masks[raw]
+
+    def convert(self, raws):
+        '''Values of a sequence of raw readings, as an array of doubles.
+
+        Readings without a value, e.g. out of the linearization domain, are
+        NaN.
+        '''
+        return array('d', map(self._doubles.__getitem__, raws))
+
+
+def alarm_names(mask):
+    return [name for name, bit in THRESHOLD_BITS if mask & (1 << bit)]
+
+
+def sensor_luts(sdrs):
+    '''SensorLut of each SDR, None for the records without conversion.'''
+    return [SensorLut(s) if s.type is pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD
+            else None for s in sdrs]
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+import argparse
+import statistics
+import sys
+import time
+
+import pyipmi
+
+from pyipmi.errors import CompletionCodeError, IpmiTimeoutError, RetryError
+from pyipmi.logger import log
+from pyipmi.sensor import SENSOR_TYPE_MODULE_HOT_SWAP, SENSOR_TYPE_TEMPERATURE
+
+from mmctester.arduino import HIGH, LOW, OUTPUT
+from mmctester.cache import SdrCache
+from mmctester.interface import MMCTesterBoard
+from mmctester.led import set_led_long, set_led_off, set_led_short
+from mmctester.metrics import Histogram
+from mmctester.results import (CheckResult, Suite, format_stats,
+                               latency_stats, text_output, write_json,
+                               write_junit)
+from mmctester.sensors import (create_sensor_reading_request,
+                               decode_sensor_reading)
+from mmctester.util import hex_or_int
+
+DEFAULT_TARGET = 0xa2
+DEFAULT_CYCLES = 1000
+DEFAULT_EVENT_TIMEOUT = 5.0
+DEFAULT_SENSOR_TIMEOUT = 5.0
+# seconds given to the MMC after each half cycle
+DEFAULT_SETTLE = 0.2
+# a latency this many times the median of its stage is an outlier, once
+# the stage has OUTLIER_MIN_SAMPLES
+DEFAULT_OUTLIER_FACTOR = 3.0
+OUTLIER_MIN_SAMPLES = 10
+PROGRESS_EVERY = 100
+HANDLE_CLOSED = 0
+HANDLE_OPEN = 1
+ACTIVATION = 'activation'
+DEACTIVATION = 'deactivation'
+# handle pin level, hot-swap event offset, LED setting and payload pin
+# level of each half cycle
+DIRECTIONS = {
+    ACTIVATION: (HIGH, HANDLE_CLOSED, set_led_long, HIGH),
+    DEACTIVATION: (LOW, HANDLE_OPEN, set_led_short, LOW),
+}
+STAGE_EVENT = 'handle to event'
+STAGE_LED = 'event to LED'
+STAGE_SENSOR = 'PG to sensor'
+STAGES = (STAGE_EVENT, STAGE_LED, STAGE_SENSOR)
+# failures of a request that end its stage rather than the soak
+IPMI_ERRORS = (CompletionCodeError, IpmiTimeoutError, RetryError)
+
+
+class StageStats(object):
+    '''Latencies of a stage of the soak and the cycles that missed it.'''
+
+    def __init__(self, name, outlier_factor=DEFAULT_OUTLIER_FACTOR):
+        self.name = name
+        self.outlier_factor = outlier_factor
+        self.histogram = Histogram()
+        self.latencies = []
+        self.missed = 0
+        self.outliers = 0
+
+    def observe(self, cycle, latency):
+        if len(self.latencies) >= OUTLIER_MIN_SAMPLES and \
+                latency > self.outlier_factor * \
+                statistics.median(self.latencies):
+            self.outliers += 1
+            log().warning('Cycle %d: %s outlier %.1fms', cycle, self.name,
+                          latency * 1000)
+        self.histogram.observe(latency)
+        self.latencies.append(latency)
+
+    def miss(self, cycle):
+        self.missed += 1
+        log().warning('Cycle %d: %s missed', cycle, self.name)
+
+    def lines(self):
+        '''Summary line followed by the non-empty histogram buckets.'''
+        text = f'{self.name}: {len(self.latencies)} ok, {self.missed} missed'
+        stats = latency_stats(self.latencies)
+        if stats is not None:
+            text += (f', {format_stats(stats)} max={stats["max"] * 1000:.1f}'
+                     f'ms, {self.outliers} outliers')
+        lines = [text]
+        bounds = list(self.histogram.buckets) + [float('inf')]
+        for bound, count in zip(bounds, self.histogram.counts):
+            if count:
+                label = f'{bound * 1000:g}ms' if bound != float('inf') \
+                    else 'inf'
+                lines.append(f'  <= {label}: {count}')
+        return lines
+
+    def result(self, cycles):
+        return CheckResult(self.name, self.missed == 0,
+                           f'{self.missed} missed' if self.missed else '',
+                           self.histogram.sum, attempts=cycles,
+                           failures=self.missed, latencies=self.latencies)
+
+
+class HotSwapSoak(object):
+    '''Moves the hot-swap handle through pin_hs for many cycles.
+
+    Each half cycle changes the handle and measures the time from the pin
+    edge to the hot-swap Platform Event of the MMC, from the event to the
+    MMC answering the Set FRU LED State of the new state, and from setting
+    pin_pg to the next reading of a watched sensor that differs from the
+    one before. The pin times are taken when the board acknowledges the
+    write, so they are late by at most a local command round trip. A stage
+    whose event, answer or sensor change does not come, e.g. because its
+    request failed after the retries, is missed.
+
+    pg_sensors: names of the sensors watched after pin_pg changes, by
+    default all of them but the temperatures, which drift on their own
+    '''
+
+    def __init__(self, port, target, pin_hs, pin_pg=None, sdr_cache=True,
+                 pg_sensors=None, event_timeout=DEFAULT_EVENT_TIMEOUT,
+                 sensor_timeout=DEFAULT_SENSOR_TIMEOUT,
+                 settle=DEFAULT_SETTLE,
+                 outlier_factor=DEFAULT_OUTLIER_FACTOR):
+        self.interface = MMCTesterBoard(port=port)
+        self.ipmi = pyipmi.create_connection(self.interface)
+        self.ipmi.target = pyipmi.Target(target)
+        self.arduino = self.interface.arduino
+        self.pin_hs = pin_hs
+        self.pin_pg = pin_pg
+        self.event_timeout = event_timeout
+        self.sensor_timeout = sensor_timeout
+        self.settle = settle
+        self.sdr_cache = SdrCache() if sdr_cache else None
+        self.stats = {(direction, stage): StageStats(
+            f'{direction} {stage}', outlier_factor)
+            for direction in DIRECTIONS for stage in STAGES
+            if stage != STAGE_SENSOR or pin_pg is not None}
+        self.other_events = 0
+        self.errors = 0
+        self.cycles = 0
+        self.duration = 0.0
+        self._sensor_reqs = []
+        if pin_pg is not None:
+            try:
+                self._sensor_reqs = self.sensor_requests(pg_sensors)
+            except Exception:
+                self.close()
+                raise
+
+    def sensor_requests(self, names=None):
+        if self.sdr_cache is None:
+            sdrs = list(self.ipmi.device_sdr_entries())
+        else:
+            sdrs = self.sdr_cache.device_sdr_entries(self.ipmi)
+        sdrs = [s for s in sdrs
+                if s.type in (pyipmi.sdr.SDR_TYPE_FULL_SENSOR_RECORD,
+                              pyipmi.sdr.SDR_TYPE_COMPACT_SENSOR_RECORD)]
+        if names:
+            sdrs = [s for s in sdrs if s.device_id_string in names]
+        else:
+            sdrs = [s for s in sdrs if getattr(s, 'sensor_type_code', None)
+                    != SENSOR_TYPE_TEMPERATURE]
+        if not sdrs:
+            raise ValueError('No sensors to watch after pin_pg changes')
+        return [create_sensor_reading_request(
+            self.ipmi.target, s.number, getattr(s, 'owner_lun', 0))
+            for s in sdrs]
+
+    def read_sensors(self):
+        return [decode_sensor_reading(rsp) for rsp in
+                self.interface.send_and_receive_many(self._sensor_reqs)]
+
+    # calls func, returns whether it succeeded
+    def _request(self, cycle, func, *args):
+        try:
+            func(*args)
+        except IPMI_ERRORS as e:
+            self.errors += 1
+            log().warning('Cycle %d: %s failed: %r', cycle, func.__name__, e)
+            return False
+        return True
+
+    def drain_events(self):
+        while self.interface.receive_and_ack_event(timeout=0) is not None:
+            pass
+
+    # the next hot-swap assertion event, None if none came in time
+    def wait_hotswap_event(self, deadline):
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            event = self.interface.receive_and_ack_event(timeout=remaining)
+            if event is None:
+                return None
+            if event.sensor_type == SENSOR_TYPE_MODULE_HOT_SWAP and \
+                    event.event_type.dir == 0:
+                return event
+            self.other_events += 1
+
+    # polls the watched sensors until one differs from before, returns the
+    # time it was read or None if none did in time
+    def wait_sensor_change(self, cycle, before, deadline):
+        while time.perf_counter() < deadline:
+            try:
+                readings = self.read_sensors()
+            except IPMI_ERRORS as e:
+                self.errors += 1
+                log().warning('Cycle %d: sensor reading failed: %r', cycle,
+                              e)
+                continue
+            if readings != before:
+                return time.perf_counter()
+        return None
+
+    def half_cycle(self, cycle, direction):
+        hs_level, offset, set_led, pg_level = DIRECTIONS[direction]
+        stats = self.stats
+
+        self.arduino.digital_write(self.pin_hs, hs_level)
+        edge = time.perf_counter()
+        event = self.wait_hotswap_event(edge + self.event_timeout)
+        if event is None:
+            stats[direction, STAGE_EVENT].miss(cycle)
+            stats[direction, STAGE_LED].miss(cycle)
+        else:
+            received = time.perf_counter()
+            if event.event_data[0] != offset:
+                log().warning('Cycle %d: unexpected hot-swap event %d',
+                              cycle, event.event_data[0])
+            stats[direction, STAGE_EVENT].observe(cycle, received - edge)
+            if self._request(cycle, set_led, self.ipmi):
+                stats[direction, STAGE_LED].observe(
+                    cycle, time.perf_counter() - received)
+            else:
+                stats[direction, STAGE_LED].miss(cycle)
+
+        if self.pin_pg is not None:
+            deadline = time.perf_counter() + self.sensor_timeout
+            before = None
+            while before is None and time.perf_counter() < deadline:
+                try:
+                    before = self.read_sensors()
+                except IPMI_ERRORS:
+                    self.errors += 1
+            self.arduino.digital_write(self.pin_pg, pg_level)
+            edge = time.perf_counter()
+            changed = None
+            if before is not None:
+                changed = self.wait_sensor_change(
+                    cycle, before, edge + self.sensor_timeout)
+            if changed is None:
+                stats[direction, STAGE_SENSOR].miss(cycle)
+            else:
+                stats[direction, STAGE_SENSOR].observe(cycle, changed - edge)
+        self._request(cycle, set_led_off, self.ipmi)
+        time.sleep(self.settle)
+
+    def setup(self):
+        with self.arduino.batch() as batch:
+            for pin in (self.pin_hs, self.pin_pg):
+                if pin is not None:
+                    batch.pin_mode(pin, OUTPUT)
+                    batch.digital_write(pin, LOW)
+        time.sleep(self.settle)
+        self.drain_events()
+
+    def run(self, cycles=DEFAULT_CYCLES, progress=None):
+        '''Runs the cycles, a KeyboardInterrupt ends them early.
+
+        progress: called with the number of cycles done every
+        PROGRESS_EVERY cycles
+        '''
+        self.setup()
+        started = time.perf_counter()
+        try:
+            for cycle in range(1, cycles + 1):
+                self.half_cycle(cycle, ACTIVATION)
+                self.half_cycle(cycle, DEACTIVATION)
+                self.cycles = cycle
+                if progress is not None and cycle % PROGRESS_EVERY == 0:
+                    progress(cycle)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.duration = time.perf_counter() - started
+
+    @property
+    def missed(self):
+        return sum(s.missed for s in self.stats.values())
+
+    def lines(self):
+        lines = [f'{self.cycles} cycles in {self.duration:.1f}s, '
+                 f'{self.missed} missed, {self.errors} failed requests, '
+                 f'{self.other_events} other events']
+        for stage_stats in self.stats.values():
+            lines.extend(stage_stats.lines())
+        return lines
+
+    def results(self):
+        return [s.result(self.cycles) for s in self.stats.values()]
+
+    def close(self):
+        self.interface.close_session()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Toggle the hot-swap handle of a MMC for many cycles '
+                    'and measure how fast it responds')
+    parser.add_argument(
+        '--port', help='Serial port device node e.g. /dev/ttyACM0',
+        required=True)
+    parser.add_argument(
+        '--target', type=hex_or_int, default=DEFAULT_TARGET,
+        help='IPMB address of target device')
+    parser.add_argument(
+        '--pin-hs', type=int, required=True,
+        help='Arduino pin controlling the hotswap switch')
+    parser.add_argument(
+        '--pin-pg', type=int,
+        help='Arduino pin used for indicating that payload power is on')
+    parser.add_argument(
+        '--cycles', type=int, default=DEFAULT_CYCLES,
+        help='Handle close and open cycles to run')
+    parser.add_argument(
+        '--pg-sensor', action='append', metavar='NAME',
+        help='Sensor expected to change after pin-pg, can be repeated, all '
+             'but the temperatures by default')
+    parser.add_argument(
+        '--event-timeout', type=float, default=DEFAULT_EVENT_TIMEOUT,
+        help='Seconds to wait for the hot-swap event of a handle change')
+    parser.add_argument(
+        '--sensor-timeout', type=float, default=DEFAULT_SENSOR_TIMEOUT,
+        help='Seconds to wait for a sensor change after pin-pg')
+    parser.add_argument(
+        '--settle', type=float, default=DEFAULT_SETTLE,
+        help='Seconds to wait after each handle change')
+    parser.add_argument(
+        '--outlier-factor', type=float, default=DEFAULT_OUTLIER_FACTOR,
+        help='Log latencies longer than this many times the median')
+    parser.add_argument(
+        '--no-sdr-cache', dest='sdr_cache', action='store_false',
+        help="Read the SDRs from the device even if they are cached")
+    parser.add_argument(
+        '--json', metavar='FILE',
+        help='Write the results as JSON to FILE, - for standard output')
+    parser.add_argument(
+        '--junit', metavar='FILE',
+        help='Write the results as JUnit XML to FILE, - for standard output')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    output = text_output(args.json, args.junit)
+    soak = HotSwapSoak(args.port, args.target, args.pin_hs, args.pin_pg,
+                       args.sdr_cache, args.pg_sensor, args.event_timeout,
+                       args.sensor_timeout, args.settle, args.outlier_factor)
+    try:
+        soak.run(args.cycles, lambda cycle: print(
+            f'cycle {cycle}/{args.cycles}, {soak.missed} missed',
+            file=output, flush=True))
+    finally:
+        soak.close()
+    for line in soak.lines():
+        print(line, file=output)
+    suites = [Suite(f'{args.port} 0x{args.target:02x} hot-swap soak',
+                    soak.results(),
+                    {'port': args.port, 'target': f'0x{args.target:02x}',
+                     'cycles': soak.cycles})]
+    if args.json:
+        write_json(args.json, suites)
+    if args.junit:
+        write_junit(args.junit, suites)
+    if soak.missed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
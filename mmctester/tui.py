@@ -5,8 +5,19 @@ import locale
 import time
 from mmctester.util import chunk_string
 
+# at most this many frames are drawn per second
+MAX_FPS = 20
+
 
 class TuiManager:
+    '''Curses screen showing titled sections of lines.
+
+    Sections are set with set_section and drawn by render, one below the
+    other. Only the screen rows whose text changed are written and the
+    terminal is updated once per frame, so a frame costs what changed in
+    it, e.g. a sensor line, instead of the whole screen.
+    '''
+
     def __init__(self):
         self.win = curses.initscr()
 #        curses.start_color()
@@ -19,9 +30,19 @@ class TuiManager:
         self.on_resize()
         self.key_callbacks = []
         self.draw_callbacks = []
+        self.sections = {}
+        self.min_frame_interval = 1 / MAX_FPS
+        self._rows = []
+        self._dirty = False
+        self._last_frame = 0.0
 
     def on_resize(self):
         self.ymax, self.xmax = self.win.getmaxyx()
+        # the next frame redraws every row
+        self.win.clear()
+        self._rows = []
+        self._dirty = True
+        self._last_frame = 0.0
 
     def set_half_delay(self, tenths):
         curses.halfdelay(tenths)
@@ -41,6 +62,10 @@ class TuiManager:
             callback()
 
     def add_str(self, string, y=None, x=0):
+        self._add_str(string, y, x)
+        self.win.refresh()
+
+    def _add_str(self, string, y=None, x=0):
         if y is None:
             y = self.line
         else:
@@ -51,26 +76,90 @@ class TuiManager:
 
         if isinstance(string, list):
             for part in string:
-                self.add_str(part, y=None, x=x)
+                self._add_str(part, y=None, x=x)
             return
 
         for i, chunk in enumerate(chunk_string(string, self.xmax - x)):
             self.win.addstr(y + i, x, chunk.encode())
             self.line += 1
 
-        self.win.refresh()
-
+    def set_section(self, name, lines):
+        '''Sets the lines shown under a title.
+
+        Sections are shown in the order they are first set.
+        '''
+        lines = tuple(lines)
+        if self.sections.get(name) != lines:
+            self.sections[name] = lines
+            self._dirty = True
+
+    def _layout(self):
+        rows = []
+        for i, (name, lines) in enumerate(self.sections.items()):
+            if i:
+                rows.append("===")
+            rows.append(name)
+            for line in lines:
+                rows.extend(chunk_string(line, self.xmax))
+        return rows[:self.ymax]
+
+    def _draw_row(self, y, row):
+        try:
+            self.win.move(y, 0)
+            self.win.clrtoeol()
+            if row:
+                self.win.addstr(y, 0, row.encode())
+        except curses.error:
+            # writing the bottom right corner moves the cursor off screen
+            pass
+
+    def render(self, force=False):
+        '''Draws what changed since the previous frame.
+
+        Frames closer than min_frame_interval to the previous one are
+        skipped, unless force is set, their changes are drawn by the next
+        call, see pending_delay. Returns whether a frame was drawn.
+        '''
+        now = time.monotonic()
+        if not self._dirty:
+            return False
+        if not force and now - self._last_frame < self.min_frame_interval:
+            return False
+        self._dirty = False
+        self._last_frame = now
+        rows = self._layout()
+        for y, row in enumerate(rows):
+            if y >= len(self._rows) or self._rows[y] != row:
+                self._draw_row(y, row)
+        for y in range(len(rows), len(self._rows)):
+            self._draw_row(y, "")
+        self._rows = rows
+        self.win.noutrefresh()
+        curses.doupdate()
+        return True
+
+    def pending_delay(self):
+        '''Seconds until a skipped frame can be drawn, None if none was.'''
+        if not self._dirty:
+            return None
+        return max(0.0, self._last_frame + self.min_frame_interval -
+                   time.monotonic())
+
+    # handles all the pending keys, curses may have read several of them
+    # from the terminal at once
     def process_events(self):
         c = self.win.getch()
-        if c != -1:
+        while c != -1:
             self.notify_key(c)
-        if c == curses.KEY_RESIZE:
-            self.on_resize()
-            self.notify_draw()
+            if c == curses.KEY_RESIZE:
+                self.on_resize()
+                self.notify_draw()
+            c = self.win.getch()
 
     def clear(self):
-        self.win.clear()
+        self.win.erase()
         self.line = 0
+        self._rows = []
 
     def quit(self):
         curses.echo()
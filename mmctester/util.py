@@ -2,6 +2,10 @@
 
 import binascii
 
+HEX_DIGITS = b'0123456789abcdefABCDEF'
+# the other bytes, deleted before decoding hex
+NON_HEX = bytes(b for b in range(256) if b not in HEX_DIGITS)
+
 
 def hex_or_int(value):
     if value.startswith('0x'):
@@ -11,10 +15,15 @@ def hex_or_int(value):
 
 
 def hex_to_bin(hex_data):
-    ALLOWED_HEX = set(['0', '1', '2', '3', '4', '5', '6', '7', '8', '9',
-                       'a', 'b', 'c', 'd', 'e', 'f'])
-    stripped = ''.join(item for item in hex_data if item in ALLOWED_HEX)
-    return binascii.unhexlify(stripped)
+    '''Bytes of hex text, str or bytes, ignoring anything but hex digits.'''
+    if isinstance(hex_data, str):
+        hex_data = hex_data.encode('ascii', errors='ignore')
+    return binascii.unhexlify(hex_data.translate(None, NON_HEX))
+
+
+def hex_dump(data):
+    '''Hex digits of data separated by spaces, for the logs.'''
+    return ' '.join(f'{b:02x}' for b in data)
 
 
 def chunk_string(string, width):
@@ -0,0 +1,143 @@
+import fcntl
+import os
+import select
+import struct
+import termios
+
+import pyipmi
+import pytest
+
+from pyipmi.interfaces.ipmb import IpmbHeaderReq, encode_ipmb_msg
+from pyipmi.msgs import encode_message
+
+from mmctester import interface
+from mmctester.emulator import MMCModel
+from mmctester.framing import HexFraming
+from mmctester.interface import MAX_I2C_MSG_SIZE, BoardProtocol
+
+
+class ModelInterface(object):
+    '''pyipmi interface answered in process by a MMCModel, without a board.
+
+    requests holds the (netfn, cmdid, data) of every request sent.
+    '''
+
+    NAME = 'model'
+
+    def __init__(self, mmc, address=0x20):
+        self.mmc = mmc
+        self.address = address
+        self.max_msg_size = MAX_I2C_MSG_SIZE
+        self.requests = []
+        self._sequence = 0
+
+    def establish_session(self, session):
+        pass
+
+    def close_session(self):
+        pass
+
+    def is_ipmc_accessible(self, target):
+        return True
+
+    def send_and_receive_raw(self, target, lun, netfn, raw_bytes):
+        self._sequence = (self._sequence + 1) % 64
+        header = IpmbHeaderReq()
+        header.netfn = netfn
+        header.rs_lun = lun
+        header.rs_sa = target.ipmb_address
+        header.rq_seq = self._sequence
+        header.rq_lun = 0
+        header.rq_sa = self.address
+        header.cmdid = raw_bytes[0]
+        self.requests.append((netfn, raw_bytes[0], bytes(raw_bytes[1:])))
+        rsp = self.mmc.handle_message(
+            bytes(encode_ipmb_msg(header, raw_bytes[1:])))
+        return rsp[6:-1]
+
+    def send_and_receive(self, req):
+        rx_data = self.send_and_receive_raw(
+            req.target, req.lun, req.netfn,
+            bytes((req.cmdid,)) + bytes(encode_message(req)))
+        return BoardProtocol._decode_response(req, rx_data)
+
+    def send_and_receive_many(self, reqs, window=None):
+        return [self.send_and_receive(req) for req in reqs]
+
+
+@pytest.fixture
+def mmc():
+    return MMCModel()
+
+
+@pytest.fixture
+def ipmi(mmc):
+    ipmi = pyipmi.create_connection(ModelInterface(mmc))
+    ipmi.target = pyipmi.Target(mmc.address)
+    return ipmi
+
+
+class FakeSerial(object):
+    '''Serial port of a board in hex framing, read through a pipe.
+
+    Every IPMB request written is recorded and given to handle, which
+    answers it, or not, with reply.
+    '''
+
+    def __init__(self, port, baudrate=115200, timeout=None):
+        self.timeout = timeout
+        self.requests = []
+        self.handle = None
+        self.error = None
+        self._rfd, self._wfd = os.pipe()
+
+    def fileno(self):
+        return self._rfd
+
+    @property
+    def in_waiting(self):
+        buf = fcntl.ioctl(self._rfd, termios.FIONREAD, b'\0' * 4)
+        return struct.unpack('i', buf)[0]
+
+    def read(self, size=1):
+        if self.error is not None:
+            raise self.error
+        if not self.in_waiting and not select.select(
+                [self._rfd], [], [], self.timeout)[0]:
+            return b''
+        return os.read(self._rfd, size)
+
+    def read_until(self, terminator=b'\n'):
+        data = bytearray()
+        while not data.endswith(terminator):
+            byte = self.read(1)
+            if not byte:
+                break
+            data += byte
+        return bytes(data)
+
+    def write(self, data):
+        for line in data.splitlines():
+            raw = bytes.fromhex(line.decode())
+            if raw == b'\x00':
+                # ping
+                os.write(self._wfd, b'00\n')
+                continue
+            self.requests.append(raw)
+            if self.handle is not None:
+                self.handle(raw)
+        return len(data)
+
+    def reply(self, frame):
+        os.write(self._wfd, HexFraming().encode(frame))
+
+    def close(self):
+        os.close(self._rfd)
+        os.close(self._wfd)
+
+
+@pytest.fixture
+def fake_serial(monkeypatch):
+    '''Opens a FakeSerial instead of the serial port of a board.'''
+    monkeypatch.setattr(interface.serial, 'Serial', FakeSerial)
+    return FakeSerial
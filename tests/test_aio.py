@@ -0,0 +1,151 @@
+import asyncio
+
+import pyipmi
+import pytest
+
+from pyipmi.errors import IpmiTimeoutError
+
+from mmctester.aio import AsyncMMCTesterBoard
+from mmctester.arduino import HIGH, OUTPUT
+from mmctester.emulator import HS_HANDLE_CLOSED, BoardEmulator
+from mmctester.sensors import (create_sensor_reading_request,
+                               decode_sensor_reading)
+
+PIN_HS = 2
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def sensor_requests(mmc, count=4):
+    target = pyipmi.Target(mmc.address)
+    return [create_sensor_reading_request(target, number)
+            for number in range(1, count + 1)]
+
+
+async def open_fake_board(mmc, handle=None, window=4):
+    board = AsyncMMCTesterBoard('fake', framing='hex')
+    board.pipeline_window = window
+    # do not wait long for what is never answered
+    board.rtt.initial = 0.05
+    board.rtt.min_timeout = 0.05
+    await board.open()
+    port = board._ser._ser
+    if handle is None:
+        port.handle = lambda request: port.reply(mmc.handle_message(request))
+    else:
+        port.handle = lambda request: handle(port, request)
+    return board, port
+
+
+@pytest.fixture
+def emulator():
+    emulator = BoardEmulator(pin_hs=PIN_HS, seed=1)
+    emulator.start()
+    yield emulator
+    emulator.stop()
+    emulator.close()
+
+
+def test_window_and_out_of_order_responses(fake_serial, mmc, ipmi):
+    pending = []
+    most_pending = []
+
+    def answer_in_pairs(port, request):
+        pending.append(request)
+        most_pending.append(len(pending))
+        if len(pending) == 2:
+            for request in reversed(pending):
+                port.reply(mmc.handle_message(request))
+            del pending[:]
+
+    async def main():
+        board, port = await open_fake_board(mmc, answer_in_pairs, 2)
+        try:
+            rsps = await board.send_and_receive_many(sensor_requests(mmc))
+        finally:
+            board.close()
+        return board, port, rsps
+
+    board, port, rsps = run(main())
+    # each response given to its own request
+    assert [decode_sensor_reading(rsp) for rsp in rsps] == \
+        [decode_sensor_reading(ipmi.interface.send_and_receive(req))
+         for req in sensor_requests(mmc)]
+    assert max(most_pending) == 2
+    assert len(port.requests) == 4
+    assert board.metrics.retries == 0
+
+
+def test_retry_resends_same_sequence_number(fake_serial, mmc):
+    def drop_first_attempt(port, request):
+        if len(port.requests) > 1:
+            port.reply(mmc.handle_message(request))
+
+    async def main():
+        board, port = await open_fake_board(mmc, drop_first_attempt)
+        try:
+            rsp = await board.send_and_receive(sensor_requests(mmc, 1)[0])
+        finally:
+            board.close()
+        return board, port, rsp
+
+    board, port, rsp = run(main())
+    assert rsp.completion_code == 0
+    assert port.requests[0] == port.requests[1]
+    assert board.metrics.retries == 1
+    rtt = board.rtt.get(mmc.address, rsp.netfn, rsp.cmdid)
+    assert rtt.timeouts == 1
+
+
+def test_unanswered_request_times_out(fake_serial, mmc):
+    async def main():
+        board, port = await open_fake_board(mmc, lambda port, req: None)
+        try:
+            with pytest.raises(IpmiTimeoutError):
+                await board.send_and_receive(sensor_requests(mmc, 1)[0])
+        finally:
+            board.close()
+        return board, port
+
+    board, port = run(main())
+    assert len(port.requests) == board.max_retries
+    assert board.metrics.timeouts == 1
+
+
+def test_reader_failure_is_not_a_timeout(fake_serial, mmc):
+    def fail(port, request):
+        port.error = OSError('device disconnected')
+        port.reply(mmc.handle_message(request))
+
+    async def main():
+        board, port = await open_fake_board(mmc, fail)
+        try:
+            with pytest.raises(IOError, match='Serial reader failed'):
+                await board.send_and_receive(sensor_requests(mmc, 1)[0])
+        finally:
+            board.close()
+        return board
+
+    board = run(main())
+    assert board.metrics.retries == 0
+
+
+def test_emulated_board(emulator):
+    async def main():
+        async with AsyncMMCTesterBoard(emulator.port) as board:
+            assert board.framing == 'binary'
+            rsps = await board.send_and_receive_many(
+                sensor_requests(emulator.mmc))
+            async with board.arduino.batch() as batch:
+                batch.pin_mode(PIN_HS, OUTPUT)
+                batch.digital_write(PIN_HS, HIGH)
+            level = await board.arduino.digital_read(PIN_HS)
+            event = await board.receive_and_ack_event(timeout=1)
+        return rsps, level, event
+
+    rsps, level, event = run(main())
+    assert [rsp.completion_code for rsp in rsps] == [0] * 4
+    assert level == HIGH
+    assert event.event_data[0] == HS_HANDLE_CLOSED
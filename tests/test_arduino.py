@@ -0,0 +1,98 @@
+import pytest
+
+from mmctester.arduino import (ERR_NO_COMMAND, HIGH, MAX_BATCH_ARGS,
+                               MAX_BATCH_RESULTS, OUTPUT,
+                               ArduinoLocalCommand)
+from mmctester.emulator import BoardEmulator
+
+PIN_READ = ArduinoLocalCommand.COMMAND_DIG_READ
+PIN_WRITE = ArduinoLocalCommand.COMMAND_DIG_WRITE
+AN_READ = ArduinoLocalCommand.COMMAND_AN_READ
+
+
+class FakeBoard(object):
+    '''Answers local commands with the emulator's handlers, without a pty.'''
+
+    def __init__(self, batch=True):
+        self.emulator = BoardEmulator(batch=batch)
+        self.sent = []
+        self.arduino = ArduinoLocalCommand(self.send, self.recv)
+
+    def send(self, data):
+        self.sent.append(bytes(data))
+
+    def recv(self):
+        data = self.sent[-1]
+        command = self.emulator.commands.get(data[1])
+        if command is None:
+            return bytes((data[0], ERR_NO_COMMAND))
+        return bytes(data[:2]) + command(data[2:])
+
+
+def test_split_batch_at_max_args():
+    # 3 bytes each, the 11th command no longer fits
+    commands = [(PIN_WRITE, (n, HIGH), 0) for n in range(11)]
+    batches = ArduinoLocalCommand._split_batch(commands)
+    assert [len(b) for b in batches] == [10, 1]
+    assert len(ArduinoLocalCommand._batch_args(batches[0])) == MAX_BATCH_ARGS
+
+
+def test_split_batch_at_max_results():
+    # 2 bytes of arguments and 2 result bytes each
+    commands = [(AN_READ, (n,), 2) for n in range(16)]
+    batches = ArduinoLocalCommand._split_batch(commands)
+    assert [len(b) for b in batches] == [14, 2]
+    assert sum(size for _, _, size in batches[0]) <= MAX_BATCH_RESULTS
+
+
+def test_split_batch_mixed():
+    commands = [(AN_READ, (0,), 2)] * 14 + [(PIN_READ, (1,), 1)] + \
+        [(PIN_WRITE, (2, HIGH), 0)] * 10
+    batches = ArduinoLocalCommand._split_batch(commands)
+    # the read fills both limits exactly
+    assert [len(b) for b in batches] == [15, 10]
+    assert len(ArduinoLocalCommand._batch_args(batches[0])) == MAX_BATCH_ARGS
+    assert sum(size for _, _, size in batches[0]) == MAX_BATCH_RESULTS
+
+
+def test_split_batch_empty():
+    assert ArduinoLocalCommand._split_batch([]) == [[]]
+
+
+def test_batch_results():
+    arduino = ArduinoLocalCommand(None, None)
+    commands = [(PIN_WRITE, (1, HIGH), 0), (PIN_READ, (1,), 1),
+                (AN_READ, (14,), 2)]
+    ans = bytes((0, ArduinoLocalCommand.COMMAND_BATCH,
+                 ArduinoLocalCommand.OK, HIGH, 0x34, 0x02))
+    assert arduino._batch_results(commands, ans) == [None, HIGH, 0x234]
+    with pytest.raises(IOError):
+        arduino._batch_results(commands, ans[:-1])
+    with pytest.raises(IOError):
+        arduino._batch_results(commands, ans + b'\x00')
+
+
+def test_run_batch_round_trips():
+    board = FakeBoard()
+    with board.arduino.batch() as batch:
+        for pin in range(20):
+            batch.pin_mode(pin, OUTPUT)
+            batch.digital_write(pin, pin & 1)
+            batch.digital_read(pin)
+    assert batch.results == [None, None, 0, None, None, 1] * 10
+    assert all(len(data) <= MAX_BATCH_ARGS + 2 for data in board.sent)
+    assert len(board.sent) == 6
+
+
+def test_run_batch_unsupported():
+    board = FakeBoard(batch=False)
+    batch = board.arduino.batch()
+    batch.digital_write(3, HIGH)
+    batch.digital_read(3)
+    assert batch.flush() == [None, HIGH]
+    assert not board.arduino.batch_supported
+    assert len(board.sent) == 3
+    # no more batch attempts once the firmware turned out not to know it
+    batch.digital_read(3)
+    assert batch.flush() == [HIGH]
+    assert len(board.sent) == 4
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from mmctester.bench import (Bench, WorkloadResult, compare_baseline,
+                             save_baseline)
+
+
+@pytest.fixture
+def bench(fake_serial, mmc):
+    bench = Bench('fake', mmc.address, framing='hex', sdr_cache=False)
+    port = bench.interface._ser._ser
+    port.handle = lambda request: port.reply(mmc.handle_message(request))
+    yield bench
+    bench.close()
+
+
+def workload(name, ops_per_second, p95):
+    result = WorkloadResult(name)
+    result.ops = 100
+    result.elapsed = 100 / ops_per_second
+    result.latencies = [p95] * 100
+    return result
+
+
+def test_ping(bench):
+    result = bench.run('ping', count=5)
+    assert result.ops == 5
+    assert len(result.latencies) == 5
+    assert (result.timeouts, result.errors, result.retries) == (0, 0, 0)
+    assert result.requests == 5
+    assert result.tx_bytes > 0 and result.rx_bytes > 0
+    assert result.line().startswith('ping: 5 ops in ')
+
+
+def test_sensors(bench, mmc):
+    result = bench.run('sensors', count=2)
+    # a request per sensor, the SDRs were read during the warm up
+    assert result.to_dict()['requests_per_op'] == len(mmc.sensors)
+    assert result.errors == 0
+
+
+def test_errors_counted(bench, mmc):
+    mmc.handlers.clear()
+    result = bench.run('ping', count=3)
+    assert result.errors == 3
+    assert result.latencies == []
+    assert result.to_dict()['error_rate'] == 1.0
+    assert result.line().endswith('errors 100.00%')
+
+
+def test_baseline(tmp_path):
+    path = tmp_path / 'baseline.json'
+    save_baseline(str(path), [workload('ping', 100, 0.01),
+                              workload('sensors', 10, 0.1)],
+                  {'framing': 'binary'})
+    assert json.loads(path.read_text())['properties'] == \
+        {'framing': 'binary'}
+    lines, regressed = compare_baseline(
+        str(path), [workload('ping', 95, 0.0105),
+                    workload('fru', 1, 1.0)])
+    assert not regressed
+    assert lines == ['ping: 95.0 ops/s (-5.0%), p95 10.5ms (+5.0%)',
+                     'fru: not in baseline']
+    # slower
+    lines, regressed = compare_baseline(
+        str(path), [workload('ping', 80, 0.01)])
+    assert regressed
+    assert lines[0].endswith('REGRESSION')
+    # a longer tail
+    lines, regressed = compare_baseline(
+        str(path), [workload('sensors', 10, 0.2)], tolerance=0.5)
+    assert regressed
+
+
+def test_unknown_baseline_version(tmp_path):
+    path = tmp_path / 'baseline.json'
+    path.write_text('{"version": 0}')
+    with pytest.raises(ValueError):
+        compare_baseline(str(path), [])
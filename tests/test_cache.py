@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from pyipmi.msgs import constants
+
+from mmctester.cache import SdrCache, device_identity
+
+GET_DEVICE_SDR = (constants.NETFN_SENSOR_EVENT, constants.CMDID_GET_DEVICE_SDR)
+
+
+def count(ipmi, request):
+    return sum((netfn, cmdid) == request
+               for netfn, cmdid, _ in ipmi.interface.requests)
+
+
+@pytest.fixture
+def sdr_cache(tmp_path):
+    return SdrCache(str(tmp_path))
+
+
+def test_device_identity(ipmi, mmc):
+    identity = device_identity(ipmi)
+    assert len(identity) == 2
+    assert identity == device_identity(ipmi)
+    mmc.sdr_change_indicator += 1
+    assert device_identity(ipmi) != identity
+
+
+def test_no_identity(ipmi, mmc):
+    mmc.handlers[(constants.NETFN_APP, constants.CMDID_GET_DEVICE_ID)] = \
+        lambda data: bytes((constants.CC_INV_CMD,))
+    assert device_identity(ipmi) is None
+
+
+def test_sdrs_read_once(ipmi, sdr_cache):
+    sdrs = sdr_cache.device_sdr_entries(ipmi)
+    reads = count(ipmi, GET_DEVICE_SDR)
+    assert reads >= len(sdrs) == 4
+    cached = sdr_cache.device_sdr_entries(ipmi)
+    assert count(ipmi, GET_DEVICE_SDR) == reads
+    assert [bytes(s.data) for s in cached] == [bytes(s.data) for s in sdrs]
+    assert [s.device_id_string for s in cached] == \
+        ['HOTSWAP AMC', 'P12V', 'P3V3', 'TEMP UC']
+    assert (sdr_cache.hits, sdr_cache.misses) == (1, 1)
+
+
+def test_sdrs_read_again_when_identity_changes(ipmi, mmc, sdr_cache):
+    sdr_cache.device_sdr_entries(ipmi)
+    reads = count(ipmi, GET_DEVICE_SDR)
+    # the sensor population changed
+    mmc.sdr_change_indicator += 1
+    sdr_cache.device_sdr_entries(ipmi)
+    assert count(ipmi, GET_DEVICE_SDR) > reads
+    reads = count(ipmi, GET_DEVICE_SDR)
+    # a firmware update
+    device_id = mmc._get_device_id(b'')
+    mmc.handlers[(constants.NETFN_APP, constants.CMDID_GET_DEVICE_ID)] = \
+        lambda data: device_id[:4] + b'\x11' + device_id[5:]
+    sdr_cache.device_sdr_entries(ipmi)
+    assert count(ipmi, GET_DEVICE_SDR) > reads
+    assert sdr_cache.misses == 3
+
+
+def test_entry_of_other_identity_ignored(ipmi, sdr_cache, tmp_path):
+    identity = device_identity(ipmi)
+    sdr_cache.device_sdr_entries(ipmi, identity)
+    path, = tmp_path.iterdir()
+    entry = json.loads(path.read_text())
+    entry['identity'] = ['other']
+    path.write_text(json.dumps(entry))
+    assert sdr_cache.load(ipmi.target.ipmb_address, identity) is None
+    path.write_text('{')
+    assert sdr_cache.load(ipmi.target.ipmb_address, identity) is None
+    assert sdr_cache.hits == 0
+
+
+def test_no_cache_without_identity(ipmi, mmc, sdr_cache, tmp_path):
+    mmc.handlers[(constants.NETFN_SENSOR_EVENT,
+                  constants.CMDID_GET_DEVICE_SDR_INFO)] = \
+        lambda data: bytes((constants.CC_INV_CMD,))
+    assert len(sdr_cache.device_sdr_entries(ipmi)) == 4
+    assert list(tmp_path.iterdir()) == []
+
@@ -0,0 +1,102 @@
+import pytest
+
+from mmctester.capture import (CAPTURE_ANALOG, TIMESTAMP_MODULO,
+                               TRIGGER_RISING, Capture, capture_block,
+                               capture_command_args, encode_sample)
+
+LOCAL_ADDR = 0x0
+# an analog and two digital pins, 3 bytes a sample and 8 samples a block
+ANALOG = (14,)
+DIGITAL = (2, 3)
+PER_BLOCK = 8
+
+
+def block(sequence, timestamp_us, values):
+    samples = b''.join(encode_sample((value,), (value & 1, value & 2))
+                       for value in values)
+    return bytes((LOCAL_ADDR,)) + capture_block(sequence, timestamp_us,
+                                                samples)
+
+
+def new_capture(count=4 * PER_BLOCK, period=0.001):
+    return Capture(ANALOG, DIGITAL, period, count)
+
+
+def test_add_block_decodes_samples():
+    capture = new_capture()
+    capture.add_block(block(0, 1000, [0x301, 2, 3]))
+    assert len(capture) == 3
+    assert list(capture.analog[14]) == [0x301, 2, 3]
+    assert list(capture.digital[2]) == [1, 0, 1]
+    assert list(capture.digital[3]) == [0, 1, 1]
+    assert list(capture.times) == pytest.approx([0, 0.001, 0.002])
+    assert list(capture.rows())[1] == (pytest.approx(0.001), 2, 0, 1)
+
+
+def test_lost_blocks_counted_from_sequence_gaps():
+    capture = new_capture(count=5 * PER_BLOCK)
+    capture.add_block(block(0, 0, range(PER_BLOCK)))
+    capture.add_block(block(3, 24000, range(PER_BLOCK)))
+    assert capture.lost_blocks == 2
+    # the times after the gap come from the timestamp
+    assert capture.times[PER_BLOCK] == pytest.approx(0.024)
+    assert not capture.complete
+    capture.add_block(block(4, 32000, range(PER_BLOCK)))
+    assert capture.lost_blocks == 2
+    # lost blocks are taken as full
+    assert capture.complete
+
+
+def test_sequence_wraps():
+    capture = new_capture(count=1000)
+    for sequence in range(300):
+        capture.add_block(block(sequence, sequence * 8000, [1]))
+    assert capture.lost_blocks == 0
+    capture.add_block(block(301, 301 * 8000, [1]))
+    assert capture.lost_blocks == 1
+
+
+def test_first_block_lost():
+    capture = new_capture()
+    capture.add_block(block(1, 8000, [1]))
+    assert capture.lost_blocks == 1
+    assert capture.times[0] == 0
+
+
+def test_timestamp_wraps():
+    capture = new_capture()
+    capture.add_block(block(0, TIMESTAMP_MODULO - 500, [1]))
+    capture.add_block(block(1, 7500, [1]))
+    assert list(capture.times) == pytest.approx([0, 0.008])
+
+
+def test_first_time():
+    capture = new_capture()
+    capture.add_block(block(0, 0, [10, 100, 500, 200]))
+    assert capture.first_time(capture.analog[14], 400) == \
+        pytest.approx(0.002)
+    assert capture.first_time(capture.analog[14], 1000) is None
+    assert capture.first_time(capture.analog[14], 5, rising=False) is None
+    assert capture.first_time(capture.digital[3], 0, rising=False) == \
+        pytest.approx(0.001)
+
+
+def test_capture_command_args():
+    assert capture_command_args((14,), (2,), 0.001, 1000,
+                                (3, 'rising')) == \
+        [0xe8, 0x03, 0xe8, 0x03, 3, TRIGGER_RISING, 14 | CAPTURE_ANALOG, 2]
+    assert capture_command_args((), (), 0, 0) == [0, 0, 0, 0, 0, 0]
+
+
+@pytest.mark.parametrize('analog, digital, period, count, trigger', [
+    ((), (), 0.001, 10, None),
+    ((14, 15, 16), (2, 3), 0.001, 10, None),
+    ((14,), (), 0.001, 0x10000, None),
+    ((14,), (), 0.1, 10, None),
+    ((14,), (), 0, 10, None),
+    ((14,), (), 0.001, 10, (3, 'both')),
+])
+def test_capture_command_args_invalid(analog, digital, period, count,
+                                      trigger):
+    with pytest.raises(ValueError):
+        capture_command_args(analog, digital, period, count, trigger)
@@ -0,0 +1,75 @@
+import io
+
+import pytest
+
+from pyipmi.msgs import constants
+
+from mmctester.commandstester import CommandsTester, SkipCheck
+
+GET_DEVICE_GUID = (constants.NETFN_APP, constants.CMDID_GET_DEVICE_GUID)
+
+
+@pytest.fixture
+def output():
+    return io.StringIO()
+
+
+def commands_tester(ipmi, output, repeat=1):
+    return CommandsTester('/dev/board', ipmi.target.ipmb_address,
+                          sdr_cache=False, output=output,
+                          interface=ipmi.interface, repeat=repeat)
+
+
+def test_run(ipmi, output):
+    results = commands_tester(ipmi, output, repeat=3).run()
+    assert [r.status for r in results] == ['pass'] * len(results)
+    assert all(r.attempts == 3 and len(r.latencies) == 3
+               for r in results)
+    assert 'Get Sensor Reading: OK min=' in output.getvalue()
+
+
+def test_attempts_failing_with_completion_code(ipmi, mmc, output):
+    guid = mmc.handlers[GET_DEVICE_GUID]
+    answers = []
+
+    def busy_every_other_time(data):
+        answers.append(data)
+        if len(answers) % 2:
+            return bytes((constants.CC_NODE_BUSY,))
+        return guid(data)
+
+    mmc.handlers[GET_DEVICE_GUID] = busy_every_other_time
+    commands = commands_tester(ipmi, output, repeat=4)
+    commands.try_get_device_guid()
+    result, = commands.results
+    assert result.status == 'fail'
+    assert (result.attempts, result.failures) == (4, 2)
+    assert len(result.latencies) == 2
+    assert result.completion_code == constants.CC_NODE_BUSY
+    assert output.getvalue().startswith('Get Device GUID: FAIL (2/4, ')
+
+
+def test_skipped_check(ipmi, output):
+    def skip():
+        raise SkipCheck('not supported')
+
+    commands = commands_tester(ipmi, output, repeat=3)
+    assert commands._check('Skipped', skip) is None
+    result, = commands.results
+    assert result.status == 'skip'
+    assert result.attempts == 1
+    assert result.completion_code is None
+    assert output.getvalue() == 'Skipped: not supported\n'
+
+
+def test_prepare_is_not_timed(ipmi, output):
+    prepared = []
+
+    def prepare():
+        prepared.append(True)
+        return lambda: 42
+
+    commands = commands_tester(ipmi, output, repeat=2)
+    assert commands._check('Prepared', prepare=prepare) == 42
+    assert prepared == [True]
+    assert commands.results[0].attempts == 2
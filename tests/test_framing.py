@@ -0,0 +1,92 @@
+import pytest
+
+from pyipmi.errors import IpmiTimeoutError
+
+from mmctester.framing import (FRAME_START, BinaryFraming, HexFraming,
+                               frame_checksum)
+
+
+class FakeSerial(object):
+    '''Serial port handing out the given chunks, one per read.'''
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        if not self.chunks:
+            return b''
+        chunk = self.chunks.pop(0)
+        assert size >= len(chunk)
+        return chunk
+
+
+def read_all(framing, chunks):
+    ser = FakeSerial(chunks)
+    frames = []
+    while ser.chunks:
+        frames.append([bytes(f) for f in framing.read_frames(ser)])
+    return frames
+
+
+def test_hex_frames_across_reads():
+    frames = read_all(HexFraming(), [b'00 0', b'1 02\n20 ', b'30\n40\n'])
+    assert frames == [[], [b'\x00\x01\x02'], [b'\x20\x30', b'\x40']]
+
+
+def test_hex_invalid_line_skipped():
+    frames = read_all(HexFraming(), [b'00 0\n01 02\n'])
+    assert frames == [[b'\x01\x02']]
+
+
+def test_hex_encode():
+    assert HexFraming().encode(b'\x00\xab') == b'00 ab\n'
+
+
+def test_read_timeout():
+    with pytest.raises(IpmiTimeoutError):
+        HexFraming().read_frames(FakeSerial([]))
+
+
+def test_binary_roundtrip_byte_by_byte():
+    framing = BinaryFraming()
+    data = framing.encode(b'\x00\x05\x0e') + framing.encode(b'\x20\x01')
+    frames = read_all(framing, [bytes((b,)) for b in data])
+    assert [f for f in frames if f] == [[b'\x00\x05\x0e'], [b'\x20\x01']]
+    assert framing.buffer == b''
+
+
+def test_binary_encode():
+    assert BinaryFraming().encode(b'\x00\x05\x0e') == \
+        b'\xa5\x03\x00\x05\x0e\xea'
+    assert frame_checksum(b'\x03\x00\x05\x0e\xea') == 0
+
+
+def test_binary_resync_after_garbage():
+    framing = BinaryFraming()
+    frame = framing.encode(b'\x20\x01')
+    # bytes outside of frames, a bad length and a bad checksum
+    garbage = b'\x30\x31' + bytes((FRAME_START, 0xff)) + \
+        bytes((FRAME_START, 2, 0x20, 0x01, 0x00))
+    assert read_all(framing, [garbage + frame]) == [[b'\x20\x01']]
+    assert framing.buffer == b''
+
+
+def test_binary_keeps_incomplete_frame():
+    framing = BinaryFraming()
+    frame = framing.encode(b'\x20\x01\x02')
+    assert read_all(framing, [frame + frame[:3]]) == [[b'\x20\x01\x02']]
+    assert framing.buffer == frame[:3]
+    assert read_all(framing, [frame[3:]]) == [[b'\x20\x01\x02']]
+
+
+def test_binary_takes_over_hex_buffer():
+    hex_framing = HexFraming()
+    binary = BinaryFraming()
+    frame = binary.encode(b'\x00\x80')
+    read_all(hex_framing, [b'00 80\n' + frame[:2]])
+    binary = BinaryFraming(hex_framing.buffer)
+    assert read_all(binary, [frame[2:]]) == [[b'\x00\x80']]
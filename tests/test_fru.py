@@ -0,0 +1,78 @@
+import pytest
+
+from pyipmi.errors import CompletionCodeError
+from pyipmi.msgs import constants
+
+from mmctester.cache import FruCache
+from mmctester.fru import FruReader, max_fru_read_size
+
+READ_FRU_DATA = (constants.NETFN_STORAGE, constants.CMDID_READ_FRU_DATA)
+
+
+def fru_reads(ipmi):
+    '''Offset and count of each Read FRU Data request.'''
+    return [(data[1] | (data[2] << 8), data[3])
+            for netfn, cmdid, data in ipmi.interface.requests
+            if (netfn, cmdid) == READ_FRU_DATA]
+
+
+def test_reads_in_message_sized_chunks(ipmi, mmc):
+    reader = FruReader(ipmi)
+    assert reader.read_size == max_fru_read_size() == 23
+    assert reader.read_fru_data() == mmc.fru
+    assert [count for _, count in fru_reads(ipmi)] == \
+        [23] * (len(mmc.fru) // 23) + [len(mmc.fru) % 23]
+    assert reader.reads == len(fru_reads(ipmi))
+
+
+def test_backs_off_when_the_device_returns_less(ipmi, mmc):
+    mmc.max_msg_size = 20
+    reader = FruReader(ipmi)
+    assert reader.read_fru_data() == mmc.fru
+    counts = [count for _, count in fru_reads(ipmi)]
+    # 23 to 11 in steps of 2, then 11 bytes per read
+    assert counts[:7] == [23, 21, 19, 17, 15, 13, 11]
+    assert set(counts[7:-1]) == {11}
+    assert reader.read_size == 11
+    # the size that worked is kept for the next inventory
+    del ipmi.interface.requests[:]
+    reader.read_fru_data()
+    assert fru_reads(ipmi)[0][1] == 11
+
+
+def test_invalid_offset_is_not_backed_off(ipmi, mmc):
+    # the device claims a larger area than it has
+    mmc.handlers[(constants.NETFN_STORAGE,
+                  constants.CMDID_GET_FRU_INVENTORY_AREA_INFO)] = \
+        lambda data: bytes((0, 0, 1, 0))
+    with pytest.raises(CompletionCodeError) as e:
+        FruReader(ipmi).read_fru_data()
+    assert e.value.cc == constants.CC_PARAM_OUT_OF_RANGE
+    # a single attempt at the offset, not one per smaller count
+    assert fru_reads(ipmi)[-1] == (len(mmc.fru), 23)
+    assert fru_reads(ipmi)[-2][0] != len(mmc.fru)
+
+
+def test_empty_read(ipmi, mmc):
+    mmc.handlers[READ_FRU_DATA] = lambda data: bytes((0, 0))
+    with pytest.raises(IOError, match='offset 0'):
+        FruReader(ipmi).read_fru_data()
+
+
+def test_inventory(ipmi):
+    inventory = FruReader(ipmi).get_fru_inventory()
+    assert inventory.product_info_area.manufacturer.string == 'EMULATOR'
+
+
+def test_cache(ipmi, tmp_path):
+    fru_cache = FruCache(str(tmp_path))
+    inventory = fru_cache.get_fru_inventory(ipmi)
+    reads = len(fru_reads(ipmi))
+    cached = fru_cache.get_fru_inventory(ipmi)
+    assert len(fru_reads(ipmi)) == reads
+    assert cached.product_info_area.name.string == \
+        inventory.product_info_area.name.string
+    # a FRU device of its own
+    fru_cache.get_fru_inventory(ipmi, fru_id=1)
+    assert len(fru_reads(ipmi)) == 2 * reads
+    assert len(list(tmp_path.iterdir())) == 2
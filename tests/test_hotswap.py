@@ -0,0 +1,105 @@
+import pytest
+
+from mmctester.hotswap import (STATE_ACTIVATING, STATE_DEACTIVATING,
+                               STATE_OFF, STATE_ON, STATE_UNKNOWN,
+                               HotSwapSequencer, delay_override)
+from mmctester.loop import SelectorLoop
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def loop(clock):
+    loop = SelectorLoop(clock)
+    yield loop
+    loop.close()
+
+
+def run(loop, clock, seconds):
+    '''Advances the clock and runs the timers that became due.'''
+    clock.now += seconds
+    # never waits, even when nothing else is scheduled
+    loop.call_at(clock.now, lambda: None)
+    loop.run_once()
+
+
+def sequencer(loop, **kwargs):
+    entered = []
+    hotswap = HotSwapSequencer(loop.call_later, entered.append, **kwargs)
+    return hotswap, entered
+
+
+def test_activation(loop, clock):
+    hotswap, entered = sequencer(loop)
+    assert hotswap.state is STATE_UNKNOWN
+    hotswap.handle_closed()
+    assert entered == [STATE_ACTIVATING]
+    run(loop, clock, 2.9)
+    assert hotswap.state == STATE_ACTIVATING
+    run(loop, clock, 0.1)
+    assert entered == [STATE_ACTIVATING, STATE_ON]
+    # the handle is already closed
+    hotswap.handle_closed()
+    run(loop, clock, 5)
+    assert entered == [STATE_ACTIVATING, STATE_ON]
+
+
+def test_deactivation_from_unknown(loop, clock):
+    hotswap, entered = sequencer(loop)
+    hotswap.handle_open()
+    run(loop, clock, 3)
+    assert entered == [STATE_DEACTIVATING, STATE_OFF]
+    hotswap.handle_open()
+    assert entered == [STATE_DEACTIVATING, STATE_OFF]
+
+
+def test_quick_open_and_close(loop, clock):
+    hotswap, entered = sequencer(loop)
+    hotswap.handle_closed()
+    run(loop, clock, 1)
+    hotswap.handle_open()
+    run(loop, clock, 1)
+    hotswap.handle_closed()
+    run(loop, clock, 10)
+    # no transition of a cancelled sequence happened
+    assert entered == [STATE_ACTIVATING, STATE_DEACTIVATING,
+                       STATE_ACTIVATING, STATE_ON]
+
+
+def test_cancel(loop, clock):
+    hotswap, entered = sequencer(loop)
+    hotswap.handle_closed()
+    hotswap.cancel()
+    run(loop, clock, 10)
+    assert hotswap.state == STATE_ACTIVATING
+
+
+def test_delays(loop, clock):
+    hotswap, entered = sequencer(
+        loop, delays=dict([delay_override('activating=0.5')]))
+    hotswap.handle_closed()
+    run(loop, clock, 0.5)
+    assert hotswap.state == STATE_ON
+    hotswap.handle_open()
+    run(loop, clock, 0.5)
+    assert hotswap.state == STATE_DEACTIVATING
+    run(loop, clock, 2.5)
+    assert hotswap.state == STATE_OFF
+
+
+def test_delay_override():
+    assert delay_override('deactivating=0') == (STATE_DEACTIVATING, 0.0)
+    for text in ('on=1', 'activating', 'activating=-1'):
+        with pytest.raises(ValueError):
+            delay_override(text)
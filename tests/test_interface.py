@@ -0,0 +1,137 @@
+import select
+
+import pyipmi
+import pytest
+
+from pyipmi.errors import IpmiTimeoutError
+from pyipmi.interfaces.ipmb import checksum
+
+from mmctester.emulator import HS_HANDLE_CLOSED, MMCModel
+from mmctester.interface import MMCTesterBoard
+
+TARGET = pyipmi.Target(0x72)
+NETFN_SENSOR = 0x04
+CMDID_GET_SENSOR_READING = 0x2d
+
+
+def response(request, data):
+    '''IPMB response to a request, completion code OK and data.'''
+    header = bytes((request[3], (request[1] | 4) & 0xff))
+    body = bytes((request[0], request[4], request[5], 0)) + bytes(data)
+    return (header + bytes((checksum(header),)) + body +
+            bytes((checksum(body),)))
+
+
+def sensor_requests(count):
+    return [(TARGET, 0, NETFN_SENSOR, CMDID_GET_SENSOR_READING,
+             bytes((number,))) for number in range(count)]
+
+
+@pytest.fixture
+def board(fake_serial):
+    board = MMCTesterBoard('fake', framing='hex')
+    # do not wait long for what is never answered
+    board.rtt.initial = 0.05
+    board.rtt.min_timeout = 0.05
+    yield board
+    board.close_session()
+
+
+def test_window_and_out_of_order_responses(board):
+    port = board._ser._ser
+    pending = []
+    most_pending = []
+
+    def answer_in_pairs(request):
+        pending.append(request)
+        most_pending.append(len(pending))
+        if len(pending) == 2:
+            for request in reversed(pending):
+                port.reply(response(request, (request[6], 0xc0)))
+            del pending[:]
+
+    port.handle = answer_in_pairs
+    results = board._send_and_receive_many(sensor_requests(6), 2)
+    assert [bytes(result) for result in results] == \
+        [bytes((0, number, 0xc0)) for number in range(6)]
+    assert max(most_pending) == 2
+    assert len(port.requests) == 6
+    # a sequence number per request in flight
+    assert len(set(request[4] for request in port.requests[:2])) == 2
+    assert board.metrics.retries == 0
+
+
+def test_retry_resends_same_sequence_number(board):
+    port = board._ser._ser
+
+    def drop_first_attempt(request):
+        if len(port.requests) > 1:
+            port.reply(response(request, (0x42, 0xc0)))
+
+    port.handle = drop_first_attempt
+    result = board._send_and_receive_many(sensor_requests(1), 1)[0]
+    assert bytes(result) == b'\x00\x42\xc0'
+    assert len(port.requests) == 2
+    assert port.requests[0] == port.requests[1]
+    assert board.metrics.retries == 1
+    assert board.metrics.timeouts == 0
+
+
+def test_late_response_to_first_attempt_accepted(board):
+    port = board._ser._ser
+
+    def answer_first_attempt_late(request):
+        if len(port.requests) > 1:
+            port.reply(response(port.requests[0], (0x42, 0xc0)))
+
+    port.handle = answer_first_attempt_late
+    result = board._send_and_receive_many(sensor_requests(1), 1)[0]
+    assert bytes(result) == b'\x00\x42\xc0'
+
+
+def test_unanswered_request_times_out(board):
+    with pytest.raises(IpmiTimeoutError):
+        board._send_and_receive_many(sensor_requests(2), 2)
+    assert len(board._ser._ser.requests) == 2 * board.max_retries
+    assert board.metrics.timeouts == 1
+    assert board.metrics.abandoned == 1
+
+
+def test_reader_failure_is_not_a_timeout(board):
+    port = board._ser._ser
+    port.error = OSError('device disconnected')
+    board.start_reader()
+    board._reader.join(1)
+    with pytest.raises(IOError, match='Serial reader failed'):
+        board._send_and_receive_many(sensor_requests(1), 1)
+    assert board.metrics.retries == 0
+    assert board.metrics.timeouts == 0
+
+
+def test_reader_thread_wakes_up_waiters(board):
+    port = board._ser._ser
+    port.handle = lambda request: port.reply(response(request, (7, 0xc0)))
+    board.start_reader()
+    assert port.timeout == 0.1
+    result = board._send_and_receive_many(sensor_requests(3), 3)
+    assert [bytes(r) for r in result] == [b'\x00\x07\xc0'] * 3
+    board.stop_reader()
+    assert port.timeout == board.timeout
+
+
+def test_reader_thread_signals_frames(board):
+    port = board._ser._ser
+    board.start_reader()
+    assert board.fileno() != port.fileno()
+    assert board.receive_and_ack_event(0) is None
+    port.reply(MMCModel().set_handle(HS_HANDLE_CLOSED))
+    assert select.select([board.fileno()], [], [], 1)[0]
+    board.drain_wakeup()
+    assert not select.select([board.fileno()], [], [], 0)[0]
+    event = board.receive_and_ack_event(1)
+    assert event.event_data[0] == HS_HANDLE_CLOSED
+    # the acknowledge went back to the MMC
+    ack = port.requests[-1]
+    assert ack[1] >> 2 == event.netfn | 1
+    board.stop_reader()
+    assert board.fileno() == port.fileno()
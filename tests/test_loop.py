@@ -0,0 +1,81 @@
+import os
+import time
+
+import pytest
+
+from mmctester.loop import SelectorLoop
+
+
+@pytest.fixture
+def loop():
+    loop = SelectorLoop()
+    yield loop
+    loop.close()
+
+
+def test_timers_run_in_order(loop):
+    calls = []
+    now = loop.clock()
+    loop.call_at(now + 0.02, calls.append, 'second')
+    loop.call_at(now + 0.01, calls.append, 'first')
+    loop.call_at(now + 0.02, calls.append, 'third')
+    loop.call_later(0.03, loop.stop)
+    loop.run_forever()
+    assert calls == ['first', 'second', 'third']
+    assert loop.clock() - now >= 0.03
+
+
+def test_cancelled_timer(loop):
+    calls = []
+    loop.call_later(0, calls.append, 'cancelled').cancel()
+    loop.call_later(0.01, loop.stop)
+    loop.run_forever()
+    assert calls == []
+
+
+def test_sleeps_until_timer(loop):
+    started = time.monotonic()
+    loop.call_later(0.05, lambda: None)
+    loop.run_once()
+    assert time.monotonic() - started >= 0.05
+
+
+def test_reader(loop):
+    rfd, wfd = os.pipe()
+    received = []
+
+    def on_readable(fd):
+        received.append(os.read(fd, 10))
+        if len(received) == 2:
+            loop.stop()
+
+    loop.add_reader(rfd, on_readable, rfd)
+    loop.call_later(0.01, os.write, wfd, b'a')
+    loop.call_later(0.02, os.write, wfd, b'b')
+    started = time.monotonic()
+    loop.run_forever()
+    # woken up by the file, not by a timeout
+    assert time.monotonic() - started < 0.5
+    assert received == [b'a', b'b']
+    loop.remove_reader(rfd)
+    os.write(wfd, b'c')
+    loop.call_later(0.01, lambda: None)
+    loop.run_once()
+    assert received == [b'a', b'b']
+    os.close(rfd)
+    os.close(wfd)
+
+
+def test_timer_scheduled_by_callback(loop):
+    calls = []
+
+    def tick(count):
+        calls.append(count)
+        if count < 3:
+            loop.call_later(0, tick, count + 1)
+        else:
+            loop.stop()
+
+    loop.call_later(0, tick, 1)
+    loop.run_forever()
+    assert calls == [1, 2, 3]
@@ -0,0 +1,103 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mmctester.mch import AMC_CHANNEL, MchSessionPool, bridged_target
+
+
+class Session(object):
+    '''RMCP interface of a session, answering after a delay.'''
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.closed = False
+
+    def send_and_receive(self, req):
+        with self.counter.lock:
+            self.counter.in_flight += 1
+            self.counter.most = max(self.counter.most,
+                                    self.counter.in_flight)
+        time.sleep(0.01)
+        with self.counter.lock:
+            self.counter.in_flight -= 1
+        return (self, req)
+
+    def close_session(self):
+        self.closed = True
+
+    def close(self):
+        pass
+
+
+class Counter(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.most = 0
+        self.hosts = []
+
+    def connect(self, host):
+        self.hosts.append(host)
+        return Session(self)
+
+
+@pytest.fixture
+def counter():
+    return Counter()
+
+
+def test_bridged_target():
+    target = bridged_target(0x7a)
+    assert target.ipmb_address == 0x7a
+    assert target.routing[-1].rs_sa == 0x7a
+    assert target.routing[-1].channel is None
+    assert target.routing[-2].channel == AMC_CHANNEL
+
+
+def test_window(counter):
+    pool = MchSessionPool('mch', 2, counter.connect)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(pool.send_and_receive, range(16)))
+    assert [req for _, req in responses] == list(range(16))
+    assert counter.most == 2
+    assert pool.opened == 2
+    assert counter.hosts == ['mch', 'mch']
+    # every request went through one of the two sessions
+    assert len(set(session for session, _ in responses)) == 2
+
+
+def test_sessions_reused(counter):
+    pool = MchSessionPool('mch', 4, counter.connect)
+    first, _ = pool.send_and_receive(1)
+    second, _ = pool.send_and_receive(2)
+    assert first is second
+    assert pool.opened == 1
+    responses = pool.send_and_receive_many([3, 4, 5])
+    assert [session for session, _ in responses] == [first] * 3
+
+
+def test_failed_connect_frees_its_slot(counter):
+    connects = []
+
+    def connect(host):
+        connects.append(host)
+        if len(connects) == 1:
+            raise OSError('unreachable')
+        return counter.connect(host)
+
+    pool = MchSessionPool('mch', 1, connect)
+    with pytest.raises(OSError):
+        pool.send_and_receive(1)
+    assert pool.opened == 0
+    assert pool.send_and_receive(2)[1] == 2
+    assert pool.opened == 1
+
+
+def test_close(counter):
+    pool = MchSessionPool('mch', 2, counter.connect)
+    session, _ = pool.send_and_receive(1)
+    pool.close()
+    assert session.closed
@@ -0,0 +1,114 @@
+import pytest
+
+from mmctester.interface import BoardProtocol
+from mmctester.metrics import (LATENCY_BUCKETS, Histogram, MeteredSerial,
+                               TextfileExporter, metrics_lines,
+                               prometheus_text)
+
+
+class Port(object):
+    def __init__(self, data=b''):
+        self.data = data
+        self.timeout = 1.0
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+        return len(data)
+
+    def read(self, size=1):
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+    def read_until(self, terminator=b'\n'):
+        end = self.data.find(terminator) + 1
+        data, self.data = self.data[:end], self.data[end:]
+        return data
+
+
+@pytest.fixture
+def board():
+    board = BoardProtocol(0x20, 16)
+    board._ser = MeteredSerial(Port(b'00\n20 00\n'), board.metrics)
+    return board
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1.0))
+    assert histogram.quantile(0.5) is None
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.sum == pytest.approx(2.65)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(1) == float('inf')
+
+
+def test_metered_serial(board):
+    ser = board._ser
+    ser.write(b'00\n')
+    assert ser.read_until() == b'00\n'
+    assert ser.read(3) == b'20 '
+    snapshot = board.metrics_snapshot()
+    assert snapshot['frames_sent'] == 1
+    assert snapshot['bytes_sent'] == 3
+    assert snapshot['bytes_received'] == 6
+    assert snapshot['read_seconds']['count'] == 2
+    # the reader thread shortens the timeout of the port itself
+    ser.timeout = 0.1
+    assert ser._ser.timeout == 0.1
+
+
+def test_snapshot_counts_queue(board):
+    board._recv_queue.push(b'\x99')
+    board._recv_queue.push(b'\x00\x01\x80')
+    board.metrics.retries = 2
+    snapshot = board.metrics_snapshot()
+    assert snapshot['frames_received'] == 2
+    assert snapshot['unknown_messages'] == 1
+    assert snapshot['queue_depth'] == 2
+    assert snapshot['retries'] == 2
+    assert snapshot['rtt'] == []
+
+
+def test_prometheus_text(board):
+    board.metrics.timeouts = 3
+    board.metrics.request_seconds.observe(0.003)
+    board.metrics.request_seconds.observe(5)
+    board.rtt.get(0x72, 0x04, 0x2d).observe(0.02)
+    text = prometheus_text(board.metrics_snapshot(), {'board': 'a'})
+    lines = text.splitlines()
+    assert '# TYPE mmctester_timeouts_total counter' in lines
+    assert 'mmctester_timeouts_total{board="a"} 3' in lines
+    assert 'mmctester_queue_depth{board="a"} 0' in lines
+    # cumulative buckets
+    assert 'mmctester_request_seconds_bucket{board="a",le="0.0025"} 0' \
+        in lines
+    assert 'mmctester_request_seconds_bucket{board="a",le="0.005"} 1' \
+        in lines
+    assert 'mmctester_request_seconds_bucket{board="a",le="+Inf"} 2' \
+        in lines
+    assert 'mmctester_request_seconds_count{board="a"} 2' in lines
+    assert len([line for line in lines
+                if line.startswith('mmctester_read_seconds_bucket')]) == \
+        len(LATENCY_BUCKETS) + 1
+    assert ('mmctester_rtt_smoothed_seconds{board="a",target="0x72",'
+            'netfn="0x04",cmd="0x2d"} 0.02') in lines
+    assert text.endswith('\n')
+
+
+def test_metrics_lines(board):
+    board.rtt.get(0x72, 0x04, 0x2d).observe(0.02)
+    lines = metrics_lines(board)
+    assert lines[0].startswith('Frames tx 0 rx 0')
+    assert lines[-1] == ('RTT 0x72 netfn 0x04 cmd 0x2d srtt 20.0ms var '
+                         '10.0ms timeout 100ms, 1 samples, 0 timeouts')
+
+
+def test_textfile_exporter(board, tmp_path):
+    path = tmp_path / 'mmctester.prom'
+    TextfileExporter(str(path), board, {'board': 'a'}).write()
+    assert path.read_text() == prometheus_text(board.metrics_snapshot(),
+                                               {'board': 'a'})
+    assert [p.name for p in tmp_path.iterdir()] == ['mmctester.prom']
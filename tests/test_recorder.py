@@ -0,0 +1,116 @@
+import io
+import math
+
+import pytest
+
+from pyipmi.sdr import SdrCompactSensorRecord, SdrFullSensorRecord
+
+from mmctester.emulator import EmulatedSensor
+from mmctester.recorder import (Recorder, Recording, export_csv,
+                                summarize)
+
+TEMP = 1
+HOTSWAP = 2
+
+
+@pytest.fixture
+def sdrs():
+    temp = EmulatedSensor(TEMP, 'Temp', None, m=5, k2=-1)
+    hotswap = EmulatedSensor(HOTSWAP, 'Hot Swap', None, sensor_type=0xf2,
+                             compact=True)
+    return [SdrFullSensorRecord(temp.sdr(0, 0x72)),
+            SdrCompactSensorRecord(hotswap.sdr(1, 0x72))]
+
+
+def record(path, sdrs, readings, chunk_size=3):
+    with Recorder(str(path), sdrs, target=0x72,
+                  chunk_size=chunk_size) as recorder:
+        for reading in readings:
+            recorder.record(*reading)
+    assert recorder.count == len(readings)
+
+
+READINGS = [
+    (1.0, TEMP, 40, 0x00c0),
+    (1.5, HOTSWAP, 3, 0x0010),
+    (2.0, TEMP, 42, None),
+    (2.5, HOTSWAP, None, 0x0008),
+    (3.0, TEMP, None, None),
+    (3.5, TEMP, 44, 0x00c0),
+    (4.0, TEMP, 255, 0x00c0),
+]
+
+
+def test_round_trip(tmp_path, sdrs):
+    path = tmp_path / 'readings.mmcr'
+    record(path, sdrs, READINGS)
+    with Recording(str(path)) as recording:
+        assert recording.metadata['target'] == 0x72
+        assert [bytes(s.data) for s in recording.sdrs] == \
+            [bytes(s.data) for s in sdrs]
+        # two full chunks and a partial one
+        assert len(recording._chunks) == 3
+        assert len(recording) == len(READINGS)
+        assert list(recording.readings()) == READINGS
+        assert sorted(recording.luts) == [TEMP]
+
+
+def test_series(tmp_path, sdrs):
+    path = tmp_path / 'readings.mmcr'
+    record(path, sdrs, READINGS)
+    with Recording(str(path)) as recording:
+        times = []
+        values = []
+        for chunk_times, chunk_values in recording.series(TEMP):
+            times.extend(chunk_times)
+            values.extend(chunk_values)
+        assert times == [1.0, 2.0, 3.0, 3.5, 4.0]
+        assert values[:2] == [pytest.approx(20), pytest.approx(21)]
+        assert math.isnan(values[2])
+        assert values[3:] == [pytest.approx(22), pytest.approx(127.5)]
+        # no lut, the raw values
+        hotswap = sum((list(v) for _, v in recording.series(HOTSWAP)), [])
+        assert hotswap[0] == 3.0
+        assert math.isnan(hotswap[1])
+
+
+def test_truncated_chunk_ignored(tmp_path, sdrs):
+    path = tmp_path / 'readings.mmcr'
+    record(path, sdrs, READINGS)
+    data = path.read_bytes()
+    path.write_bytes(data[:-4])
+    with Recording(str(path)) as recording:
+        assert list(recording.readings()) == READINGS[:6]
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / 'readings.mmcr'
+    path.write_bytes(bytes(64))
+    with pytest.raises(ValueError, match='Not a recording'):
+        Recording(str(path))
+
+
+def test_export_csv(tmp_path, sdrs):
+    path = tmp_path / 'readings.mmcr'
+    record(path, sdrs, READINGS)
+    output = io.StringIO()
+    with Recording(str(path)) as recording:
+        export_csv(recording, output, ['Temp'])
+    lines = output.getvalue().splitlines()
+    assert lines[0] == 'time,sensor,raw,value,states'
+    assert lines[1] == '1.000,Temp,40,20,0x00c0'
+    assert lines[3] == '3.000,Temp,,,'
+    assert len(lines) == 6
+
+
+def test_summary(tmp_path, sdrs):
+    path = tmp_path / 'readings.mmcr'
+    record(path, sdrs, READINGS)
+    with Recording(str(path)) as recording:
+        temp, hotswap = summarize(recording)
+    assert temp.count == 5
+    assert temp.missing == 1
+    assert temp.line() == ('Temp: 5 readings, min=20 max=127.5 '
+                           'mean=47.625, 1 without value, '
+                           '0 state changes, 3.0s')
+    assert hotswap.state_changes == 1
@@ -0,0 +1,94 @@
+import json
+import sys
+
+from xml.etree import ElementTree
+
+import pytest
+
+from mmctester.results import (CheckResult, Suite, latency_stats,
+                               text_output, write_json, write_junit)
+
+
+@pytest.fixture
+def suites():
+    results = [
+        CheckResult('Get Device ID', True, duration=0.5, retries=0,
+                    attempts=3, latencies=[0.03, 0.01, 0.02]),
+        CheckResult('Get Sensor Reading', False, 'out of range',
+                    duration=0.25, completion_code=0xc9, attempts=2,
+                    failures=1, latencies=[0.04]),
+        CheckResult('FRU', None, 'no FRU'),
+    ]
+    return [Suite('0x72', results, {'port': '/dev/ttyUSB0'})]
+
+
+def test_latency_stats():
+    assert latency_stats([]) is None
+    stats = latency_stats([i / 100 for i in range(100, 0, -1)])
+    assert stats['min'] == 0.01
+    assert stats['max'] == 1.0
+    assert stats['median'] == pytest.approx(0.505)
+    assert stats['mean'] == pytest.approx(0.505)
+    # nearest rank
+    assert stats['p95'] == 0.95
+    assert stats['p99'] == 0.99
+    assert latency_stats([0.5])['p99'] == 0.5
+
+
+def test_status():
+    assert [r.status for r in (CheckResult('a', True),
+                               CheckResult('b', False),
+                               CheckResult('c', None))] == \
+        ['pass', 'fail', 'skip']
+
+
+def test_json(tmp_path, suites):
+    path = tmp_path / 'results.json'
+    write_json(str(path), suites)
+    document = json.loads(path.read_text())
+    suite, = document['suites']
+    assert suite['name'] == '0x72'
+    assert suite['properties'] == {'port': '/dev/ttyUSB0'}
+    checks = suite['checks']
+    assert [c['status'] for c in checks] == ['pass', 'fail', 'skip']
+    assert checks[0]['latency']['median'] == 0.02
+    assert checks[1]['completion_code'] == 0xc9
+    assert checks[2]['latency'] is None
+
+
+def test_junit(tmp_path, suites):
+    path = tmp_path / 'results.xml'
+    write_junit(str(path), suites)
+    root = ElementTree.parse(str(path)).getroot()
+    suite, = root
+    assert suite.get('tests') == '3'
+    assert suite.get('failures') == '1'
+    assert suite.get('skipped') == '1'
+    assert suite.get('time') == '0.750000'
+    assert suite.find('properties/property').attrib == \
+        {'name': 'port', 'value': '/dev/ttyUSB0'}
+    passed, failed, skipped = suite.findall('testcase')
+    assert passed.find('failure') is None
+    assert passed.find('system-out').text.startswith(
+        'attempts=3 failures=0 retries=0 min=10.0ms median=20.0ms')
+    assert failed.find('failure').get('message') == \
+        'out of range (cc=0xc9)'
+    assert skipped.find('skipped').get('message') == 'no FRU'
+    assert skipped.find('system-out') is None
+
+
+def test_standard_output(capsys, suites):
+    write_json('-', suites)
+    assert json.loads(capsys.readouterr().out)['suites'][0]['name'] == \
+        '0x72'
+    write_junit('-', suites)
+    assert capsys.readouterr().out.startswith("<?xml version='1.0'")
+    assert not sys.stdout.closed
+
+
+def test_text_output():
+    assert text_output(None, 'results.json') is sys.stdout
+    # the results go to the standard output, the report elsewhere
+    assert text_output('-', None) is sys.stderr
+    with pytest.raises(SystemExit):
+        text_output('-', '-')
@@ -0,0 +1,104 @@
+import pytest
+
+from mmctester.rtt import (BACKOFF_BASE, INITIAL_TIMEOUT, MAX_BACKOFF,
+                           MAX_TIMEOUT, MIN_TIMEOUT, RTT_ALPHA, RTT_BETA,
+                           RttEstimator, RttTable)
+
+
+def test_first_sample():
+    rtt = RttEstimator()
+    assert rtt.timeout == INITIAL_TIMEOUT
+    rtt.observe(0.2)
+    assert rtt.srtt == 0.2
+    assert rtt.rttvar == 0.1
+    assert rtt.timeout == pytest.approx(0.6)
+
+
+def test_smoothing():
+    rtt = RttEstimator()
+    rtt.observe(0.2)
+    rtt.observe(0.4)
+    rttvar = 0.1 + RTT_BETA * (0.2 - 0.1)
+    srtt = 0.2 + RTT_ALPHA * 0.2
+    assert rtt.rttvar == pytest.approx(rttvar)
+    assert rtt.srtt == pytest.approx(srtt)
+    assert rtt.timeout == pytest.approx(srtt + 4 * rttvar)
+    assert rtt.samples == 2
+
+
+def test_timeout_clamped():
+    rtt = RttEstimator()
+    rtt.observe(0.001)
+    assert rtt.timeout == MIN_TIMEOUT
+    rtt = RttEstimator()
+    rtt.observe(3)
+    assert rtt.timeout == MAX_TIMEOUT
+
+
+def test_answered_after_retry_doubles():
+    rtt = RttEstimator()
+    rtt.observe(0.01)
+    rtt.answered_after_retry(rtt.samples)
+    assert rtt.timeout == 2 * MIN_TIMEOUT
+    # another request was answered in time since, this one was lost
+    samples = rtt.samples
+    rtt.observe(0.01)
+    rtt.answered_after_retry(samples)
+    assert rtt.timeout == MIN_TIMEOUT
+    for _ in range(10):
+        rtt.answered_after_retry(rtt.samples)
+    assert rtt.timeout == MAX_TIMEOUT
+
+
+def test_timed_out_doubles():
+    rtt = RttEstimator()
+    rtt.observe(0.01)
+    assert rtt.timed_out(MIN_TIMEOUT) == 2 * MIN_TIMEOUT
+    assert rtt.timeout == 2 * MIN_TIMEOUT
+    # concurrent attempts do not compound the timeout of the estimator
+    assert rtt.timed_out(MIN_TIMEOUT) == 2 * MIN_TIMEOUT
+    assert rtt.timeout == 2 * MIN_TIMEOUT
+    assert rtt.timed_out(4) == MAX_TIMEOUT
+    assert rtt.timeouts == 3
+    # until the next measurement
+    rtt.observe(0.01)
+    assert rtt.timeout == MIN_TIMEOUT
+
+
+def test_slow_request_after_fast_traffic():
+    rtt = RttEstimator()
+    for _ in range(20):
+        rtt.observe(0.008)
+    assert rtt.timeout == MIN_TIMEOUT
+    # a request taking 0.4s, sent 3 times, is answered in the last attempt
+    samples = rtt.samples
+    timeout = rtt.timeout
+    sent = 0
+    for _ in range(2):
+        sent += timeout
+        timeout = rtt.timed_out(timeout)
+    assert sent + timeout > 0.4
+    rtt.answered_after_retry(samples)
+    # and the next one is measured at its first attempt
+    assert rtt.timeout > 0.4
+
+
+@pytest.mark.parametrize('retries', range(1, 10))
+def test_backoff_bounds(retries):
+    limit = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (retries - 1))
+    for _ in range(20):
+        assert limit / 2 <= RttEstimator().backoff(retries) <= limit
+
+
+def test_table_per_command():
+    table = RttTable(min_timeout=0.2)
+    sensor = table.get(0x72, 0x04, 0x2d)
+    assert table.get(0x72, 0x05, 0x2d) is sensor
+    assert table.get(0x72, 0x0a, 0x23) is not table.get(0x72, 0x0a, 0x11)
+    assert table.get(0x74, 0x04, 0x2d) is not sensor
+    sensor.observe(0.01)
+    assert sensor.timeout == 0.2
+    assert [(e['target'], e['netfn'], e['cmdid'])
+            for e in table.snapshot()] == \
+        [(0x72, 0x04, 0x2d), (0x72, 0x0a, 0x11), (0x72, 0x0a, 0x23),
+         (0x74, 0x04, 0x2d)]
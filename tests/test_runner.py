@@ -0,0 +1,143 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from pyipmi.msgs import constants
+
+from mmctester import runner
+from mmctester.results import CheckResult
+from mmctester.runner import (STATUS_ERROR, STATUS_FAIL, STATUS_PASS,
+                              STATUS_TIMEOUT, BoardReport, board_spec,
+                              report_suite, run_board, run_boards,
+                              worker_groups)
+
+GET_DEVICE_GUID = (constants.NETFN_APP, constants.CMDID_GET_DEVICE_GUID)
+GET_SENSOR_READING = (constants.NETFN_SENSOR_EVENT,
+                      constants.CMDID_GET_SENSOR_READING)
+
+
+def test_board_spec():
+    assert board_spec('/dev/ttyACM0') == ('/dev/ttyACM0', 0xa2)
+    assert board_spec('192.168.1.2:0x7a') == ('192.168.1.2', 0x7a)
+    with pytest.raises(ValueError):
+        board_spec(':0x7a')
+
+
+def test_worker_groups():
+    boards = [('/dev/ttyACM0', 0xa2), ('10.0.0.1', 0x72),
+              ('/dev/ttyACM1', 0xa2), ('10.0.0.1', 0x74)]
+    assert worker_groups(boards) == [
+        [('/dev/ttyACM0', 0xa2)],
+        [('10.0.0.1', 0x72), ('10.0.0.1', 0x74)],
+        [('/dev/ttyACM1', 0xa2)]]
+
+
+def test_check_board(ipmi):
+    report = run_board('/dev/board', ipmi.target.ipmb_address, 'check', 0,
+                       False, interface=ipmi.interface)
+    assert report.status == STATUS_PASS
+    assert report.count(False) == 0
+    assert 'Get Device ID: OK' in report.log
+
+
+def test_failed_check_fails_board(ipmi, mmc):
+    mmc.handlers[GET_DEVICE_GUID] = \
+        lambda data: bytes((constants.CC_NODE_BUSY,))
+    report = run_board('/dev/board', ipmi.target.ipmb_address, 'check', 0,
+                       False, interface=ipmi.interface)
+    assert report.status == STATUS_FAIL
+    assert report.count(False) == 1
+    assert report.line().startswith('/dev/board 0xa2: FAIL 8 ok, 1 failed')
+
+
+def test_monitor_board(ipmi, mmc):
+    mmc.handlers[GET_SENSOR_READING] = \
+        lambda data: bytes((constants.CC_REQ_DATA_NOT_PRESENT,))
+    report = run_board('/dev/board', ipmi.target.ipmb_address, 'monitor',
+                       0.1, False, interface=ipmi.interface)
+    assert report.status == STATUS_FAIL
+    assert [r.name for r in report.results] == \
+        ['HOTSWAP AMC', 'P12V', 'P3V3', 'TEMP UC']
+    assert all('errors' in r.detail for r in report.results)
+
+
+def test_board_that_can_not_be_run():
+    report = run_board('/dev/mmctester-missing', 0xa2, 'check', 0, False)
+    assert report.status == STATUS_ERROR
+    assert report.detail
+
+
+def fake_run_board(port, target, mode, duration, sdr_cache, repeat=1,
+                   interface=None):
+    if port == '/dev/hung':
+        time.sleep(10)
+    if port == '/dev/crashed':
+        os._exit(3)
+    report = BoardReport(port, target, STATUS_PASS)
+    report.results = [CheckResult('Get Device ID', True)]
+    return report
+
+
+def test_run_boards(monkeypatch):
+    # inherited by the worker processes
+    monkeypatch.setattr(runner, 'run_board', fake_run_board)
+    started = time.monotonic()
+    reports = list(run_boards([('/dev/ok', 0xa2), ('/dev/hung', 0xa2),
+                               ('/dev/crashed', 0xa2)], timeout=1))
+    statuses = [(r.port, r.status) for r in reports]
+    # the hung board did not delay the others
+    assert sorted(statuses[:2]) == [('/dev/crashed', STATUS_ERROR),
+                                    ('/dev/ok', STATUS_PASS)]
+    assert statuses[2] == ('/dev/hung', STATUS_TIMEOUT)
+    assert time.monotonic() - started < 5
+    crashed = next(r for r in reports if r.port == '/dev/crashed')
+    assert crashed.detail == 'Worker exited with code 3'
+
+
+def run_main(monkeypatch, statuses, *args):
+    def fake_run_boards(boards, *args):
+        for port, target in boards:
+            yield BoardReport(port, target, statuses[port])
+
+    monkeypatch.setattr(runner, 'run_boards', fake_run_boards)
+    monkeypatch.setattr(sys, 'argv', ['mmcrunner'] + list(args))
+    runner.main()
+
+
+def test_exit_code(monkeypatch, capsys):
+    statuses = {'/dev/a': STATUS_PASS, '/dev/b': STATUS_FAIL}
+    run_main(monkeypatch, statuses, '--board', '/dev/a')
+    assert 'Summary:\n/dev/a 0xa2: PASS' in capsys.readouterr().out
+    with pytest.raises(SystemExit) as e:
+        run_main(monkeypatch, statuses, '--board', '/dev/a', '--board',
+                 '/dev/b')
+    assert e.value.code == 1
+    with pytest.raises(SystemExit) as e:
+        run_main(monkeypatch, statuses)
+    assert e.value.code == 'No boards to run'
+
+
+def test_report_suite():
+    report = BoardReport('/dev/a', 0xa2, STATUS_TIMEOUT, 'No result')
+    report.results = [CheckResult('Get Device ID', True)]
+    suite = report_suite(report)
+    assert suite.name == '/dev/a 0xa2'
+    assert suite.properties['status'] == STATUS_TIMEOUT
+    # the board that could not finish fails its suite
+    assert [(r.name, r.ok) for r in suite.results] == \
+        [('Get Device ID', True), ('Run', False)]
+    assert report.results == [report.results[0]]
+    report.status = STATUS_PASS
+    assert len(report_suite(report).results) == 1
+
+
+def test_results_on_standard_output(monkeypatch, capsys):
+    run_main(monkeypatch, {'/dev/a': STATUS_PASS}, '--board', '/dev/a',
+             '--json', '-')
+    captured = capsys.readouterr()
+    suite, = json.loads(captured.out)['suites']
+    assert suite['properties']['port'] == '/dev/a'
+    assert 'Summary:' in captured.err
@@ -0,0 +1,126 @@
+from pyipmi.interfaces.ipmb import checksum
+from pyipmi.msgs import constants
+
+from mmctester.capture import CAPTURE_BLOCK
+from mmctester.rxqueue import (KIND_CAPTURE, KIND_EVENT, KIND_LOCAL,
+                               KIND_OTHER, KIND_RESPONSE, KIND_SCAN,
+                               ReceiveQueue)
+from mmctester.scan import SCAN_RESULT
+
+ADDRESS = 0x20
+MMC_ADDRESS = 0x72
+
+
+def ipmb_frame(netfn, cmdid, seq, data=b'', address=ADDRESS,
+               sender=MMC_ADDRESS):
+    header = bytes((address, netfn << 2))
+    body = bytes((sender, seq << 2, cmdid)) + bytes(data)
+    return (header + bytes((checksum(header),)) + body +
+            bytes((checksum(body),)))
+
+
+def response(cmdid=0x2d, seq=1, data=b'\x00'):
+    return ipmb_frame(constants.NETFN_SENSOR_EVENT | 1, cmdid, seq, data)
+
+
+def event(seq=1):
+    return ipmb_frame(constants.NETFN_SENSOR_EVENT,
+                      constants.CMDID_PLATFORM_EVENT, seq,
+                      b'\x04\xf2\x00\x6f\x00\xff\xff')
+
+
+def test_classify():
+    queue = ReceiveQueue(ADDRESS)
+    assert queue.classify(b'\x00\x05\x80') == (KIND_LOCAL, None)
+    assert queue.classify(bytes((0, SCAN_RESULT, 0x80))) == (KIND_SCAN, None)
+    assert queue.classify(bytes((0, CAPTURE_BLOCK, 0x80))) == \
+        (KIND_CAPTURE, None)
+    assert queue.classify(event()) == (KIND_EVENT, None)
+    assert queue.classify(response(seq=3)) == \
+        (KIND_RESPONSE, (MMC_ADDRESS, constants.NETFN_SENSOR_EVENT | 1,
+                         0x2d, 3))
+    assert queue.classify(ipmb_frame(7, 1, 1, address=0x40)) == \
+        (KIND_OTHER, None)
+    assert queue.classify(b'\x20\x04') == (KIND_OTHER, None)
+    assert queue.invalid == 0
+
+
+def test_classify_invalid_checksum():
+    queue = ReceiveQueue(ADDRESS)
+    data = bytearray(response())
+    data[-1] ^= 0xff
+    assert queue.classify(data) == (KIND_OTHER, None)
+    assert queue.invalid == 1
+
+
+def test_push_and_pop():
+    queue = ReceiveQueue(ADDRESS)
+    frames = [b'\x00\x05\x80', event(), bytes((0, SCAN_RESULT, 0x80)),
+              bytes((0, CAPTURE_BLOCK, 0x80))]
+    for data in frames:
+        queue.push(data)
+    kind, key = queue.push(response())
+    assert kind == KIND_RESPONSE
+    assert len(queue) == 5
+    assert queue.pop_response(key) == response()
+    assert queue.pop_response(key) is None
+    assert queue.pop_local() == frames[0]
+    assert queue.pop_event() == frames[1]
+    assert queue.pop_scan() == frames[2]
+    assert queue.pop_capture() == frames[3]
+    assert queue.pop_event() is None
+    assert len(queue) == 0
+
+
+def test_duplicate_response_replaces_stale_one():
+    queue = ReceiveQueue(ADDRESS)
+    queue.push(response(data=b'\x00\x01'))
+    _, key = queue.push(response(data=b'\x00\x02'))
+    assert len(queue) == 1
+    assert queue.received[KIND_RESPONSE] == 2
+    assert queue.pop_response(key) == response(data=b'\x00\x02')
+    assert queue.overflows == 0
+
+
+def test_eviction_order():
+    queue = ReceiveQueue(ADDRESS, max_size=6)
+    queue.push(event(1))
+    queue.push(b'\x00\x05\x80')
+    queue.push(response(seq=1))
+    queue.push(bytes((0, CAPTURE_BLOCK, 0x80)))
+    queue.push(bytes((0, SCAN_RESULT, 0x80)))
+    queue.push(b'\x99')
+    assert queue.overflows == 0
+
+    evicted = []
+    for seq in range(2, 8):
+        queue.push(event(seq))
+        evicted.append(dict((kind, count) for kind, count
+                            in queue.evicted.items() if count))
+        assert len(queue) == 6
+    assert evicted == [
+        {KIND_OTHER: 1},
+        {KIND_OTHER: 1, KIND_SCAN: 1},
+        {KIND_OTHER: 1, KIND_SCAN: 1, KIND_CAPTURE: 1},
+        {KIND_OTHER: 1, KIND_SCAN: 1, KIND_CAPTURE: 1, KIND_RESPONSE: 1},
+        {KIND_OTHER: 1, KIND_SCAN: 1, KIND_CAPTURE: 1, KIND_RESPONSE: 1,
+         KIND_LOCAL: 1},
+        {KIND_OTHER: 1, KIND_SCAN: 1, KIND_CAPTURE: 1, KIND_RESPONSE: 1,
+         KIND_LOCAL: 1, KIND_EVENT: 1},
+    ]
+    assert queue.overflows == 6
+    assert queue.received[KIND_EVENT] == 7
+    # the oldest event went first
+    assert queue.pop_event() == event(2)
+
+
+def test_pop_unprocessed():
+    queue = ReceiveQueue(ADDRESS)
+    queue.push(b'\x99')
+    queue.push(response(seq=1))
+    queue.push(response(seq=2))
+    queue.push(event())
+    assert queue.pop_unprocessed() == [b'\x99', response(seq=1),
+                                       response(seq=2)]
+    assert len(queue) == 1
+    assert queue.pop_unprocessed() == []
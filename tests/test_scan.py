@@ -0,0 +1,70 @@
+import itertools
+
+import pytest
+
+from pyipmi.msgs import constants
+
+from mmctester.emulator import BoardEmulator
+from mmctester.interface import MMCTesterBoard
+from mmctester.scan import (MAX_SCAN_ENTRIES, decode_scan_result,
+                            is_scan_response, scan_command_args,
+                            scan_request, scan_result)
+
+RQ_SA = 0x20
+
+
+def test_command_args():
+    assert scan_command_args([(0xa2, 1, 0), (0xa2, 2, 5)], 0.3) == \
+        [0x2c, 0x01, 0xa2, 1, 0, 0xa2, 2, 1]
+    with pytest.raises(ValueError):
+        scan_command_args([(0xa2, 1, 0)] * (MAX_SCAN_ENTRIES + 1), 1)
+    with pytest.raises(ValueError):
+        scan_command_args([], 66)
+
+
+def test_result_of_a_reading(mmc):
+    entries = [(mmc.address, 2, 0), (mmc.address, 3, 0)]
+    rsp = mmc.handle_message(scan_request(entries[1], 1, RQ_SA))
+    assert is_scan_response(rsp)
+    frame = scan_result(rsp, entries, 0x1_0000_0123)
+    # as the board sends it, behind the local address
+    result = decode_scan_result(b'\x00' + frame, entries)
+    assert (result.index, result.entry) == (1, entries[1])
+    assert result.completion_code == constants.CC_OK
+    assert result.raw == rsp[7]
+    assert result.timestamp == 0x123
+    # a response to another target or index is not ours
+    assert scan_result(rsp, entries[:1], 0) is None
+    assert scan_result(rsp, [(0x72, 2, 0), (0x72, 3, 0)], 0) is None
+
+
+def test_failed_reading(mmc):
+    mmc.handlers[(constants.NETFN_SENSOR_EVENT,
+                  constants.CMDID_GET_SENSOR_READING)] = \
+        lambda data: bytes((constants.CC_REQ_DATA_NOT_PRESENT,))
+    entries = [(mmc.address, 2, 0)]
+    rsp = mmc.handle_message(scan_request(entries[0], 0, RQ_SA))
+    result = decode_scan_result(b'\x00' + scan_result(rsp, entries, 0),
+                                entries)
+    assert result.completion_code == constants.CC_REQ_DATA_NOT_PRESENT
+    assert (result.raw, result.states) == (None, None)
+
+
+def test_scan_on_emulated_board():
+    emulator = BoardEmulator(seed=1)
+    port = emulator.start()
+    board = MMCTesterBoard(port)
+    try:
+        entries = [(emulator.mmc.address, number, 0) for number in (2, 3)]
+        board.start_scan(entries, 0.05)
+        results = list(itertools.islice(board.scan_results(1), 6))
+        board.stop_scan()
+    finally:
+        board.close_session()
+        emulator.stop()
+        emulator.close()
+    assert [r.index for r in results] == [0, 1] * 3
+    assert all(r.completion_code == constants.CC_OK for r in results)
+    # a sweep every period
+    sweeps = [r.timestamp for r in results[::2]]
+    assert all(45 <= b - a <= 100 for a, b in zip(sweeps, sweeps[1:]))
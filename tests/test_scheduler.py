@@ -0,0 +1,120 @@
+import pytest
+
+from pyipmi.sdr import SdrCommon
+from pyipmi.sensor import SENSOR_TYPE_MODULE_HOT_SWAP
+
+from mmctester.emulator import MMCModel
+from mmctester.scheduler import (INITIAL_READ_COST, MAX_INTERVAL_FACTOR,
+                                 MIN_INTERVAL_FACTOR, PollScheduler,
+                                 interval_override)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class Locator(object):
+    '''A record that is not a sensor.'''
+
+    type = 0x12
+    device_id_string = 'MMC'
+
+
+@pytest.fixture
+def sdrs():
+    mmc = MMCModel()
+    # hot swap every 5s, P12V and P3V3 every 0.5s, TEMP UC every 2s
+    return [SdrCommon.from_data(sdr) for sdr in mmc._sdrs] + [Locator()]
+
+
+def intervals(scheduler):
+    return {s.sdr.device_id_string: s.interval
+            for s in scheduler.schedules.values()}
+
+
+def test_intervals_by_type_and_override(sdrs):
+    scheduler = PollScheduler(sdrs, overrides={'P3V3': 3.0})
+    assert intervals(scheduler) == {'HOTSWAP AMC': 5.0, 'P12V': 0.5,
+                                    'P3V3': 3.0, 'TEMP UC': 2.0}
+    assert len(scheduler.schedules) == 4
+    assert scheduler.readings(0)[4] == (None, None, None)
+
+
+def test_interval_override():
+    assert interval_override('P12V=0.25') == ('P12V', 0.25)
+    assert interval_override('A=B=2') == ('A=B', 2.0)
+    for text in ('P12V', '=1', 'P12V=0', 'P12V=-1'):
+        with pytest.raises(ValueError):
+            interval_override(text)
+
+
+def test_poll_reads_what_is_due(sdrs):
+    clock = Clock()
+    scheduler = PollScheduler(sdrs, budget=1.0, clock=clock)
+    read = []
+
+    def reader(batch):
+        read.append([sdr.device_id_string for sdr in batch])
+        return [(1, 0)] * len(batch)
+
+    assert len(scheduler.poll(reader)) == 4
+    assert scheduler.time_to_next() == 0.5
+    clock.now += 0.5
+    scheduler.poll(reader)
+    assert read[-1] == ['P12V', 'P3V3']
+    # the voltages did not change, they are read every 0.75s now
+    assert scheduler.time_to_next() == 0.75
+    clock.now += 2
+    scheduler.poll(reader)
+    # the temperature is due too, most late first
+    assert read[-1] == ['P12V', 'P3V3', 'TEMP UC']
+    assert scheduler.readings()[0] == (1, 0, 2.5)
+
+
+def test_budget_limits_the_batch(sdrs):
+    scheduler = PollScheduler(sdrs, budget=2 * INITIAL_READ_COST)
+    assert len(scheduler.next_batch(0)) == 2
+    # readings turned out four times slower
+    batch = scheduler.next_batch(0)
+    scheduler.update(batch, [(1, 0)] * 2, 0, 8 * INITIAL_READ_COST)
+    assert scheduler.read_cost == pytest.approx(
+        INITIAL_READ_COST + 3 * INITIAL_READ_COST / 4)
+    # at least one sensor is read
+    assert len(scheduler.next_batch(10)) == 1
+
+
+def test_intervals_adapt_to_changes(sdrs):
+    scheduler = PollScheduler(sdrs, overrides={'P3V3': 3.0})
+    p12v, p3v3 = scheduler.schedules[1], scheduler.schedules[2]
+    now = 0.0
+    for raw in range(10):
+        scheduler.update([p12v, p3v3], [(raw, 0)] * 2, now, now)
+        now += 1
+    assert p12v.interval == 0.5 * MIN_INTERVAL_FACTOR
+    for _ in range(10):
+        scheduler.update([p12v, p3v3], [(9, 0)] * 2, now, now)
+        now += 1
+    assert p12v.interval == 0.5 * MAX_INTERVAL_FACTOR
+    assert p3v3.interval == 3.0
+    assert p12v.next_time == now - 1 + p12v.interval
+
+
+def test_expire(sdrs):
+    clock = Clock()
+    scheduler = PollScheduler(sdrs, budget=1.0, clock=clock)
+    scheduler.poll(lambda batch: [(1, 0)] * len(batch))
+    assert scheduler.next_batch() == []
+    scheduler.expire(SENSOR_TYPE_MODULE_HOT_SWAP)
+    assert [s.sdr.device_id_string for s in scheduler.next_batch()] == \
+        ['HOTSWAP AMC']
+    assert scheduler.time_to_next() == 0.0
+
+
+def test_no_sensors():
+    scheduler = PollScheduler([Locator()])
+    assert scheduler.time_to_next() is None
+    assert scheduler.next_batch(0) == []
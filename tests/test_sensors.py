@@ -0,0 +1,103 @@
+import math
+
+import pytest
+
+from pyipmi.sdr import L_LINEAR, L_LN, SdrCompactSensorRecord, \
+    SdrFullSensorRecord
+
+from mmctester.emulator import EmulatedSensor
+from mmctester.sensors import (THRESHOLD_BITS, SensorLut, alarm_names,
+                               sensor_luts)
+
+# readable: lnc, lcr, unc and ucr, not lnr and unr
+READABLE = 0x1b
+THRESHOLDS = dict(unr=250, ucr=220, unc=200, lnr=5, lcr=10, lnc=20)
+
+
+def full_record(event_reading_type=0x01, reading_mask=READABLE, m=2, k2=-1,
+                linearization=L_LINEAR, data_format=0):
+    body = bytes((
+        0x72, 0, 1,
+        0xc1, 0x00,  # entity id, instance
+        0x7f, 0x68, 0x01, event_reading_type,
+        0x00, 0x00, 0x00, 0x00,  # assertion, deassertion masks
+        reading_mask, reading_mask,  # readable, settable
+        data_format << 6, 0x00, 0x00,  # units
+        linearization,
+        m & 0xff, (m >> 2) & 0xc0,
+        0x00, 0x00, 0x00,  # B, accuracy
+        (k2 & 0xf) << 4,
+        0x00,  # analog characteristics
+        0x00, 0x00, 0x00, 0xff, 0x00,  # nominal, normal, sensor range
+        THRESHOLDS['unr'], THRESHOLDS['ucr'], THRESHOLDS['unc'],
+        THRESHOLDS['lnr'], THRESHOLDS['lcr'], THRESHOLDS['lnc'],
+        0x00, 0x00,  # hysteresis
+        0x00, 0x00, 0x00,  # reserved, oem
+        0xc4)) + b'Temp'
+    return SdrFullSensorRecord(bytes((1, 0, 0x51, 0x01, len(body))) + body)
+
+
+def expected_value(sdr, raw):
+    try:
+        return sdr.convert_sensor_raw_to_value(raw)
+    except (ArithmeticError, ValueError):
+        return None
+
+
+@pytest.mark.parametrize('record', [
+    dict(),
+    dict(m=-3, k2=-2, data_format=SdrFullSensorRecord.DATA_FMT_2S_COMPLEMENT),
+    dict(linearization=L_LN),
+])
+def test_values_match_conversion(record):
+    sdr = full_record(**record)
+    lut = SensorLut(sdr)
+    for raw in range(256):
+        expected = expected_value(sdr, raw)
+        assert lut.value(raw) == expected
+        converted = lut.convert([raw])[0]
+        if expected is None:
+            assert math.isnan(converted)
+        else:
+            assert converted == expected
+    assert lut.value(None) is None
+
+
+def test_threshold_alarms():
+    sdr = full_record()
+    lut = SensorLut(sdr)
+    assert sorted(lut.thresholds) == ['lcr', 'lnc', 'ucr', 'unc']
+    for raw in range(256):
+        expected = 0
+        for name, bit in THRESHOLD_BITS:
+            if not READABLE & (1 << bit):
+                continue
+            if name.startswith('u'):
+                crossed = raw >= THRESHOLDS[name]
+            else:
+                crossed = raw <= THRESHOLDS[name]
+            if crossed:
+                expected |= 1 << bit
+        assert lut.alarms(raw) == expected
+    assert alarm_names(lut.alarms(5)) == ['lnc', 'lcr']
+    assert alarm_names(lut.alarms(100)) == []
+    assert alarm_names(lut.alarms(255)) == ['unc', 'ucr']
+    assert lut.alarms(None) == 0
+
+
+def test_discrete_sensor_has_no_thresholds():
+    sdr = full_record(event_reading_type=0x6f, reading_mask=0x3f)
+    lut = SensorLut(sdr)
+    assert lut.thresholds == {}
+    assert not any(lut.alarms(raw) for raw in range(256))
+    assert lut.value(10) == expected_value(sdr, 10)
+
+
+def test_sensor_luts():
+    full = EmulatedSensor(1, 'Temp', None, m=5, k2=-1)
+    compact = EmulatedSensor(2, 'Hot Swap', None, sensor_type=0xf2,
+                             compact=True)
+    luts = sensor_luts([SdrFullSensorRecord(full.sdr(1, 0x72)),
+                        SdrCompactSensorRecord(compact.sdr(2, 0x72))])
+    assert luts[0].value(10) == pytest.approx(5)
+    assert luts[1] is None
@@ -0,0 +1,99 @@
+import pytest
+
+from mmctester.emulator import BoardEmulator
+from mmctester.soak import (ACTIVATION, DEACTIVATION, OUTLIER_MIN_SAMPLES,
+                            STAGE_EVENT, STAGE_LED, STAGE_SENSOR,
+                            HotSwapSoak, StageStats)
+
+PIN_HS = 2
+PIN_PG = 3
+
+
+def start_emulator(**kwargs):
+    emulator = BoardEmulator(seed=1, **kwargs)
+    emulator.start()
+    return emulator
+
+
+@pytest.fixture
+def emulator():
+    emulator = start_emulator(pin_hs=PIN_HS, pin_pg=PIN_PG)
+    yield emulator
+    emulator.stop()
+    emulator.close()
+
+
+def soak(emulator, **kwargs):
+    return HotSwapSoak(emulator.port, emulator.mmc.address, PIN_HS, PIN_PG,
+                       sdr_cache=False, event_timeout=1, sensor_timeout=1,
+                       settle=0, **kwargs)
+
+
+def test_stage_outliers():
+    stats = StageStats('stage', outlier_factor=3)
+    for cycle in range(OUTLIER_MIN_SAMPLES):
+        stats.observe(cycle, 0.01)
+    stats.observe(11, 0.029)
+    assert stats.outliers == 0
+    stats.observe(12, 0.031)
+    assert stats.outliers == 1
+    stats.miss(13)
+    result = stats.result(13)
+    assert result.status == 'fail'
+    assert (result.attempts, result.failures) == (13, 1)
+    assert len(result.latencies) == 12
+    lines = stats.lines()
+    assert lines[0].startswith('stage: 12 ok, 1 missed, min=10.0ms')
+    assert lines[1:] == ['  <= 10ms: 10', '  <= 50ms: 2']
+
+
+def test_cycles(emulator):
+    hotswap = soak(emulator)
+    try:
+        hotswap.run(3)
+    finally:
+        hotswap.close()
+    assert hotswap.cycles == 3
+    assert (hotswap.missed, hotswap.errors) == (0, 0)
+    assert len(hotswap.stats) == 6
+    for stats in hotswap.stats.values():
+        assert len(stats.latencies) == 3
+    # the emulator sends the event after event_delay
+    event = hotswap.stats[ACTIVATION, STAGE_EVENT].latencies
+    assert min(event) >= emulator.event_delay
+    assert [r.status for r in hotswap.results()] == ['pass'] * 6
+    assert hotswap.lines()[0].startswith('3 cycles in ')
+    assert emulator.pins == {PIN_HS: 0, PIN_PG: 0}
+
+
+def test_missed_events():
+    # the handle pin is not wired to the MMC
+    emulator = start_emulator(pin_pg=PIN_PG)
+    hotswap = soak(emulator)
+    hotswap.event_timeout = 0.1
+    try:
+        hotswap.run(2)
+    finally:
+        hotswap.close()
+        emulator.stop()
+        emulator.close()
+    assert hotswap.missed == 8
+    for direction in (ACTIVATION, DEACTIVATION):
+        assert hotswap.stats[direction, STAGE_EVENT].missed == 2
+        assert hotswap.stats[direction, STAGE_LED].missed == 2
+        assert hotswap.stats[direction, STAGE_SENSOR].missed == 0
+
+
+def test_no_sensors_to_watch(emulator, monkeypatch):
+    closed = []
+    close = HotSwapSoak.close
+
+    def spy(self):
+        closed.append(self)
+        close(self)
+
+    monkeypatch.setattr(HotSwapSoak, 'close', spy)
+    with pytest.raises(ValueError):
+        soak(emulator, pg_sensors=['missing'])
+    # the board is not left open
+    assert len(closed) == 1
@@ -0,0 +1,135 @@
+import pytest
+
+from mmctester import tui
+from mmctester.tui import TuiManager
+
+
+class Window(object):
+    '''Curses window of a terminal, recording the rows written.'''
+
+    def __init__(self, height=10, width=20):
+        self.height = height
+        self.width = width
+        self.written = []
+        self.cleared = []
+        self.keys = []
+        self._y = 0
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def nodelay(self, flag):
+        pass
+
+    def clear(self):
+        pass
+
+    def move(self, y, x):
+        self._y = y
+
+    def clrtoeol(self):
+        self.cleared.append(self._y)
+
+    def addstr(self, y, x, text):
+        self.written.append((y, text.decode()))
+
+    def noutrefresh(self):
+        pass
+
+    def getch(self):
+        return self.keys.pop(0) if self.keys else -1
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def window(monkeypatch):
+    window = Window()
+    monkeypatch.setattr(tui.curses, 'initscr', lambda: window)
+    for name in ('noecho', 'cbreak', 'curs_set', 'doupdate'):
+        monkeypatch.setattr(tui.curses, name, lambda *args: None)
+    return window
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tui.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def screen(window, clock):
+    return TuiManager()
+
+
+def test_draws_only_changed_rows(screen, window):
+    screen.set_section('Sensors', ['P12V 12.0', 'P3V3 3.3'])
+    screen.set_section('Events', ['none'])
+    assert screen.render()
+    assert window.written == [(0, 'Sensors'), (1, 'P12V 12.0'),
+                              (2, 'P3V3 3.3'), (3, '==='), (4, 'Events'),
+                              (5, 'none')]
+    del window.written[:]
+    screen.set_section('Sensors', ['P12V 12.0', 'P3V3 3.2'])
+    assert screen.render(force=True)
+    assert window.written == [(2, 'P3V3 3.2')]
+
+
+def test_unchanged_section_draws_nothing(screen, window):
+    screen.set_section('Sensors', ['P12V 12.0'])
+    screen.render()
+    screen.set_section('Sensors', ('P12V 12.0',))
+    assert not screen.render(force=True)
+    assert screen.pending_delay() is None
+
+
+def test_frames_limited(screen, window, clock):
+    screen.set_section('Sensors', ['P12V 12.0'])
+    assert screen.render()
+    clock.now += 0.01
+    screen.set_section('Sensors', ['P12V 11.9'])
+    # too close to the previous frame
+    assert not screen.render()
+    assert screen.pending_delay() == pytest.approx(
+        screen.min_frame_interval - 0.01)
+    clock.now += screen.min_frame_interval
+    assert screen.pending_delay() == 0.0
+    assert screen.render()
+    assert window.written[-1] == (1, 'P12V 11.9')
+    assert screen.pending_delay() is None
+
+
+def test_shorter_layout_clears_rows(screen, window):
+    screen.set_section('Sensors', ['a', 'b', 'c'])
+    screen.render()
+    del window.cleared[:]
+    screen.set_section('Sensors', ['a'])
+    screen.render(force=True)
+    assert window.cleared == [2, 3]
+
+
+def test_long_lines_wrapped_and_cut(screen, window):
+    screen.set_section('Log', ['x' * 30] + ['line'] * 20)
+    screen.render()
+    assert window.written[1:3] == [(1, 'x' * 20), (2, 'x' * 10)]
+    assert len(window.written) == window.height
+
+
+def test_resize_redraws_everything(screen, window):
+    screen.set_section('Sensors', ['P12V 12.0'])
+    screen.render()
+    del window.written[:]
+    resized = []
+    screen.add_draw_callback(lambda: resized.append(True))
+    window.keys = [tui.curses.KEY_RESIZE]
+    screen.process_events()
+    assert resized == [True]
+    assert screen.render()
+    assert window.written == [(0, 'Sensors'), (1, 'P12V 12.0')]